@@ -1,9 +1,12 @@
 #! /usr/bin/env python3
 # Author: Martin Kacmarcik
+import gzip
 import locale
 import os
+import shutil
 import signal
 import sys
+import tempfile
 from datetime import datetime
 from itertools import groupby
 from pathlib import Path
@@ -13,9 +16,7 @@ from typing import Union
 
 import pysftp
 from dialog import Dialog
-from gevent import joinall
 from paramiko.ssh_exception import SSHException
-from pssh.clients.native.parallel import ParallelSSHClient
 
 from plbmng.executor import PlbmngJob
 from plbmng.executor import PlbmngJobResult
@@ -23,13 +24,14 @@ from plbmng.executor import PlbmngJobState
 from plbmng.executor import time_from_timestamp
 from plbmng.lib.database import PlbmngDb
 from plbmng.lib.library import clear
+from plbmng.lib.library import copy_directory
 from plbmng.lib.library import copy_files
 from plbmng.lib.library import delete_jobs
+from plbmng.lib.library import fetch_remote_jobs
 from plbmng.lib.library import get_all_jobs
 from plbmng.lib.library import get_all_nodes
 from plbmng.lib.library import get_last_server_access
 from plbmng.lib.library import get_non_stopped_jobs
-from plbmng.lib.library import get_remote_jobs
 from plbmng.lib.library import get_server_info
 from plbmng.lib.library import get_stopped_jobs
 from plbmng.lib.library import jobs_downloaded_artefacts
@@ -41,15 +43,19 @@ from plbmng.lib.library import OPTION_KERNEL
 from plbmng.lib.library import OPTION_MEM
 from plbmng.lib.library import OPTION_PYTHON
 from plbmng.lib.library import plot_servers_on_map
+from plbmng.lib.library import relay_files
 from plbmng.lib.library import run_remote_command
+from plbmng.lib.library import schedule_jobs
 from plbmng.lib.library import schedule_remote_command
 from plbmng.lib.library import search_by_location
 from plbmng.lib.library import search_by_regex
 from plbmng.lib.library import search_by_sware_hware
 from plbmng.lib.library import server_choices
+from plbmng.lib.library import sync_files
 from plbmng.lib.library import update_availability_database_parent
 from plbmng.lib.library import verify_api_credentials_exist
 from plbmng.lib.library import verify_ssh_credentials_exist
+from plbmng.lib.relay import RelayCredentialsError
 from plbmng.utils.config import first_run
 from plbmng.utils.config import get_db_path
 from plbmng.utils.config import get_remote_jobs_path
@@ -151,6 +157,7 @@ class Engine:
                     ("5", "Refresh jobs state"),
                     ("6", "Job artefacts"),
                     ("7", "Clean up jobs"),
+                    ("8", "Schedule batch of remote jobs"),
                 ],
                 title="Remote execution menu",
             )
@@ -169,6 +176,8 @@ class Engine:
                     self.job_artefacts_menu()
                 elif tag == "7":
                     self.job_cleanup_menu()
+                elif tag == "8":
+                    self.schedule_batch()
             else:
                 return None
 
@@ -290,21 +299,27 @@ class Engine:
         while True:
             code, tag = self.d.menu(
                 "Choose one of the following options:",
-                choices=[("1", "Update server list"), ("2", "Update server status")],
+                choices=[
+                    ("1", "Update server list"),
+                    ("2", "Update server status"),
+                    ("3", "Rebuild server list"),
+                ],
                 title="Monitoring menu",
                 height=0,
                 width=0,
             )
             if code == self.d.OK:
-                if tag == "1":
-                    if self.d.yesno("This is going to take around 20 minutes") == self.d.OK:
+                if tag in ("1", "3"):
+                    if self.d.yesno("This is going to take several minutes") == self.d.OK:
                         try:
-                            get_all_nodes()
+                            delta = get_all_nodes(incremental=tag == "1")
                         except NeedToFillPasswdFirstInfo:
                             self.d.msgbox(
                                 "Error! Your Planetlab credentials are not set. "
                                 "Please use 'Set credentials' option in main menu to set them."
                             )
+                            continue
+                        self.update_changed_servers(delta)
                     else:
                         continue
                 elif tag == "2":
@@ -317,14 +332,40 @@ class Engine:
                             continue
                         else:
                             nodes = self.db.get_nodes()
-                            self.db.close()
-                            update_availability_database_parent(dialog=self.d, nodes=nodes)
-                            self.db.connect()
+                            update_availability_database_parent(dialog=self.d, db=self.db, nodes=nodes)
                     else:
                         continue
             else:
                 return None
 
+    def update_changed_servers(self, delta: dict) -> None:
+        """
+        Offer to update status of the servers added or changed by the server list update.
+
+        :param delta: Dictionary with ``added``, ``changed`` and ``removed`` lists of hostnames.
+        """
+        if not delta:
+            self.d.msgbox("Error! Server list could not be updated.")
+            return
+        changed = set(delta.get("added", []) + delta.get("changed", []))
+        text = (
+            f"Server list has been updated: {len(delta.get('added', []))} added, "
+            f"{len(delta.get('changed', []))} changed, {len(delta.get('removed', []))} removed."
+        )
+        if not changed:
+            self.d.msgbox(text)
+            return
+        if self.d.yesno(f"{text}\nDo you want to update status of the added and changed servers?") != self.d.OK:
+            return
+        if not verify_ssh_credentials_exist():
+            self.d.msgbox(
+                "Error! Your ssh credentials are not set. "
+                "Please use 'Set credentials' option in main menu to set them."
+            )
+            return
+        nodes = [node for node in self.db.get_nodes(False) if node["dns"] in changed]
+        update_availability_database_parent(dialog=self.d, db=self.db, nodes=nodes)
+
     def pick_date(self) -> datetime:
         """
         Menu to pick date and time.
@@ -363,13 +404,21 @@ class Engine:
             self.d.msgbox("You did not select any servers!")
             return None
 
-        ret = run_remote_command(self.d, remote_cmd, servers)
+        results = run_remote_command(self.d, remote_cmd, servers)
+        failures = {host: result for host, result in results.items() if result.return_code != 0}
 
-        if ret:
-            self.d.msgbox("Command was run successfully!")
+        if not failures:
+            self.d.msgbox(f"Command was run successfully on all {len(results)} servers!")
             return None
-        self.d.msgbox("There was an error running the command.")
-        # TODO: Print more meaningful message to the user, containing the error.
+        text = f"Command failed on {len(failures)} of {len(results)} servers:\n\n"
+        for host, result in sorted(failures.items()):
+            if result.stderr is None:
+                error = f"see {result.stderr_file}"
+            else:
+                error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+            exit_code = "none" if result.return_code is None else result.return_code
+            text += f"{host} (exit code {exit_code}, {result.duration} s): {error}\n"
+        self.d.scrollbox(text)
         return None
 
     def schedule_remote_cmd(self) -> None:
@@ -396,9 +445,57 @@ class Engine:
             self.d.msgbox("You did not select any servers!")
             return None
 
-        # TODO: handle exceptions here
-        schedule_remote_command(remote_cmd, date, servers, self.db)
-        self.d.msgbox("Command scheduled successfully.")
+        results = schedule_remote_command(remote_cmd, date, servers, self.db)
+        failures = {host: error for host, error in results.items() if error is not None}
+        if not failures:
+            self.d.msgbox("Command scheduled successfully.")
+            return None
+        text = f"Could not schedule the command on {len(failures)} of {len(results)} servers:\n\n"
+        text += "".join(f"{host}: {error}\n" for host, error in sorted(failures.items()))
+        self.d.scrollbox(text)
+        return None
+
+    def schedule_batch(self) -> None:
+        """
+        Schedule batch of remote jobs menu.
+
+        Every command of the batch is scheduled on every selected server.
+
+        :return: None
+        """
+        init = (
+            "# One job per line: date and time (YYYY-MM-DD HH:MM:SS), tab and the command to run.\n"
+            f"# {datetime.now():%Y-%m-%d %H:%M:%S}\tuname -a\n"
+        )
+        code, text = self.d.editbox_str(init, title="Batch of remote jobs", height=20, width=80)
+        if code != self.d.OK:
+            return None
+        batch = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            try:
+                date, cmd = line.split("\t", 1)
+                batch.append((datetime.strptime(date.strip(), "%Y-%m-%d %H:%M:%S"), cmd.strip()))
+            except ValueError:
+                self.d.msgbox(f"Wrong job on line {number}: {line}")
+                return None
+        if not batch:
+            self.d.msgbox("You did not enter any jobs!")
+            return None
+        servers = self.access_servers_gui(checklist=True)
+        if not servers:
+            self.d.msgbox("You did not select any servers!")
+            return None
+        results = schedule_jobs([(host, cmd, date) for host in servers for date, cmd in batch], self.db)
+        failures = {host: error for host, error in results.items() if error is not None}
+        if not failures:
+            self.d.msgbox(f"{len(batch) * len(servers)} jobs scheduled successfully.")
+            return None
+        text = f"Could not schedule the jobs on {len(failures)} of {len(results)} servers:\n\n"
+        text += "".join(f"{host}: {error}\n" for host, error in sorted(failures.items()))
+        self.d.scrollbox(text)
+        return None
 
     def job_info_s(self, job: PlbmngJob) -> str:
         """
@@ -512,23 +609,24 @@ ID:            {job.job_id}"""
             self.d.msgbox("There are no non-stopped jobs to update.")
             return None
         hosts = list(dict(groupby(ns_jobs, lambda job: job.hostname)).keys())
-        ssh_key = settings.remote_execution.ssh_key
-        user = settings.planetlab.slice
-        client = ParallelSSHClient(hosts, user=user, pkey=ssh_key)
-        cmds = client.copy_remote_file(f"/home/{user}/.plbmng/jobs.json", f"{get_remote_jobs_path()}/jobs.json")
-        joinall(cmds, raise_error=True)
+        results = fetch_remote_jobs(hosts)
 
         fetched_jobs = []
-        for host in hosts:
-            # get jobs for the current host
-            fetched_jobs.extend(get_remote_jobs(host))
-        jobs_intersection = set(fetched_jobs).intersection(set(ns_jobs))
-
+        failures = {}
+        for host, jobs in results.items():
+            if isinstance(jobs, str):
+                failures[host] = jobs
+            else:
+                fetched_jobs.extend(jobs)
         # update database
-        for job in jobs_intersection:
-            job = next((fjob for fjob in fetched_jobs if fjob == job), None)
-            self.db.update_job(job)
-        self.d.msgbox("Jobs updated successfully.")
+        fetched_jobs = {job.job_id: job for job in fetched_jobs}
+        self.db.update_jobs([fetched_jobs[job.job_id] for job in ns_jobs if job.job_id in fetched_jobs])
+        if not failures:
+            self.d.msgbox("Jobs updated successfully.")
+            return None
+        text = f"Could not read the jobs on {len(failures)} of {len(results)} servers:\n\n"
+        text += "".join(f"{host}: {error}\n" for host, error in sorted(failures.items()))
+        self.d.scrollbox(text)
 
     def job_artefacts_menu(self) -> None:
         """
@@ -661,7 +759,15 @@ ID:            {job.job_id}"""
                 code, tag = self.d.menu(text, choices=artefact_choices)
                 if code == self.d.OK:
                     selected_file = files[int(tag) - 1]
-                    self.d.textbox(selected_file.as_posix())
+                    if selected_file.suffix != ".gz":
+                        self.d.textbox(selected_file.as_posix())
+                        continue
+                    # artefacts compressed by the executor are shown decompressed
+                    with tempfile.NamedTemporaryFile(prefix="plbmng-artefact-") as text_file:
+                        with gzip.open(selected_file, "rb") as gz_file:
+                            shutil.copyfileobj(gz_file, text_file)
+                        text_file.flush()
+                        self.d.textbox(text_file.name)
                 else:
                     break
 
@@ -787,7 +893,10 @@ ID:            {job.job_id}"""
 
         :return: None
         """
-        text = "Type in destination path on the target hosts. Path to specific file must be specified!"
+        text = (
+            "Type in destination path on the target hosts. Path to specific file must be specified!\n"
+            "Directories are copied recursively into the destination directory."
+        )
         init = f"/home/{settings.planetlab.slice}"
         code, source_path = self.d.fselect(filepath="/home/", height=20, width=60)
 
@@ -799,14 +908,36 @@ ID:            {job.job_id}"""
             self.d.msgbox("You did not select any servers!")
             return None
         code, destination_path = self.d.inputbox(text=text, init=init, height=0, width=0)
-        if code == self.d.OK:
-            ret = copy_files(dialog=self.d, source_path=source_path, hosts=servers, destination_path=destination_path)
-        else:
+        if code != self.d.OK:
             return None
-        if ret:
+        choices = [("1", "Copy to all servers"), ("2", "Send only the changes since the last copy")]
+        if not os.path.isdir(source_path):
+            choices.append(("3", "Relay through the servers (large files, many servers)"))
+        code, tag = self.d.menu("Choose how to copy:", choices=choices)
+        if code != self.d.OK:
+            return None
+        if tag == "1":
+            copy = copy_directory if os.path.isdir(source_path) else copy_files
+            results = copy(dialog=self.d, source_path=source_path, hosts=servers, destination_path=destination_path)
+        elif tag == "2":
+            results = sync_files(
+                dialog=self.d, source_path=source_path, hosts=servers, destination_path=destination_path
+            )
+        else:
+            try:
+                results = relay_files(
+                    dialog=self.d, source_path=source_path, hosts=servers, destination_path=destination_path, db=self.db
+                )
+            except RelayCredentialsError as err:
+                self.d.msgbox(f"Error! {err}")
+                return None
+        failures = {host: error for host, error in results.items() if error is not None}
+        if not failures:
             self.d.msgbox("Copy successful!")
             return None
-        self.d.msgbox("Could not copy file to all servers!")
+        text = f"Could not copy file to {len(failures)} of {len(results)} servers:\n\n"
+        text += "".join(f"{host}: {error}\n" for host, error in sorted(failures.items()))
+        self.d.scrollbox(text)
         return None
 
     def access_servers_gui(self, checklist: bool = False) -> Union[None, List[str]]:
@@ -1,16 +1,27 @@
 import argparse
 import enum
+import fcntl
 import getpass
+import gzip
+import heapq
+import io
 import json
 import logging
 import os
 import platform
-import sched
+import random
+import select
 import shlex
 import subprocess
+import sys
+import threading
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
+from typing import Dict
 from typing import List
 from typing import Tuple
 from typing import Union
@@ -19,16 +30,89 @@ HOME_DIR = str(Path.home())
 PLBMNG_DIR = HOME_DIR + "/.plbmng"
 JOBS_DIR = PLBMNG_DIR + "/jobs"
 JOBS_FILE = PLBMNG_DIR + "/jobs.json"
+SPOOL_DIR = PLBMNG_DIR + "/spool"
+DAEMON_LOCK_FILE = PLBMNG_DIR + "/executor.pid"
+# Default maximum number of jobs the daemon runs at the same time
+DAEMON_CONCURRENCY = 4
+# How often the daemon looks for new jobs in the spool directory, in seconds
+SPOOL_POLL_INTERVAL = 1
+# Daemon exits after it has had nothing to do for this many seconds
+DAEMON_IDLE_TIMEOUT = 60
+# Journal of the changes of the jobs is folded into the jobs file once it grows over this many bytes
+JOURNAL_COMPACT_SIZE = 1048576
+# Flush every append to the journal to the disk, set by the --fsync option
+JOURNAL_FSYNC = False
+# Waiting for the lock of the jobs file fails after this many seconds
+JOBS_LOCK_TIMEOUT = 60
+# Processes waiting for the lock of the jobs file retry with exponential backoff up to this delay, in seconds
+JOBS_LOCK_MAX_DELAY = 0.05
+# Output of the jobs is read in chunks of this size and written to the artefacts as it comes
+ARTEFACT_CHUNK_SIZE = 65536
+# Artefacts are flushed at least this often while the job runs, in seconds
+ARTEFACT_FLUSH_INTERVAL = 1
+# Artefacts are truncated after this many bytes of output, 0 for no limit, set by the --artefact-max-size option
+ARTEFACT_MAX_SIZE = 0
+# Artefacts are compressed by gzip, set by the --compress-artefacts option
+ARTEFACT_COMPRESS = False
+# Appended to the truncated artefact
+ARTEFACT_TRUNCATED = "\n[plbmng: output truncated, {kept} of {total} bytes kept]\n"
+# Options of the executor stored with each submitted job, so that they apply even if the daemon is already running
+JOB_OPTIONS = {"fsync": bool, "artefact_max_size": int, "compress_artefacts": bool}
 
 
 # executor.py --run-at 1606254787 --run-cmd "date -d now" --job-id b23c4354-9e06-48de-b0a7-996a7e61717d
+# executor.py --batch ~/.plbmng/batch-1234.json
+# executor.py --submit ~/.plbmng/batch-1234.json --concurrency 4
+# executor.py --dump
+# executor.py --delete b23c4354-9e06-48de-b0a7-996a7e61717d
 
 parser = argparse.ArgumentParser(description="Executor script for the remote jobs scheduled by plbmng")
+parser.add_argument("--run-at", dest="run_at", type=int, help="time to run the job at. Requires timestamp (epoch)")
+parser.add_argument("--run-cmd", dest="run_cmd", type=str, help="command to run")
+parser.add_argument("--job-id", dest="job_id", type=str, help="ID of the job")
 parser.add_argument(
-    "--run-at", dest="run_at", required=True, type=int, help="time to run the job at. Requires timestamp (epoch)"
+    "--batch",
+    dest="batch",
+    type=str,
+    help="JSON file with list of jobs, each with job_id, run_at and run_cmd. The file is removed once it is read. "
+    "The jobs are handed over to the daemon as with --submit",
 )
-parser.add_argument("--run-cmd", dest="run_cmd", required=True, type=str, help="command to run")
-parser.add_argument("--job-id", dest="job_id", required=True, type=str, help="ID of the job")
+parser.add_argument(
+    "--submit",
+    dest="submit",
+    type=str,
+    help="JSON file with list of jobs as for --batch. The jobs are handed over to the daemon, which is started "
+    "if it is not running",
+)
+parser.add_argument("--daemon", dest="daemon", action="store_true", help="run the jobs submitted by --submit")
+parser.add_argument(
+    "--concurrency",
+    dest="concurrency",
+    type=int,
+    default=DAEMON_CONCURRENCY,
+    help="maximum number of jobs the daemon runs at the same time",
+)
+parser.add_argument(
+    "--fsync",
+    dest="fsync",
+    action="store_true",
+    help="flush every change of the jobs to the disk, so that it survives a crash of the node",
+)
+parser.add_argument(
+    "--artefact-max-size",
+    dest="artefact_max_size",
+    type=int,
+    default=ARTEFACT_MAX_SIZE,
+    help="truncate stdout and stderr of the jobs after this many bytes, 0 for no limit",
+)
+parser.add_argument(
+    "--compress-artefacts",
+    dest="compress_artefacts",
+    action="store_true",
+    help="save stdout and stderr of the jobs compressed by gzip",
+)
+parser.add_argument("--dump", dest="dump", action="store_true", help="print current state of all jobs as JSON")
+parser.add_argument("--delete", dest="delete", nargs="+", metavar="JOB_ID", help="delete the jobs")
 
 
 def main() -> None:
@@ -37,81 +121,415 @@ def main() -> None:
 
     Run when the module itself is executed.
     """
+    global JOURNAL_FSYNC, ARTEFACT_MAX_SIZE, ARTEFACT_COMPRESS
     logging.basicConfig(level=logging.INFO)  # TODO: create logfile and returnit as artefact
     args = parser.parse_args()
-    run_at = args.run_at
-    ensure_basic_structure()
-    create_job(args.job_id, args.run_cmd, run_at)
+    JOURNAL_FSYNC = args.fsync
+    ARTEFACT_MAX_SIZE = args.artefact_max_size
+    ARTEFACT_COMPRESS = args.compress_artefacts
+    if args.dump:
+        _ensure_base_dir()
+        sys.stdout.write(json.dumps(PlbmngJobsJournal(JOBS_FILE).read(), cls=_PlbmngJobEncoder) + "\n")
+        return
+    if args.delete:
+        _ensure_base_dir()
+        PlbmngJobsJournal(JOBS_FILE).append([PlbmngJobsJournal.delete_event(job_id) for job_id in args.delete])
+        return
+    if args.daemon:
+        ensure_basic_structure()
+        ExecutorDaemon(args.concurrency).run()
+        return
+    if args.submit or args.batch:
+        with open(args.submit or args.batch) as batch_file:
+            jobs = json.load(batch_file)
+        os.remove(args.submit or args.batch)
+    elif args.run_at is None or args.run_cmd is None or args.job_id is None:
+        parser.error("--run-at, --run-cmd and --job-id are required unless --submit or --batch is used")
+    else:
+        jobs = [{"job_id": args.job_id, "run_at": args.run_at, "run_cmd": args.run_cmd}]
+    try:
+        submit(jobs, args.concurrency)
+    except ValidationError as e:
+        sys.exit("Invalid batch: {}".format(e))
 
-    scheduler = sched.scheduler(time.time, time.sleep)
-    logging.info("START: " + str(time.time()))
 
-    # enters queue using enterabs method
-    scheduler.enterabs(run_at, 1, runner, argument=(args.job_id, args.run_cmd))
+def validate_batch(jobs: List[dict]) -> None:
+    """
+    Check that the batch is a list of jobs, each of them with ``job_id``, ``run_cmd`` and ``run_at``.
 
-    # executing the event
-    scheduler.run()
+    :param jobs: Batch of jobs as loaded from JSON.
+    :raises ValidationError: If the batch or any of its jobs is malformed.
+    """
+    if not isinstance(jobs, list):
+        raise ValidationError("Batch has to be a list of jobs, got {}".format(type(jobs).__name__))
+    for job in jobs:
+        if not isinstance(job, dict):
+            raise ValidationError("Job has to be an object, got {}".format(type(job).__name__))
+        types = dict(JOB_OPTIONS, job_id=str, run_cmd=str, run_at=(int, float))
+        for key, expected in types.items():
+            if key not in job and key in JOB_OPTIONS:
+                continue
+            value = job.get(key)
+            # bool is a subclass of int, but it is not a valid time or size
+            if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+                raise ValidationError("Job {} has invalid {}: {!r}".format(job.get("job_id"), key, value))
+
+
+def submit(jobs: List[dict], concurrency: int = DAEMON_CONCURRENCY) -> None:
+    """
+    Hand the jobs over to the daemon, starting the daemon if it is not running.
 
+    The options given on the command line (``--fsync``, ``--artefact-max-size`` and ``--compress-artefacts``)
+    are stored with each job, so they apply even if the daemon is already running.
+    The ``concurrency`` applies only if the daemon is started.
 
-def runner(job_id: str, cmd_argv: str) -> None:
+    :param jobs: Jobs, each of them with ``job_id``, ``run_cmd`` and ``run_at`` timestamp.
+    :param concurrency: Maximum number of jobs run at the same time by the daemon if it has to be started.
+    """
+    validate_batch(jobs)
+    for job in jobs:
+        job.setdefault("fsync", JOURNAL_FSYNC)
+        job.setdefault("artefact_max_size", ARTEFACT_MAX_SIZE)
+        job.setdefault("compress_artefacts", ARTEFACT_COMPRESS)
+    _ensure_base_dir()
+    Path(SPOOL_DIR).mkdir(exist_ok=True)
+    path = os.path.join(SPOOL_DIR, "{}-{}".format(int(time.time() * 1000), os.getpid()))
+    with open(path + ".tmp", "w") as batch_file:
+        json.dump(jobs, batch_file)
+    # the daemon picks up only complete files, rename within the same file system is atomic
+    os.rename(path + ".tmp", path + ".json")
+    if daemon_running():
+        return
+    with open(os.devnull, "r+b") as devnull:
+        argv = [sys.executable, os.path.abspath(__file__), "--daemon", "--concurrency", str(concurrency)]
+        if JOURNAL_FSYNC:
+            argv.append("--fsync")
+        if ARTEFACT_MAX_SIZE:
+            argv += ["--artefact-max-size", str(ARTEFACT_MAX_SIZE)]
+        if ARTEFACT_COMPRESS:
+            argv.append("--compress-artefacts")
+        subprocess.Popen(
+            argv,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            cwd=HOME_DIR,
+            start_new_session=True,
+        )
+
+
+def daemon_running() -> bool:
+    """
+    Return whether the daemon is running.
+
+    :return: :py:obj:`True` if the daemon holds its lock file.
+    """
+    with open(DAEMON_LOCK_FILE, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return False
+
+
+class ExecutorDaemon:
+    """Single process per node running all the jobs submitted to the spool directory.
+
+    Jobs wait in a priority queue ordered by their run time, so the memory of the node does not grow
+    with the number of scheduled jobs. Only one daemon runs at a time, it holds a lock on :py:data:`DAEMON_LOCK_FILE`.
+    The daemon exits when it has had no jobs for :py:data:`DAEMON_IDLE_TIMEOUT` seconds.
+    A daemon started after the previous one was killed queues again the jobs it left scheduled.
+    """
+
+    def __init__(self, concurrency: int = DAEMON_CONCURRENCY) -> None:
+        """
+        Create the daemon.
+
+        :param concurrency: Maximum number of jobs run at the same time.
+        """
+        self.concurrency = concurrency
+        self.queue = []
+        self.running = []
+        # IDs of all jobs queued by the daemon, a batch read again after a crash does not queue them twice
+        self.queued_ids = set()
+        self._lock_file = None
+        # set whenever a job finishes, so that the next job is started without waiting for the poll interval
+        self._job_finished = threading.Event()
+
+    def _acquire(self) -> bool:
+        self._lock_file = open(DAEMON_LOCK_FILE, "a+")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            return False
+        self._lock_file.seek(0)
+        self._lock_file.truncate()
+        self._lock_file.write(str(os.getpid()))
+        self._lock_file.flush()
+        return True
+
+    def _release(self) -> None:
+        self._lock_file.seek(0)
+        self._lock_file.truncate()
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+    def _push(self, run_at: float, job_id: str, cmd_argv: str, options: dict) -> bool:
+        if job_id in self.queued_ids:
+            return False
+        self.queued_ids.add(job_id)
+        heapq.heappush(self.queue, (run_at, job_id, cmd_argv, options))
+        return True
+
+    def recover_jobs(self) -> int:
+        """
+        Queue the jobs which are still scheduled in the *jobs.json* file.
+
+        The daemon is the only process running the jobs, so these are the jobs queued by a daemon
+        which was killed before it could run them. They run with the options the daemon was started with.
+        Jobs still running were interrupted by the killed daemon, they are recorded as stopped with an error.
+
+        :return: Number of queued jobs.
+        """
+        queued = 0
+        try:
+            with PlbmngJobsFile(JOBS_FILE) as jobs_file:
+                for job in jobs_file.get_all_of_attribute("state", PlbmngJobState.scheduled, failsafe=True) or []:
+                    run_at = time_from_iso(job.scheduled_at).timestamp()
+                    queued += self._push(run_at, job.job_id, job.cmd_argv, {})
+                interrupted = jobs_file.get_all_of_attribute("state", PlbmngJobState.running, failsafe=True) or []
+                ended_at = time_to_iso(datetime.now())
+                jobs_file.update_jobs(
+                    {
+                        job.job_id: {
+                            "ended_at": ended_at,
+                            "state": PlbmngJobState.stopped,
+                            "result": PlbmngJobResult.error,
+                        }
+                        for job in interrupted
+                    }
+                )
+        except JobsFileLocked as e:
+            # the jobs stay as they are, the next daemon tries again
+            logging.error("Could not recover the jobs: %s", e)
+            return 0
+        if interrupted:
+            logging.info("Recorded %s interrupted jobs as failed", len(interrupted))
+        if queued:
+            logging.info("Recovered %s scheduled jobs", queued)
+        return queued
+
+    def read_spool(self) -> int:
+        """
+        Queue the jobs of all batches in the spool directory and remove the batches.
+
+        Batches which can not be queued are renamed with the *.failed* suffix and left in the spool directory.
+
+        :return: Number of queued jobs.
+        """
+        queued = 0
+        for name in sorted(os.listdir(SPOOL_DIR)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(SPOOL_DIR, name)
+            try:
+                with open(path) as batch_file:
+                    jobs = json.load(batch_file)
+                validate_batch(jobs)
+                create_jobs(jobs)
+            except JobsFileLocked as e:
+                # the batch stays in the spool and is read again on the next poll
+                logging.warning("Could not queue batch %s: %s", path, e)
+                break
+            except Exception as e:
+                # a batch left in the spool would make every daemon fail on it again
+                logging.error("Could not read batch %s: %s", path, e)
+                os.rename(path, path + ".failed")
+                continue
+            os.remove(path)
+            for job in jobs:
+                options = {option: job[option] for option in JOB_OPTIONS if option in job}
+                queued += self._push(job["run_at"], job["job_id"], job["run_cmd"], options)
+        return queued
+
+    def start_due_jobs(self) -> None:
+        """Start the jobs whose run time has come, as long as there are less than ``concurrency`` jobs running."""
+        self.running = [thread for thread in self.running if thread.is_alive()]
+        while self.queue and self.queue[0][0] <= time.time() and len(self.running) < self.concurrency:
+            run_at, job_id, cmd_argv, options = heapq.heappop(self.queue)
+            thread = threading.Thread(target=self._run_job, args=(job_id, cmd_argv, run_at, options))
+            thread.start()
+            self.running.append(thread)
+
+    def _run_job(self, job_id: str, cmd_argv: str, run_at: int, options: dict) -> None:
+        try:
+            runner(job_id, cmd_argv, run_at, **options)
+        finally:
+            self._job_finished.set()
+
+    def run(self) -> None:
+        """Run the jobs until there is nothing to do, return immediately if another daemon is running."""
+        Path(SPOOL_DIR).mkdir(exist_ok=True)
+        if not self._acquire():
+            return
+        logging.info("DAEMON START: " + str(time.time()))
+        self.recover_jobs()
+        idle_since = time.time()
+        while True:
+            if self.read_spool() or self.queue or self.running:
+                idle_since = time.time()
+            self.start_due_jobs()
+            if time.time() - idle_since > DAEMON_IDLE_TIMEOUT:
+                self._release()
+                # a batch submitted while the lock was still held would be left behind, take it over
+                if not any(name.endswith(".json") for name in os.listdir(SPOOL_DIR)) or not self._acquire():
+                    break
+                idle_since = time.time()
+            timeout = SPOOL_POLL_INTERVAL
+            if self.queue and len(self.running) < self.concurrency:
+                timeout = max(0, min(self.queue[0][0] - time.time(), SPOOL_POLL_INTERVAL))
+            self._job_finished.wait(timeout)
+            self._job_finished.clear()
+        logging.info("DAEMON STOP: " + str(time.time()))
+
+
+def runner(
+    job_id: str,
+    cmd_argv: str,
+    run_at: float,
+    fsync: bool = None,
+    artefact_max_size: int = None,
+    compress_artefacts: bool = None,
+) -> None:
     """
     Runner for executing :py:class:`PlbmngJob`.
 
+    Changes of the job state are appended to the journal, the jobs file is not read at all.
+    If the jobs file stays locked, the job is run anyway and its end state, which includes
+    the start time, is retried until it is recorded.
+
     :param job_id: ID of the job to create and execute.
     :param cmd_argv: Command to run.
+    :param run_at: Time the job was scheduled at. Represented as timestamp.
+    :param fsync: Flush the changes of the job state to the disk, defaults to :py:data:`JOURNAL_FSYNC`.
+    :param artefact_max_size: See :py:func:`stream_artefact`.
+    :param compress_artefacts: See :py:func:`stream_artefact`.
     """
+    journal = PlbmngJobsJournal(JOBS_FILE, fsync=fsync)
     started_at = datetime.now()
     logging.info("EVENT: " + str(started_at.timestamp()) + job_id)
-    with PlbmngJobsFile(JOBS_FILE) as jf:
-        jf._set_started_at(job_id, started_at)
-        jf._set_job_state(job_id, PlbmngJobState.running)
-
-    result, ended_at = run_command(job_id, cmd_argv)
-
-    with PlbmngJobsFile(JOBS_FILE) as jf:
-        jf._set_ended_at(job_id, ended_at)
-        jf._set_job_state(job_id, PlbmngJobState.stopped)
-        jf._set_job_result(job_id, result)
-
-
-def run_command(job_id: str, cmd_argv: str) -> Tuple["PlbmngEnum", datetime]:
+    try:
+        journal.append(
+            [PlbmngJobsJournal.update_event(job_id, started_at=time_to_iso(started_at), state=PlbmngJobState.running)]
+        )
+    except JobsFileLocked as e:
+        logging.error("Could not record start of job %s, running it anyway: %s", job_id, e)
+
+    result, ended_at = run_command(job_id, cmd_argv, artefact_max_size, compress_artefacts)
+
+    end_event = PlbmngJobsJournal.update_event(
+        job_id,
+        started_at=time_to_iso(started_at),
+        ended_at=time_to_iso(ended_at),
+        execution_time=(ended_at - time_from_timestamp(run_at)).total_seconds(),
+        real_time=(ended_at - started_at).total_seconds(),
+        state=PlbmngJobState.stopped,
+        result=result,
+    )
+    while True:
+        try:
+            journal.append([end_event])
+            return
+        except JobsFileLocked as e:
+            # the job would stay running forever if its end was not recorded
+            logging.error("Could not record end of job %s, retrying: %s", job_id, e)
+
+
+def run_command(
+    job_id: str, cmd_argv: str, artefact_max_size: int = None, compress_artefacts: bool = None
+) -> Tuple["PlbmngEnum", datetime]:
     """
-    Run command as a subprocess and create its artefacts.
+    Run command as a subprocess and stream its output to the artefacts.
 
     :param job_id: ID of the job to create artefacts for.
     :param cmd_argv: Command to run.
+    :param artefact_max_size: See :py:func:`stream_artefact`.
+    :param compress_artefacts: See :py:func:`stream_artefact`.
     :return: Job result and the ``ended_at`` time.
     """
-    cmd_argv = shlex.split(cmd_argv)
-    proc = subprocess.run(cmd_argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        proc = subprocess.Popen(shlex.split(cmd_argv), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except (ValueError, OSError) as e:
+        # the command could not be parsed or started, e.g. it does not exist
+        compress = ARTEFACT_COMPRESS if compress_artefacts is None else compress_artefacts
+        f_path = JOBS_DIR + "/" + str(job_id) + "/artefacts/stderr"
+        with gzip.open(f_path + ".gz", "wb") if compress else open(f_path, "wb") as out:
+            out.write("Could not run the command: {}\n".format(e).encode())
+        return PlbmngJobResult.error, datetime.now()
+    pumps = [
+        threading.Thread(target=stream_artefact, args=(job_id, out_type, stream, artefact_max_size, compress_artefacts))
+        for out_type, stream in (("stdout", proc.stdout), ("stderr", proc.stderr))
+    ]
+    for pump in pumps:
+        pump.start()
+    returncode = proc.wait()
+    for pump in pumps:
+        pump.join()
     ended_at = datetime.now()
-    create_artefacts(job_id, proc.stdout, proc.stderr)
-    if proc.returncode == 0:
+    if returncode == 0:
         return PlbmngJobResult.success, ended_at
     else:
         return PlbmngJobResult.error, ended_at
 
 
-def create_artefacts(job_id: str, stdout: bytes, stderr: bytes) -> None:
+def stream_artefact(job_id: str, out_type: str, stream, max_size: int = None, compress: bool = None) -> None:
     """
-    Create artefacts for the given job.
+    Write the output of the job to its artefact as the job runs.
 
-    Currently supports only stdout and stderr.
+    Memory use does not depend on the size of the output. The artefact is flushed whenever the job
+    has written nothing for :py:data:`ARTEFACT_FLUSH_INTERVAL` seconds and at least that often
+    while it keeps writing, so the output is available before the job ends.
+    The rest of the output is still read, so that the job does not block on the full pipe.
+    No artefact is created if the job writes no output.
 
     :param job_id: ID of the job.
-    :param stdout: STDOUT returned by :py:mod:`subprocess <subprocess>`
-    :param stderr: STDERR returned by :py:mod:`subprocess <subprocess>`
+    :param out_type: Name of the artefact, ``stdout`` or ``stderr``.
+    :param stream: Pipe with the output of the job, it is closed once the job closes it.
+    :param max_size: Number of bytes of the output after which the artefact is truncated, 0 for no limit.
+        Defaults to :py:data:`ARTEFACT_MAX_SIZE`.
+    :param compress: Compress the artefact by gzip, defaults to :py:data:`ARTEFACT_COMPRESS`.
     """
-    if stdout:
-        _save_artefacts_file(job_id, "stdout", stdout)
-    if stderr:
-        _save_artefacts_file(job_id, "stderr", stderr)
-
-
-def _save_artefacts_file(job_id: str, out_type: str, out: bytes) -> None:
+    max_size = ARTEFACT_MAX_SIZE if max_size is None else max_size
+    compress = ARTEFACT_COMPRESS if compress is None else compress
     f_path = JOBS_DIR + "/" + str(job_id) + "/artefacts/" + out_type
-    with open(f_path, "wb") as write_file:
-        write_file.write(out)
+    out, kept, total, flushed_at = None, 0, 0, time.monotonic()
+    fd = stream.fileno()
+    try:
+        while True:
+            ready, _, _ = select.select([fd], [], [], ARTEFACT_FLUSH_INTERVAL)
+            if out is not None and (not ready or time.monotonic() - flushed_at >= ARTEFACT_FLUSH_INTERVAL):
+                out.flush()
+                flushed_at = time.monotonic()
+            if not ready:
+                continue
+            chunk = os.read(fd, ARTEFACT_CHUNK_SIZE)
+            if not chunk:
+                break
+            if out is None:
+                out = gzip.open(f_path + ".gz", "wb") if compress else open(f_path, "wb")
+            total += len(chunk)
+            if max_size:
+                chunk = chunk[: max(0, max_size - kept)]
+            out.write(chunk)
+            kept += len(chunk)
+        if out is not None and kept < total:
+            out.write(ARTEFACT_TRUNCATED.format(kept=kept, total=total).encode())
+    finally:
+        stream.close()
+        if out is not None:
+            out.close()
 
 
 def _ensure_base_dir() -> None:
@@ -156,9 +574,26 @@ def create_job(job_id: str, cmd_argv: str, scheduled_at: int) -> None:
     :param cmd_argv: Command for the given job.
     :param scheduled_at: Time at which the time was scheduled. Represented as timestamp.
     """
-    with PlbmngJobsFile(JOBS_FILE) as jf:
-        jf.add_job(job_id, cmd_argv, scheduled_at=time_from_timestamp(scheduled_at))
-    create_job_dir(job_id)
+    create_jobs([{"job_id": job_id, "run_cmd": cmd_argv, "run_at": scheduled_at}])
+
+
+def create_jobs(jobs: List[dict]) -> None:
+    """
+    Create all ``jobs`` with a single append to the journal of the *jobs.json* file and create their job directories.
+
+    :param jobs: Jobs, each of them with ``job_id``, ``run_cmd`` and ``run_at`` timestamp.
+    """
+    events = []
+    for job in jobs:
+        scheduled_at = time_from_timestamp(job["run_at"])
+        events.append(
+            PlbmngJobsJournal.add_event(
+                PlbmngJob(job_id=job["job_id"], cmd_argv=job["run_cmd"], scheduled_at=scheduled_at)
+            )
+        )
+    PlbmngJobsJournal(JOBS_FILE).append(events)
+    for job in jobs:
+        create_job_dir(job["job_id"])
 
 
 def get_local_tz_name() -> str:
@@ -260,6 +695,37 @@ class JobNotFound(PlbmngExecutorException):
     pass
 
 
+class JobsFileLocked(PlbmngExecutorException):
+    """Exception raised when the lock of the *jobs.json* file is not acquired in time."""
+
+    pass
+
+
+def lock_exclusive(lock_file, timeout: float = None) -> None:
+    """
+    Acquire exclusive :py:func:`fcntl.flock` lock of the open file.
+
+    The lock is retried with exponential backoff and random jitter, so that processes woken up
+    at the same time do not retry in lockstep.
+
+    :param lock_file: File object of the lock file.
+    :param timeout: Time in seconds after which the retries are given up, defaults to :py:data:`JOBS_LOCK_TIMEOUT`.
+    :raises JobsFileLocked: If the lock is not acquired in ``timeout`` seconds.
+    """
+    timeout = JOBS_LOCK_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                raise JobsFileLocked("Could not lock {} in {} seconds".format(lock_file.name, timeout))
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, JOBS_LOCK_MAX_DELAY)
+
+
 class PlbmngJob:
     """Representation of remote job used within the plbmng."""
 
@@ -331,19 +797,201 @@ class _PlbmngJobEncoder(json.JSONEncoder):
             raise TypeError("Object is not of the expected instance")
 
 
-class _PlbmngJobDecoder(json.JSONDecoder):
-    def __init__(self, *args, **kwargs) -> None:
-        json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
+class PlbmngJobsJournal:
+    """Append-only journal of the changes of the jobs stored next to the *jobs.json* file.
+
+    The *jobs.json* file is a snapshot of the jobs. Every change is appended to the journal as one JSON line,
+    so its cost does not grow with the number of jobs. The current state of the jobs is the snapshot with
+    the journal replayed on top of it. Once the journal grows over :py:data:`JOURNAL_COMPACT_SIZE` bytes
+    it is folded into the snapshot. All processes serialize their access by :py:func:`fcntl.flock`
+    on the lock file next to the *jobs.json* file, see :py:func:`lock_exclusive`.
+
+    The lock is held only to append or to open the files. The snapshot and the journal are replaced
+    by renames, so a reader parses the files it opened under the lock after releasing it.
+    """
+
+    def __init__(self, file_path: str, journal_path: str = None, fsync: bool = None) -> None:
+        """
+        Create journal of the *jobs.json* file located in ``file_path``.
+
+        :param file_path: Path to the *jobs.json* file.
+        :param journal_path: Path to the journal, defaults to ``file_path`` with the *.journal* suffix.
+        :param fsync: Flush every append to the disk, defaults to :py:data:`JOURNAL_FSYNC`.
+        """
+        self.file_path = os.path.abspath(file_path)
+        self.journal_path = journal_path or self.file_path + ".journal"
+        self.lock_path = self.file_path + ".lock"
+        self.fsync = JOURNAL_FSYNC if fsync is None else fsync
 
-    def object_hook(self, obj) -> PlbmngJob:
-        plbmng_job = PlbmngJob(**obj)
-        return plbmng_job
+    @staticmethod
+    def add_event(job: PlbmngJob) -> dict:
+        """
+        Return event adding the ``job``.
+
+        :param job: Job to be added.
+        :return: Event for :py:meth:`append`.
+        """
+        return {"op": "add", "job": job}
+
+    @staticmethod
+    def update_event(job_id: str, **attrs: object) -> dict:
+        """
+        Return event setting the ``attrs`` of the job.
+
+        :param job_id: ID of the job to be updated.
+        :param attrs: Attributes of :py:class:`PlbmngJob` and their new values.
+        :return: Event for :py:meth:`append`.
+        """
+        return {"op": "set", "job_id": job_id, "attrs": attrs}
+
+    @staticmethod
+    def delete_event(job_id: str) -> dict:
+        """
+        Return event deleting the job.
+
+        :param job_id: ID of the job to be deleted.
+        :return: Event for :py:meth:`append`.
+        """
+        return {"op": "del", "job_id": job_id}
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold exclusive lock of the jobs file for the duration of the context.
+
+        The lock is not reentrant, :py:meth:`load`, :py:meth:`write` and :py:meth:`compact`
+        are the only methods which can be called while holding it.
+
+        :yield: Nothing, the lock is released when the context is left.
+        """
+        with open(self.lock_path, "a") as lock_file:
+            lock_exclusive(lock_file)
+            yield  # closing the lock file releases the lock
+
+    def append(self, events: List[dict]) -> None:
+        """
+        Append the ``events`` to the journal.
+
+        :param events: Events created by :py:meth:`add_event`, :py:meth:`update_event` or :py:meth:`delete_event`.
+        """
+        with self.locked():
+            self.write(events)
+
+    def read(self) -> List[PlbmngJob]:
+        """
+        Return current state of the jobs.
+
+        :return: All jobs from the snapshot with the journal replayed on top of it.
+        """
+        with self.locked():
+            read_file, journal_file = self._open()
+        with read_file, journal_file:
+            return [PlbmngJob(**job) for job in self._replay(read_file, journal_file).values()]
+
+    def load(self) -> List[PlbmngJob]:
+        """
+        Return current state of the jobs, the lock has to be held by :py:meth:`locked`.
+
+        :return: All jobs from the snapshot with the journal replayed on top of it.
+        """
+        read_file, journal_file = self._open()
+        with read_file, journal_file:
+            return [PlbmngJob(**job) for job in self._replay(read_file, journal_file).values()]
+
+    def _open(self) -> Tuple[io.TextIOBase, io.TextIOBase]:
+        files = []
+        for path, empty in ((self.file_path, "[]"), (self.journal_path, "")):
+            try:
+                files.append(open(path, "r"))
+            except FileNotFoundError:
+                files.append(io.StringIO(empty))
+        return files[0], files[1]
+
+    def _replay(self, read_file: io.TextIOBase, journal_file: io.TextIOBase) -> Dict[str, dict]:
+        jobs = OrderedDict()
+        for job in json.load(read_file):
+            jobs[job["job_id"]] = job
+        for line in journal_file:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # line partially written by an append interrupted by a crash of the node,
+                # or by an append still in progress
+                continue
+            self._apply(jobs, event)
+        return jobs
+
+    @staticmethod
+    def _apply(jobs: Dict[str, dict], event: dict) -> None:
+        if event["op"] == "add":
+            # the journal may be replayed again over the snapshot it was compacted into if the node
+            # crashed before the journal was truncated, the job in the snapshot is the newer one
+            jobs.setdefault(event["job"]["job_id"], event["job"])
+        elif event["op"] == "set" and event["job_id"] in jobs:
+            jobs[event["job_id"]].update(event["attrs"])
+        elif event["op"] == "del":
+            jobs.pop(event["job_id"], None)
+
+    def write(self, events: List[dict]) -> None:
+        """
+        Append the ``events`` to the journal, the lock has to be held by :py:meth:`locked`.
+
+        The journal is compacted if it grows over :py:data:`JOURNAL_COMPACT_SIZE` bytes.
+
+        :param events: Events created by :py:meth:`add_event`, :py:meth:`update_event` or :py:meth:`delete_event`.
+        """
+        if not events:
+            return
+        data = "".join(json.dumps(event, cls=_PlbmngJobEncoder) + "\n" for event in events).encode()
+        with open(self.journal_path, "a+b") as journal_file:
+            size = journal_file.seek(0, os.SEEK_END)
+            if size:
+                journal_file.seek(size - 1)
+                if journal_file.read(1) != b"\n":
+                    # terminate the line partially written by an append interrupted by a crash of the node
+                    data = b"\n" + data
+            journal_file.write(data)
+            journal_file.flush()
+            if self.fsync:
+                os.fsync(journal_file.fileno())
+            size = journal_file.tell()
+        if size > JOURNAL_COMPACT_SIZE:
+            read_file, journal_file = self._open()
+            with read_file, journal_file:
+                self.compact(list(self._replay(read_file, journal_file).values()))
+
+    def compact(self, jobs: List[Union[PlbmngJob, dict]]) -> None:
+        """
+        Replace the snapshot by the ``jobs`` and empty the journal, the lock has to be held by :py:meth:`locked`.
+
+        Both files are replaced by renames, readers which have already opened them keep reading the old ones.
+
+        :param jobs: Current state of all jobs.
+        """
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w") as write_file:
+            json.dump(jobs, write_file, cls=_PlbmngJobEncoder)
+            write_file.flush()
+            # the journal is emptied only once the snapshot replacing it is on the disk
+            os.fsync(write_file.fileno())
+        os.replace(tmp_path, self.file_path)
+        open(tmp_path, "w").close()
+        os.replace(tmp_path, self.journal_path)
 
 
 class PlbmngJobsFile:
-    """Context manager for the *jobs.json* file containing one or more :py:class:`PlbmngJob`-s."""
+    """Context manager for the *jobs.json* file containing one or more :py:class:`PlbmngJob`-s.
+
+    The jobs file is locked for the duration of the context. Changes made in the context are appended
+    to the :py:class:`PlbmngJobsJournal` of the jobs file when the context is left.
+    Jobs are indexed by their ID and by the attributes in :py:attr:`indexed_attributes`,
+    so looking up, updating or deleting a job does not depend on the number of jobs.
+    """
+
+    # attributes with an index mapping their values to the jobs, together with the expected type of the value
+    indexed_attributes = {"state": PlbmngJobState, "result": PlbmngJobResult}
 
-    def __init__(self, file_path: str, init: bool = False) -> None:
+    def __init__(self, file_path: str, init: bool = False, journal_path: str = None) -> None:
         """
         Create context for the *jobs.json* file located in ``file_path``.
 
@@ -351,19 +999,52 @@ class PlbmngJobsFile:
 
         :param file_path: Path to the *jobs.json* file.
         :param init: Create the jobs file if :py:obj:`True`, defaults to :py:obj:`False`.
+        :param journal_path: Path to the journal of the jobs file, see :py:class:`PlbmngJobsJournal`.
         """
         self.file_path = file_path
-        self.jobs = []
+        self._jobs = OrderedDict()
+        self._indexes = {attr: {} for attr in self.indexed_attributes}
         self._ensure_file_exists(init)
+        self.journal = PlbmngJobsJournal(self.file_path, journal_path)
+        self._events = []
+        self._stack = ExitStack()
 
     def __enter__(self):
-        with open(self.file_path, "r") as read_file:
-            self.jobs = json.load(read_file, cls=_PlbmngJobDecoder)
-            return self
+        self._stack.enter_context(self.journal.locked())
+        self.jobs = self.journal.load()
+        self._events = []
+        return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):  # noqa: U100
-        with open(self.file_path, "w") as write_file:
-            json.dump(self.jobs, write_file, cls=_PlbmngJobEncoder)
+        with self._stack:
+            self.journal.write(self._events)
+
+    @property
+    def jobs(self) -> List[PlbmngJob]:
+        """
+        Return all jobs in the order they were added.
+
+        :return: List of the jobs.
+        """
+        return list(self._jobs.values())
+
+    @jobs.setter
+    def jobs(self, jobs: List[PlbmngJob]) -> None:
+        self._jobs = OrderedDict()
+        self._indexes = {attr: {} for attr in self.indexed_attributes}
+        for job in jobs:
+            if job.job_id in self._jobs:
+                raise ValidationError("More than one job with id {}. Check the DB consistency.".format(job.job_id))
+            self._jobs[job.job_id] = job
+            self._index(job)
+
+    def _index(self, job: PlbmngJob) -> None:
+        for attr, index in self._indexes.items():
+            index.setdefault(getattr(job, attr), OrderedDict())[job.job_id] = job
+
+    def _unindex(self, job: PlbmngJob) -> None:
+        for attr, index in self._indexes.items():
+            index[getattr(job, attr)].pop(job.job_id)
 
     def _ensure_file_exists(self, init) -> None:
         def is_json():
@@ -377,8 +1058,17 @@ class PlbmngJobsFile:
         self.file_path = os.path.abspath(self.file_path)
         if not os.path.exists(self.file_path):
             if init:
-                with open(self.file_path, "w") as write_file:
+                tmp_path = "{}.{}-{}.tmp".format(self.file_path, os.getpid(), threading.get_ident())
+                with open(tmp_path, "w") as write_file:
                     json.dump([], write_file)
+                try:
+                    # unlike a rename the link never replaces the file created by another process in the meantime,
+                    # and unlike writing the file in place no process ever sees it empty
+                    os.link(tmp_path, self.file_path)
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(tmp_path)
             else:
                 raise FileNotFoundError("File {} does not exist.".format(self.file_path))
         else:
@@ -401,7 +1091,9 @@ class PlbmngJobsFile:
                 "Job with id {} already exists. There can be only one job with such ID.".format(job_id)
             )
         job = PlbmngJob(job_id=job_id, cmd_argv=cmd_argv, *args, **kwargs)
-        self.jobs.append(job)
+        self._jobs[job.job_id] = job
+        self._index(job)
+        self._events.append(PlbmngJobsJournal.add_event(job))
 
     def get_job(self, job: Union[PlbmngJob, str], failsafe: bool = False) -> Union[PlbmngJob, None]:
         """
@@ -409,31 +1101,24 @@ class PlbmngJobsFile:
 
         This method is failsafe based on the ``failsafe`` argument.
 
-        :param job: plbmng job to be looked-up
+        :param job: plbmng job to be looked-up, or its ID
         :param failsafe: If :py:obj:`True` no exception will be raised and , defaults to :py:obj:`False`.
-        :raises ValidationError: Is raised if DB inconsistency is detected.
         :raises JobNotFound: is raised if the job is not found and the method is not ``failsafe``.
         :return: Job found | None if no job found
         """
-        if isinstance(job, PlbmngJob):
-            job_iterator = filter(lambda job_found: job_found == job, self.jobs)
-        else:
-            # job is the job_id
-            job_iterator = filter(lambda jobs_found: jobs_found["job_id"] == job, self.jobs)
-        jobs_found = list(job_iterator)
-        if len(jobs_found) > 1:
-            raise ValidationError("More than one item found. Check the DB consistency.")
-        if not jobs_found:
-            if failsafe:
-                return None
-            else:
-                raise JobNotFound("No job found with ID: {}".format(job))
-        return jobs_found[0]
+        job_id = job.job_id if isinstance(job, PlbmngJob) else job
+        job_found = self._jobs.get(job_id)
+        if job_found is None and not failsafe:
+            raise JobNotFound("No job found with ID: {}".format(job_id))
+        return job_found
 
     def get_all_of_attribute(self, attr: str, val: object, failsafe=False) -> List[PlbmngJob]:
         """
         Get all jobs whose ``attr` is equal to ``val``.
 
+        Attributes in :py:attr:`indexed_attributes` are looked up in their index, the other attributes
+        are compared with all jobs.
+
         :param attr: Attribute name to be looked for in :py:class:`PlbmngJob`.
         :param val: Attribute value.
         :param failsafe: Optional argument, method will not raise
@@ -441,8 +1126,10 @@ class PlbmngJobsFile:
         :raises JobNotFound: If no jobs are found.
         :return: List of jobs that have ``attr`` == ``val``.
         """
-        job_iterator = filter(lambda jobs_found: jobs_found[attr] == val, self.jobs)
-        jobs_found = list(job_iterator)
+        if attr in self._indexes:
+            jobs_found = list(self._indexes[attr].get(val, {}).values())
+        else:
+            jobs_found = [job for job in self._jobs.values() if job[attr] == val]
         if not jobs_found:
             if failsafe:
                 return None
@@ -456,40 +1143,69 @@ class PlbmngJobsFile:
 
         :param job_id: ID of the job to be deleted.
         """
-        job = self.get_job(job_id)
-        self.jobs.remove(job)
+        self.del_jobs([job_id])
+
+    def del_jobs(self, jobs: List[Union[PlbmngJob, str]]) -> None:
+        """
+        Delete all ``jobs``.
+
+        :param jobs: Jobs to be deleted, or their IDs.
+        """
+        for job in jobs:
+            job = self.get_job(job)
+            self._unindex(job)
+            del self._jobs[job.job_id]
+            self._events.append(PlbmngJobsJournal.delete_event(job.job_id))
+
+    def update_jobs(self, updates: Dict[str, Dict[str, object]]) -> None:
+        """
+        Set attributes of all jobs in ``updates``.
+
+        :param updates: Dictionary mapping IDs of the jobs to dictionaries of their attributes and new values.
+        :raises TypeError: If the value of any attribute in :py:attr:`indexed_attributes` is not of its type.
+        """
+        for attrs in updates.values():
+            for attr, value in attrs.items():
+                expected = self.indexed_attributes.get(attr)
+                if expected is not None and not isinstance(value, expected):
+                    raise TypeError("Type {} expected, got {} instead.".format(expected, type(value)))
+        for job_id, attrs in updates.items():
+            self._update(self.get_job(job_id), **attrs)
+
+    def _update(self, job: PlbmngJob, **attrs: object) -> None:
+        reindex = any(attr in self._indexes for attr in attrs)
+        if reindex:
+            self._unindex(job)
+        job.__dict__.update(attrs)
+        if reindex:
+            self._index(job)
+        self._events.append(PlbmngJobsJournal.update_event(job.job_id, **attrs))
 
     def _set_job_result(self, job_id, result) -> None:
         if not isinstance(result, PlbmngJobResult):
             raise TypeError("Type {} expected, got {} instead.".format(PlbmngJobResult, type(result)))
-        job = self.get_job(job_id)
-        job.result = result
+        self._update(self.get_job(job_id), result=result)
 
     def _set_job_state(self, job_id, state) -> None:
         if not isinstance(state, PlbmngJobState):
             raise TypeError("Type {} expected, got {} instead.".format(PlbmngJobState, type(state)))
-        job = self.get_job(job_id)
-        job.state = state
+        self._update(self.get_job(job_id), state=state)
 
     def _set_started_at(self, job_id, started_at) -> None:
         if not isinstance(started_at, datetime):
             raise TypeError("Type {} expected, got {} instead.".format(datetime, type(started_at)))
-        job = self.get_job(job_id)
-        job.started_at = time_to_iso(started_at)
+        self._update(self.get_job(job_id), started_at=time_to_iso(started_at))
 
     def _set_ended_at(self, job_id, ended_at) -> None:
         if not isinstance(ended_at, datetime):
             raise TypeError("Type {} expected, got {} instead.".format(datetime, type(ended_at)))
         job = self.get_job(job_id)
-        job.ended_at = time_to_iso(ended_at)
-        self._set_execution_time(job, ended_at)
-        self._set_real_time(job, ended_at)
-
-    def _set_execution_time(self, job, ended_at) -> None:
-        job.execution_time = (ended_at - time_from_iso(job.scheduled_at)).total_seconds()
-
-    def _set_real_time(self, job, ended_at) -> None:
-        job.real_time = (ended_at - time_from_iso(job.started_at)).total_seconds()
+        self._update(
+            job,
+            ended_at=time_to_iso(ended_at),
+            execution_time=(ended_at - time_from_iso(job.scheduled_at)).total_seconds(),
+            real_time=(ended_at - time_from_iso(job.started_at)).total_seconds(),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+import csv
+import os
+from collections.abc import Mapping
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from plbmng.utils.config import get_db_path
+
+# Keys of the node as used across plbmng (lowercased header of default.node) mapped to the record slots
+NODE_KEYS = {
+    "# id": "id",
+    "ip": "ip",
+    "dns": "dns",
+    "continent": "continent",
+    "country": "country",
+    "region": "region",
+    "city": "city",
+    "url": "url",
+    "full name": "full_name",
+    "latitude": "latitude",
+    "longitude": "longitude",
+}
+# Software/hardware keys filled in from the programs table of the plbmng database
+PROGRAM_KEYS = ["gcc", "python", "kernel", "memory"]
+
+
+class NodeRecord(Mapping):
+    """Single node of the node catalog.
+
+    Record is read-only mapping with the same keys as the rows of ``default.node``,
+    so ``record["dns"]`` and ``dict(record)`` work as with the parsed rows.
+    Only the software/hardware keys from :py:data:`PROGRAM_KEYS` can be set.
+    """
+
+    __slots__ = tuple(NODE_KEYS.values()) + tuple(PROGRAM_KEYS)
+
+    def __init__(self, columns: List[str]) -> None:
+        """
+        Construct object of NodeRecord class.
+
+        :param columns: Values of the node in the order of the ``default.node`` columns.
+            Missing values are ``unknown``.
+        """
+        columns = list(columns) + ["unknown"] * (len(NODE_KEYS) - len(columns))
+        for slot, value in zip(NODE_KEYS.values(), columns):
+            setattr(self, slot, value)
+        for key in PROGRAM_KEYS:
+            setattr(self, key, None)
+
+    @property
+    def hostname(self) -> str:
+        """
+        Return name under which the node is known in the plbmng database.
+
+        :return: DNS name of the node, or its IP address if the DNS name is not known.
+        """
+        return self.dns if self.dns else self.ip
+
+    def _slot(self, key: str) -> str:
+        if key in NODE_KEYS:
+            return NODE_KEYS[key]
+        if key in PROGRAM_KEYS and getattr(self, key) is not None:
+            return key
+        raise KeyError(key)
+
+    def __getitem__(self, key: str) -> str:
+        return getattr(self, self._slot(key))
+
+    def __setitem__(self, key: str, value: str) -> None:
+        if key not in PROGRAM_KEYS:
+            raise KeyError(f"{key} of the node can not be changed")
+        setattr(self, key, value)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from NODE_KEYS
+        yield from (key for key in PROGRAM_KEYS if getattr(self, key) is not None)
+
+    def __len__(self) -> int:
+        return len(NODE_KEYS) + sum(getattr(self, key) is not None for key in PROGRAM_KEYS)
+
+    def with_programs(self, programs: List[str]) -> "NodeRecord":
+        """
+        Return copy of the record with the software/hardware keys set.
+
+        :param programs: Values of the :py:data:`PROGRAM_KEYS` in the same order.
+        :return: New record, the catalog's record is not modified.
+        """
+        record = NodeRecord([getattr(self, slot) for slot in NODE_KEYS.values()])
+        for key, value in zip(PROGRAM_KEYS, programs):
+            record[key] = value
+        return record
+
+    def __repr__(self):
+        return f"NodeRecord({dict(self)!r})"
+
+
+class NodeCatalog:
+    """Nodes from ``default.node`` and ``user_servers.node`` with indexes for the lookups done by plbmng.
+
+    Files are parsed once and parsed again only after their modification time changes.
+    """
+
+    def __init__(self, default_node_path: str = None, user_nodes_path: str = None) -> None:
+        """
+        Construct object of NodeCatalog class.
+
+        :param default_node_path: Path to the file with PlanetLab nodes. If it is :py:obj:`None`
+            ``default_node`` from configuration's ``database`` section will be used.
+        :param user_nodes_path: Path to the file with user specified nodes. If it is :py:obj:`None`
+            ``user_nodes`` from configuration's ``database`` section will be used.
+        """
+        self.default_node_path = default_node_path or get_db_path("default_node", failsafe=True)
+        self.user_nodes_path = user_nodes_path or get_db_path("user_nodes", failsafe=True)
+        self._mtimes = None
+        self.default_nodes = []
+        self.user_nodes = []
+        self.by_hostname = {}
+        self.by_dns = {}
+        self.by_ip = {}
+        self.by_country = {}
+        self.by_continent = {}
+
+    def _current_mtimes(self) -> Tuple[Optional[int], Optional[int]]:
+        mtimes = []
+        for path in (self.default_node_path, self.user_nodes_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def refresh(self) -> None:
+        """Parse the node files again if any of them has changed since they were parsed."""
+        mtimes = self._current_mtimes()
+        if mtimes == self._mtimes:
+            return
+        self.default_nodes = self._read_default_nodes()
+        last_id = int(self.default_nodes[-1]["# id"]) if self.default_nodes else 0
+        self.user_nodes = self._read_user_nodes(last_id)
+        self._mtimes = mtimes
+        self._build_indexes()
+
+    def _read_default_nodes(self) -> List[NodeRecord]:
+        try:
+            with open(self.default_node_path) as tsv:
+                csv_reader = csv.reader(tsv, delimiter="\t")
+                header = [column.lower() for column in next(csv_reader, [])]
+                order = [header.index(key) if key in header else None for key in NODE_KEYS]
+                return [
+                    NodeRecord([row[i] if i is not None and i < len(row) else "unknown" for i in order])
+                    for row in csv_reader
+                    if row
+                ]
+        except OSError:
+            return []
+
+    def _read_user_nodes(self, last_id: int) -> List[NodeRecord]:
+        try:
+            with open(self.user_nodes_path) as tsv:
+                lines = tsv.read().split("\n")
+        except OSError:
+            return []
+        user_nodes = []
+        for line in lines:
+            if not line or line.startswith("#"):
+                continue
+            last_id += 1
+            user_nodes.append(NodeRecord([str(last_id)] + line.split()))
+        return user_nodes
+
+    def _build_indexes(self) -> None:
+        # PlanetLab nodes by the name under which they are known in the plbmng database
+        self.by_hostname = {record.hostname: record for record in self.default_nodes}
+        self.by_dns = {}
+        self.by_ip = {}
+        self.by_country = {}
+        self.by_continent = {}
+        for record in self:
+            if record.dns and record.dns != "unknown":
+                self.by_dns.setdefault(record.dns, record)
+            if record.ip and record.ip != "unknown":
+                self.by_ip.setdefault(record.ip, record)
+            self.by_country.setdefault(record.country, []).append(record)
+            self.by_continent.setdefault(record.continent, []).append(record)
+
+    def get(self, hostname: str) -> Optional[NodeRecord]:
+        """
+        Find the node by its DNS name or IP address.
+
+        :param hostname: DNS name or IP address of the node.
+        :return: The node, or :py:obj:`None` if it is not in the catalog.
+        """
+        return self.by_dns.get(hostname) or self.by_ip.get(hostname)
+
+    def __iter__(self) -> Iterator[NodeRecord]:
+        yield from self.default_nodes
+        yield from self.user_nodes
+
+    def __len__(self) -> int:
+        return len(self.default_nodes) + len(self.user_nodes)
+
+
+_catalog = None
+
+
+def get_catalog() -> NodeCatalog:
+    """
+    Return node catalog shared by the whole plbmng process, parsing the node files again if they have changed.
+
+    :return: Shared :py:class:`NodeCatalog` instance.
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = NodeCatalog()
+    _catalog.refresh()
+    return _catalog
@@ -1,24 +1,37 @@
-import csv
 import hashlib
 import re
 import sqlite3
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
 from plbmng import executor
-from plbmng.lib.library import get_custom_servers
+from plbmng.lib.catalog import get_catalog
+from plbmng.lib.catalog import NodeRecord
+from plbmng.lib.prober import ProbeResult
 from plbmng.utils.config import get_db_path
 from plbmng.utils.logger import logger
 
 
+def host_hash(hostname: str) -> str:
+    """
+    Return hash identifying the node with ``hostname`` in the plbmng database.
+
+    :param hostname: IP address or host name of the node
+    :return: md5 hex digest of the ``hostname``
+    """
+    return hashlib.md5(hostname.encode()).hexdigest()
+
+
 class PlbmngDb:
     """Class provides basic interaction with plbmng database."""
 
     def __init__(self) -> None:  # noqa: D107
         self._db_path = get_db_path("plbmng_database")
-        self.db = sqlite3.connect(self._db_path)
-        self.cursor = self.db.cursor()
+        self.connect()
+        self._upgrade_db_schema()
 
     @staticmethod
     def init_db_schema() -> None:
@@ -42,9 +55,11 @@ class PlbmngDb:
                                 shash TEXT,
                                 shostname TEXT,
                                 bssh TEXT,
-                                bping TEXT
+                                bping TEXT,
+                                nrtt REAL
                               )"""
             )
+            cursor.execute("CREATE UNIQUE INDEX availability_shash_uindex ON availability (shash)")
             cursor.execute(
                 """CREATE TABLE configuration (
                                 id INTEGER PRIMARY KEY,
@@ -63,6 +78,7 @@ class PlbmngDb:
                                 smem TEXT
                               )"""
             )
+            cursor.execute("CREATE UNIQUE INDEX programs_shash_uindex ON programs (shash)")
             cursor.execute(
                 """CREATE TABLE jobs(
                             id TEXT not null
@@ -87,21 +103,10 @@ class PlbmngDb:
                        (2,'ping','F')"""
             )
 
-            nodes = __class__.read_default_node()
-            for node in nodes:
-                ip_or_hostname = node["dns"] if node["dns"] else node["ip"]
-                hash_object = hashlib.md5(ip_or_hostname.encode())
-                ssh_result = "F"
-                ping_result = "F"
-
-                cursor.execute(
-                    "INSERT into availability(shash, shostname, bssh, bping) VALUES("
-                    f" '{hash_object.hexdigest()}',"
-                    f" '{ip_or_hostname}',"
-                    f" '{ssh_result}',"
-                    f" '{ping_result}'"
-                    ")"
-                )
+            cursor.executemany(
+                "INSERT INTO availability(shash, shostname, bssh, bping) VALUES (?, ?, 'F', 'F')",
+                [(host_hash(hostname), hostname) for hostname in get_catalog().by_hostname],
+            )
             db.commit()
             db.close()
             return None
@@ -111,11 +116,70 @@ class PlbmngDb:
         """Connect to plbmng database."""
         self.db = sqlite3.connect(self._db_path)
         self.cursor = self.db.cursor()
+        # readers do not block the writer and vice versa, commits need no fsync of the whole database
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+
+    def _upgrade_db_schema(self) -> None:
+        """Add the columns and unique indexes missing in databases created by older versions of plbmng."""
+        columns = [column[1] for column in self.cursor.execute("PRAGMA table_info(availability)")]
+        if "nrtt" not in columns:
+            self.cursor.execute("ALTER TABLE availability ADD COLUMN nrtt REAL")
+        indexes = {index[0] for index in self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        for table in ["availability", "programs"]:
+            if f"{table}_shash_uindex" in indexes:
+                continue
+            # the duplicates have to go before the unique index can be created
+            self.cursor.execute(f"DELETE FROM {table} WHERE nkey NOT IN (SELECT MIN(nkey) FROM {table} GROUP BY shash)")
+            self.cursor.execute(f"CREATE UNIQUE INDEX {table}_shash_uindex ON {table} (shash)")
+        self.db.commit()
 
     def close(self) -> None:
         """Close connection to plbmng database."""
         self.db.close()
 
+    def store_probe_results(self, results: List[ProbeResult]) -> None:
+        """
+        Store availability and software/hardware of the probed nodes in a single transaction.
+
+        :param results: results of the node probes
+        """
+        availability = []
+        programs = []
+        for result in results:
+            shash = host_hash(result.hostname)
+            availability.append(
+                (shash, result.hostname, "T" if result.ssh else "F", "T" if result.ping else "F", result.rtt)
+            )
+            programs.append((shash, result.hostname, *result.programs))
+        with self.db:
+            self.cursor.executemany(
+                """INSERT INTO availability(shash, shostname, bssh, bping, nrtt) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(shash) DO UPDATE SET bssh=excluded.bssh, bping=excluded.bping, nrtt=excluded.nrtt""",
+                availability,
+            )
+            self.cursor.executemany(
+                """INSERT INTO programs(shash, shostname, sgcc, spython, skernel, smem) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(shash) DO UPDATE SET
+                       sgcc=excluded.sgcc, spython=excluded.spython, skernel=excluded.skernel, smem=excluded.smem""",
+                programs,
+            )
+
+    def get_latencies(self, hostnames: List[str]) -> Dict[str, Union[None, float]]:
+        """
+        Return ICMP round trip times of the nodes measured by the last availability update.
+
+        :param hostnames: IP addresses or host names of the nodes
+        :return: Dictionary mapping each of the ``hostnames`` to its round trip time in milliseconds,
+            :py:obj:`None` if the node did not respond or was not probed yet.
+        """
+        hashes = {host_hash(hostname): hostname for hostname in hostnames}
+        latencies = dict.fromkeys(hostnames)
+        self.cursor.execute("SELECT shash, nrtt FROM availability WHERE nrtt IS NOT NULL")
+        for shash, nrtt in self.cursor.fetchall():
+            if shash in hashes:
+                latencies[hashes[shash]] = nrtt
+        return latencies
+
     def get_stats(self) -> dict:
         """
         Return dictionary which contains stats about ping and ssh responses.
@@ -215,7 +279,7 @@ class PlbmngDb:
         check_configuration: bool = True,
         choose_availability_option: int = None,
         choose_software_hardware: str = None,
-    ) -> List[Dict[str, str]]:
+    ) -> List[NodeRecord]:
         """
         Return all nodes from default.node file plus all user specified nodes from user_servers.node.
 
@@ -246,54 +310,34 @@ class PlbmngDb:
             sql = "select shostname from availability where bssh='T'"
         elif choose_availability_option == 3:
             sql = "select shostname from availability where bping='T' and bssh='T'"
+        catalog = get_catalog()
+        if not check_configuration:
+            return list(catalog)
         self.cursor.execute(sql)
-        returned_values_sql = self.cursor.fetchall()
-        server_list = {}
-        for item in returned_values_sql:
+        # look the returned hosts up in the catalog index and keep the order of the node file
+        nodes = []
+        for item in self.cursor.fetchall():
             if choose_software_hardware:
-                server_list[item[2]] = [x for x in item if item.index(x) >= 3]
+                node = catalog.by_hostname.get(item[2])
+                if node is not None:
+                    nodes.append(node.with_programs(item[3:]))
             else:
-                server_list[item[0]] = ""
-        # open node file and append to the nodes if the element exists in the server_list
-        lines = self.read_default_node()
-        nodes = []
-        for line in lines:
-            try:
-                if check_configuration:
-                    if choose_software_hardware:
-                        if line["dns"] in server_list.keys():
-                            line["gcc"] = server_list[line["dns"]][0]
-                            line["python"] = server_list[line["dns"]][1]
-                            line["kernel"] = server_list[line["dns"]][2]
-                            line["memory"] = server_list[line["dns"]][3]
-                            nodes.append(line)
-                    else:
-                        if line["dns"] in server_list.keys():
-                            nodes.append(line)
-                else:
-                    nodes.append(line)
-            except ValueError:
-                pass
-        last_id = int(line["# id"])
+                node = catalog.by_hostname.get(item[0])
+                if node is not None:
+                    nodes.append(node)
+        nodes.sort(key=lambda node: int(node["# id"]))
         if not choose_software_hardware:
-            nodes.extend(get_custom_servers(last_id))
+            nodes.extend(catalog.user_nodes)
         return nodes
 
     @staticmethod
-    def read_default_node() -> List[Dict[str, str]]:
+    def read_default_node() -> List[NodeRecord]:
         """
-        Read ``default.node`` file and return the servers in a list.
+        Return the servers from ``default.node`` file in a list.
 
         :return: list of servers
         """
-        node_file = get_db_path("default_node")
-        nodes = []
-        with open(node_file) as tsv:
-            csv_reader = csv.DictReader(tsv, delimiter="\t")
-            for row in csv_reader:
-                row = {k.lower(): v for k, v in row.items()}
-                nodes.append(row)
-        return nodes
+        return list(get_catalog().default_nodes)
 
     def add_job(self, job_id: str, node: str, cmd_argv: str, scheduled_at: str, state: str, result: str) -> None:
         """
@@ -315,30 +359,59 @@ class PlbmngDb:
         self.cursor.execute(sql)
         self.db.commit()
 
+    def add_jobs(self, jobs: List[Tuple[str, str, str, str, int, int]]) -> None:
+        """
+        Add new jobs to the plbmng database in a single transaction.
+
+        :param jobs: tuples of job ID, FQDN of the node, argv of the command, time at which the job is scheduled,
+            state and result of the job, see :py:meth:`add_job`
+        """
+        with self.db:
+            self.cursor.executemany(
+                """INSERT INTO jobs (id, node, cmd_argv, scheduled_at, state, result)
+                   VALUES (?, (SELECT nkey FROM availability WHERE shostname = ?), ?, ?, ?, ?)""",
+                jobs,
+            )
+
     def update_job(self, job: executor.PlbmngJob) -> None:
         """
         Update existing job in the plbmng database.
 
         :param job: job to be modified in the database
         """
-        # Handle case when any of the time fields might be == null/None
-        for attr in ["started_at", "ended_at"]:
+        self.update_jobs([job])
+
+    def update_jobs(self, jobs: List[executor.PlbmngJob]) -> None:
+        """
+        Update existing jobs in the plbmng database in a single transaction.
+
+        Times the jobs do not have yet are left unchanged.
+
+        :param jobs: jobs to be modified in the database
+        """
+
+        def timestamp(job: executor.PlbmngJob, attr: str) -> Optional[str]:
             if not hasattr(job, attr):
-                setattr(job, attr, "")
-            else:
-                # TODO: deal with timezones properly, parse the TZ info from job
-                setattr(job, attr, f', {attr} = "{executor.time_from_iso(getattr(job, attr)).timestamp()}"')
-        sql = """UPDATE jobs
-                 SET state = {jstate}, result = {jresult}{jstarted_at}{jended_at}
-                 WHERE id = "{jid}";""".format(
-            jid=job.job_id,
-            jstarted_at=job.started_at,
-            jended_at=job.ended_at,
-            jstate=job.state.value,
-            jresult=job.result.value,
-        )
-        self.cursor.execute(sql)
-        self.db.commit()
+                return None
+            # TODO: deal with timezones properly, parse the TZ info from job
+            return str(executor.time_from_iso(getattr(job, attr)).timestamp())
+
+        with self.db:
+            self.cursor.executemany(
+                """UPDATE jobs
+                   SET state = ?, result = ?, started_at = COALESCE(?, started_at), ended_at = COALESCE(?, ended_at)
+                   WHERE id = ?""",
+                [
+                    (
+                        job.state.value,
+                        job.result.value,
+                        timestamp(job, "started_at"),
+                        timestamp(job, "ended_at"),
+                        job.job_id,
+                    )
+                    for job in jobs
+                ],
+            )
 
     def get_non_stopped_jobs(self) -> List[executor.PlbmngJob]:
         """
@@ -427,3 +500,12 @@ class PlbmngDb:
         sql = f"DELETE FROM jobs WHERE id='{job.job_id}'"
         self.cursor.execute(sql)
         self.db.commit()
+
+    def delete_jobs(self, jobs: List[executor.PlbmngJob]) -> None:
+        """
+        Delete jobs from the local plbmng database in a single transaction.
+
+        :param jobs: jobs to be deleted
+        """
+        with self.db:
+            self.cursor.executemany("DELETE FROM jobs WHERE id = ?", [(job.job_id,) for job in jobs])
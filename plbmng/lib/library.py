@@ -1,33 +1,49 @@
 import datetime
 import hashlib
+import io
+import json
 import os
 import re
+import shlex
+import socket
 import sqlite3
 import subprocess
 import sys
+import tarfile
+import tempfile
+import time
 import uuid
 import webbrowser
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from itertools import groupby
-from multiprocessing import Lock
-from multiprocessing import Pool
-from multiprocessing import Value
 from pathlib import Path
-from platform import system
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Tuple
 from typing import Union
 
 import folium
+import paramiko
 from dialog import Dialog
-from gevent import joinall
+from gevent import iwait
+from gevent import spawn
 from pssh.clients.native.parallel import ParallelSSHClient
+from pssh.exceptions import Timeout
 
 import plbmng.lib.planetlab_list_creator
 from plbmng import executor
 from plbmng.lib import full_map
+from plbmng.lib import pinger
 from plbmng.lib import port_scanner
+from plbmng.lib import prober
+from plbmng.lib import relay
+from plbmng.lib import resolver
 from plbmng.lib import ssh as sshlib
+from plbmng.lib import sync
+from plbmng.lib.catalog import get_catalog
 from plbmng.utils.config import get_db_path
 from plbmng.utils.config import get_install_dir
 from plbmng.utils.config import get_map_path
@@ -36,11 +52,6 @@ from plbmng.utils.config import settings
 from plbmng.utils.logger import logger
 
 
-# global variables
-base = None
-increment = None
-lock = None
-
 # Constant definition
 OPTION_IP = "ip"
 OPTION_DNS = "dns"
@@ -57,43 +68,26 @@ OPTION_PYTHON = "python"
 OPTION_KERNEL = "kernel"
 OPTION_MEM = "memory"
 
-DIALOG = None
-SOURCE_PATH = None
-DESTINATION_PATH = None
+# Errors after which the upload is worth retrying, other errors (e.g. missing remote directory) are permanent
+COPY_TRANSIENT_ERRORS = (
+    paramiko.SSHException,
+    paramiko.ssh_exception.NoValidConnectionsError,
+    EOFError,
+    ConnectionError,
+    socket.timeout,
+)
+# How often the copy gauge is updated, in seconds
+COPY_PROGRESS_INTERVAL = 0.5
+# Exit code of the executor launch command telling that the executor has to be deployed first
+EXECUTOR_MISSING = 3
+# Cached result of executor_remote_path()
+EXECUTOR_REMOTE_PATH = None
 
 
 class NeedToFillPasswdFirstInfo(Exception):
     """Raise when password is not filled."""
 
 
-def get_custom_servers(start_id: str) -> list:
-    """
-    Read user_servers.node file in database directory a return all servers from it as list.
-
-    :param start_id: Starting id as string.
-    :return: Return all servers from user_servers.node.
-    """
-    user_nodes = []
-    with open(get_db_path("user_nodes")) as tsv:
-        lines = tsv.read().split("\n")
-    for line in lines:
-        if not line:
-            continue
-        if line[0].startswith("#"):
-            continue
-        columns = line.split()
-        columns.insert(0, start_id)
-        if len(columns) < 11:
-            for _column in range(11 - len(columns)):
-                columns.append("unknown")
-        try:
-            user_nodes.append(columns)
-            start_id += 1
-        except ValueError:
-            pass
-    return user_nodes
-
-
 def run_command(cmd: str) -> Tuple[int, str]:
     """
     Execute given cmd param as shell command.
@@ -113,7 +107,138 @@ def run_command(cmd: str) -> Tuple[int, str]:
     return return_code, stdout
 
 
-def schedule_remote_command(cmd: str, date: datetime.datetime, hosts: List[str], db) -> None:
+def executor_remote_path() -> str:
+    """
+    Return path of the executor on the remote hosts, relative to the home directory of the slice.
+
+    The path contains the digest of the executor, so a new version of plbmng deploys its executor
+    next to the old one and an already deployed executor of the same version is never uploaded again.
+
+    :return: Path of the executor on the remote hosts.
+    """
+    global EXECUTOR_REMOTE_PATH
+    if EXECUTOR_REMOTE_PATH is None:
+        with open(executor.__file__, "rb") as executor_file:
+            digest = hashlib.sha256(executor_file.read()).hexdigest()
+        EXECUTOR_REMOTE_PATH = f".plbmng/executor-{digest[:16]}.py"
+    return EXECUTOR_REMOTE_PATH
+
+
+def _executor_ssh_args(host: str) -> Dict[str, str]:
+    return {
+        "hostname": host,
+        "username": settings.planetlab.slice,
+        "key_filename": settings.remote_execution.ssh_key,
+    }
+
+
+def _run_executor(host: str, script: str, run: Callable[[str], sshlib.SSHCommandResult]) -> sshlib.SSHCommandResult:
+    """
+    Run the shell ``script`` calling the executor on the ``host``, deploying the executor first if needed.
+
+    The executor is available to the ``script`` as ``"$executor"``. The check for the executor and the ``script``
+    are one command, so calling an already deployed executor costs one round trip.
+
+    :param host: Host on which the executor is run.
+    :param script: Shell script calling the executor.
+    :param run: Function running the command on the ``host`` and returning its result, called as ``run(cmd)``.
+        It may be called twice, e.g. to send the standard input again after the executor was deployed.
+    :return: Result of the ``script``.
+    """
+    executor_path = executor_remote_path()
+    cmd = f'executor={executor_path}; test -f "$executor" || {{ mkdir -p .plbmng; exit {EXECUTOR_MISSING}; }}; {script}'
+    result = run(cmd)
+    if result.return_code == EXECUTOR_MISSING:
+        with sshlib.get_sftp_session(**_executor_ssh_args(host)) as sftp:
+            # concurrent deployments never see a partially uploaded executor
+            tmp_path = f"{executor_path}.{uuid.uuid4()}"
+            sftp.put(executor.__file__, tmp_path)
+            sftp.posix_rename(tmp_path, executor_path)
+        result = run(cmd)
+    return result
+
+
+def _launch_executor(host: str, jobs: List[Dict[str, Union[str, int]]]) -> None:
+    """
+    Submit the batch of ``jobs`` to the executor daemon on the ``host``, deploying the executor first if needed.
+
+    The batch is sent on the standard input of the launch command, saved and submitted by the same command,
+    see :py:func:`_run_executor`. All the commands share one pooled connection to the ``host``.
+    The daemon is started by the submission if it is not running, see :py:class:`plbmng.executor.ExecutorDaemon`.
+
+    :param host: Host on which the executor is launched.
+    :param jobs: Jobs for the ``--batch`` option of the executor.
+    :raises OSError: if the executor could not be launched
+    """
+    script = (
+        "batch=.plbmng/batch-$$.json; "
+        'cat > "$batch" || exit 1; '
+        f'python3 "$executor" --submit "$batch" --concurrency {settings.remote_execution.executor_concurrency}'
+    )
+    if settings.remote_execution.executor_fsync:
+        script += " --fsync"
+    if settings.remote_execution.artefact_max_size:
+        script += f" --artefact-max-size {int(settings.remote_execution.artefact_max_size)}"
+    if settings.remote_execution.compress_artefacts:
+        script += " --compress-artefacts"
+    batch = json.dumps(jobs).encode()
+    result = _run_executor(
+        host, script, lambda cmd: sshlib.pipe_file(io.BytesIO(batch), cmd, **_executor_ssh_args(host))
+    )
+    if result.return_code != 0:
+        raise OSError(result.stderr.strip() or f"Could not launch the executor, exit code {result.return_code}")
+
+
+def schedule_jobs(
+    jobs: List[Tuple[str, str, datetime.datetime]], db, concurrency: int = None
+) -> Dict[str, Union[None, str]]:
+    """
+    Schedule all ``jobs`` with a single executor launch per host.
+
+    Jobs are grouped by host and each host gets its whole batch in one request, see :py:func:`_launch_executor`.
+    Hosts are scheduled in parallel. The jobs scheduled successfully are added to the plbmng database
+    in a single transaction.
+
+    :param jobs: Triples of host, command and :py:class:`datetime.datetime` at which the command should run.
+    :param db: plbmng database to write the jobs to.
+    :type db: PlbmngDb
+    :param concurrency: Maximum number of hosts the jobs are scheduled on at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to :py:obj:`None` if its jobs were scheduled,
+        or to the error message otherwise.
+    """
+    batches = {}
+    for host, cmd, date in jobs:
+        batches.setdefault(host, []).append(
+            {"job_id": str(uuid.uuid4()), "run_at": int(date.timestamp()), "run_cmd": cmd}
+        )
+    results = {}
+    with ThreadPoolExecutor(concurrency or settings.remote_execution.concurrency) as pool:
+        futures = {pool.submit(_launch_executor, host, batch): host for host, batch in batches.items()}
+        for future in as_completed(futures):
+            error = future.exception()
+            results[futures[future]] = None if error is None else str(error) or type(error).__name__
+    db.add_jobs(
+        [
+            (
+                job["job_id"],
+                host,
+                job["run_cmd"],
+                job["run_at"],
+                executor.PlbmngJobState["scheduled"].value,
+                executor.PlbmngJobResult["pending"].value,
+            )
+            for host, batch in batches.items()
+            if results[host] is None
+            for job in batch
+        ]
+    )
+    return results
+
+
+def schedule_remote_command(
+    cmd: str, date: datetime.datetime, hosts: List[str], db, concurrency: int = None
+) -> Dict[str, Union[None, str]]:
     """
     Schedule command (``cmd``) to run the specified ``hosts`` at the specified ``date``.
 
@@ -125,27 +250,12 @@ def schedule_remote_command(cmd: str, date: datetime.datetime, hosts: List[str],
     :param hosts: List of plbmng hosts on which the ``cmd`` should be run.
     :param db: plbmng database to write the job to.
     :type db: PlbmngDb
+    :param concurrency: Maximum number of hosts the job is scheduled on at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to :py:obj:`None` if the job was scheduled on it,
+        or to the error message otherwise.
     """
-    ssh_key = settings.remote_execution.ssh_key
-    user = settings.planetlab.slice  # executor_dst_path = "~/.plbmng/executor.py"
-    executor_dst_path = "/tmp/executor.py"
-    # TODO: verify that paths are instances of Path()
-    executor_path = executor.__file__
-    for host in hosts:
-        sshlib.upload_file(executor_path, executor_dst_path, key_filename=ssh_key, hostname=host, username=user)
-        job_uuid = str(uuid.uuid4())
-        executor_cmd = (
-            f"python3 {executor_dst_path} --run-at {int(date.timestamp())} --run-cmd '{cmd}' --job-id {job_uuid}"
-        )
-        db.add_job(
-            job_uuid,
-            host,
-            cmd,
-            date.timestamp(),
-            executor.PlbmngJobState["scheduled"].value,
-            executor.PlbmngJobResult["pending"].value,
-        )
-        sshlib.command(executor_cmd, hostname=host, username=user, key_filename=ssh_key, background=True)
+    return schedule_jobs([(host, cmd, date) for host in hosts], db, concurrency)
 
 
 def get_non_stopped_jobs(db) -> List[executor.PlbmngJob]:
@@ -181,63 +291,55 @@ def get_all_jobs(db) -> List[executor.PlbmngJob]:
     return db.get_all_jobs()
 
 
-def get_server_params(ip_or_hostname: str, ssh: bool = False) -> list:
-    """Return versions of prepared commands as a list.
+def get_server_facts(ip_or_hostname: str, ssh: bool = False) -> Dict[str, str]:
+    """Return facts about software and hardware of the target gathered in a single SSH session.
+
+    The session runs on the pooled connection, so later operations on the target reuse it.
 
     :param ip_or_hostname: IP address of hostname of the target
     :param ssh: use ssh, defaults to :py:obj:`False`
-    :return: List of requested info as string
-    """
-    commands = [
-        "gcc -dumpversion",
-        "python3 --version",
-        "uname -r",
-        "grep MemTotal /proc/meminfo | awk '{print $2 / 1024}'",
-    ]
+    :return: Dictionary mapping names of :py:data:`plbmng.lib.prober.FACTS` to their values
+    """
     if not ssh:
-        # return list of unknown string depending on number of commands
-        return ["unknown" for x in range(len(commands))]
-    cmd = (
-        "ssh -o PasswordAuthentication=no -o UserKnownHostsFile=/dev/null "
-        "-o StrictHostKeyChecking=no -o LogLevel=QUIET -o ConnectTimeout=10 "
-        "-i %s %s@%s " % (settings.remote_execution.ssh_key, settings.planetlab.slice, ip_or_hostname)
-    )
-    output = []
-    for command in commands:
-        try:
-            ret, stdout = run_command(cmd + command)
-            if ret != 0:
-                output.append("unknown")
-                continue
-            if stdout:
-                output.append(stdout)
-                continue
-            else:
-                output.append("unknown")
-        except Exception as e:
-            logger.error("An error occured: {}", e)
-            return ["unknown" for x in range(len(commands))]
-    return output
+        return prober.unknown_facts()
+    try:
+        with sshlib.get_connection(hostname=ip_or_hostname, timeout=prober.SSH_TIMEOUT) as connection:
+            _, stdout, _ = connection.exec_command(prober.facts_command(), timeout=prober.SSH_TIMEOUT)
+            return prober.parse_facts(stdout.read().decode("utf-8", "ignore"))
+    except Exception as e:
+        logger.error("An error occured: {}", e)
+        return prober.unknown_facts()
 
 
-def get_all_nodes() -> None:
+def get_all_nodes(incremental: bool = True) -> Dict[str, List[str]]:
     """
     Get all nodes from plbmng using planetlab_list_creator script.
 
     Create file default.node in plbmng database directory
 
+    :param incremental: Enrich only the nodes added or changed since the last update, defaults to :py:obj:`True`
     :raises NeedToFillPasswdFirstInfo: if ``username`` or ``password`` are not specified in the plbmng settings
+    :return: Dictionary with ``added``, ``changed`` and ``removed`` lists of hostnames.
+        Empty if planetlab_list_creator failed.
     """
     user = settings.planetlab.username
     passwd = settings.planetlab.password
-    if user != "" and passwd != "":
-        os.system(
-            f"pushd {get_install_dir()}; {sys.executable} {plbmng.lib.planetlab_list_creator.__file__} "
-            f"-u '{user}' -p '{passwd}' -o {get_db_path('default_node')}; popd"
-        )
-        # TODO: show output in case of fail
-    else:
+    if user == "" or passwd == "":
         raise NeedToFillPasswdFirstInfo
+    delta_path = f"{get_db_path('default_node')}.delta"
+    os.system(
+        f"pushd {get_install_dir()}; {sys.executable} {plbmng.lib.planetlab_list_creator.__file__} "
+        f"-u '{user}' -p '{passwd}' -o {get_db_path('default_node')} --delta-output {delta_path}"
+        f"{' --incremental' if incremental else ''}; popd"
+    )
+    # TODO: show output in case of fail
+    try:
+        with open(delta_path) as delta_file:
+            delta = json.load(delta_file)
+        os.remove(delta_path)
+    except (OSError, ValueError):
+        delta = {}
+    return delta
 
 
 def search_by_regex(nodes: list, option: int, regex: str) -> list:
@@ -316,15 +418,19 @@ def connect(mode: int, node: list) -> None:
     clear()
     key = settings.remote_execution.ssh_key
     user = settings.planetlab.slice
+    address = node[OPTION_IP]
+    if address == "unknown":
+        # look the node up in the resolver cache instead of letting ssh resolve it again
+        address = resolver.resolve(node[OPTION_DNS]) or node[OPTION_DNS]
     if mode == 1:
         command = 'ssh -o "StrictHostKeyChecking = no" -o "UserKnownHostsFile=/dev/null"'
-        command += f" -i {key} {user}@{node[OPTION_IP]}"
+        command += f" -i {key} {user}@{address}"
         return_value = os.system(command)
         if return_value != 0:
             raise ConnectionError(f"SSH failed with error code {return_value}")
     elif mode == 2:
         os.system("ssh-add " + key)
-        return_value = os.system(f"mc sh://{user}@{node[OPTION_IP]}:/home")
+        return_value = os.system(f"mc sh://{user}@{address}:/home")
         if return_value != 0:
             raise ConnectionError(f"MC failed with error code {return_value}")
 
@@ -402,12 +508,15 @@ def get_server_info(server_id: int, option: int, nodes: list) -> Tuple[dict, lis
     if option == 0:
         option = OPTION_DNS
     if isinstance(server_id, str):
-        # in nodes find the chosen_one node
-        chosen_one = ""
-        for item in nodes:
-            if re.search(server_id, item[option]):
-                chosen_one = item
-                break
+        # in nodes find the chosen_one node, the node catalog index is tried first
+        catalog = get_catalog()
+        index = {OPTION_DNS: catalog.by_dns, OPTION_IP: catalog.by_ip}
+        chosen_one = index.get(option, {}).get(server_id, "")
+        if chosen_one == "":
+            for item in nodes:
+                if re.search(server_id, item[option]):
+                    chosen_one = item
+                    break
         if chosen_one == "":
             logger.error("Internal error, please file a bug report via PyPi")
             exit(99)
@@ -423,7 +532,7 @@ def get_server_info(server_id: int, option: int, nodes: list) -> Tuple[dict, lis
         info_about_node_dic["lon"] = lon
         info_about_node_dic["icmp"] = test_ping(ip_or_hostname)
         info_about_node_dic["sshAvailable"] = test_ssh(ip_or_hostname)
-        programs = get_server_params(ip_or_hostname, info_about_node_dic["sshAvailable"])
+        facts = get_server_facts(ip_or_hostname, info_about_node_dic["sshAvailable"])
         info_about_node_dic[
             "text"
         ] = """
@@ -436,6 +545,8 @@ def get_server_info(server_id: int, option: int, nodes: list) -> Tuple[dict, lis
             CURRENT ICMP RESPOND: %s
             CURRENT SSH AVAILABILITY: %r
             GCC version: %s Python: %s Kernel version: %s
+            MEMORY: %s MB, CPUs: %s, LOAD: %s, DISK FREE: %s kB
+            OS: %s
             """ % (
             chosen_one[OPTION_DNS],
             chosen_one[OPTION_IP],
@@ -449,9 +560,14 @@ def get_server_info(server_id: int, option: int, nodes: list) -> Tuple[dict, lis
             info_about_node_dic["lon"],
             info_about_node_dic["icmp"],
             info_about_node_dic["sshAvailable"],
-            programs[0],
-            programs[1],
-            programs[2],
+            facts["gcc"],
+            facts["python"],
+            facts["kernel"],
+            facts["memory"],
+            facts["cpus"],
+            facts["load"],
+            facts["disk_free"],
+            facts["os_release"],
         )
         if info_about_node_dic["sshAvailable"] is True or info_about_node_dic["sshAvailable"] is False:
             # update last server access database
@@ -485,39 +601,20 @@ def clear() -> None:
 
 def test_ping(target: str, return_bool: bool = False) -> Union[str, bool]:
     """
-    Try to ping :param target host and return boolean value or message\
-    based on ping command return code from ping tool.
+    Try to ping :param target host and return boolean value or message with the round trip time.
 
     :param target: Host name or IP address.
     :param return_bool: If set to  :py:obj:`False` return message instead of boolean.
     :return: Return message or bool value with ping result.
     """
-    if system().lower() == "windows":
-        ping_param = "-n"
-    else:
-        ping_param = "-c"
-    # for Linux ping parameter takes seconds while MAC OS ping takes milliseconds
-    if system().lower() == "linux":
-        ping_packet_wait_time = 1
-    else:
-        ping_packet_wait_time = 800
-    command = ["ping", ping_param, "1", target, "-W", str(ping_packet_wait_time)]
-    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # prepare the regular expression to get time
-    if system().lower() == "windows":
-        avg = re.compile("Average = ([0-9]+)ms")
-    else:
-        avg = re.compile("min/avg/max/[a-z]+ = [0-9.]+/([0-9.]+)/[0-9.]+/[0-9.]+")
-    avg_str = avg.findall(str(p.communicate()[0]))
-    if p.returncode != 0:
+    rtt = pinger.ping(target)
+    if rtt is None:
         if not return_bool:
             return "Not reachable via ICMP"
         return False
-    else:
-        p.kill()
-        if not return_bool:
-            return avg_str[0] + " ms"
-        return True
+    if not return_bool:
+        return f"{rtt} ms"
+    return True
 
 
 def test_ssh(target: str) -> Union[bool, int]:
@@ -574,7 +671,7 @@ def update_last_server_access(info_about_node_dic: dict, chosen_node: list) -> N
     """
     last_server_file = get_db_path("last_server", failsafe=True)
     with open(last_server_file, "w") as last_server_file:
-        last_server_file.write(repr((info_about_node_dic, chosen_node)))
+        last_server_file.write(repr((info_about_node_dic, dict(chosen_node))))
 
 
 def get_last_server_access() -> Tuple[dict, list]:
@@ -616,249 +713,388 @@ def server_choices(returned_choice: int, chosen_node: list, info_about_node_dic:
         show_on_map(chosen_node, info_about_node_dic)
 
 
-def update_availability_database_parent(dialog: Dialog, nodes: list = None) -> None:
+def update_availability_database_parent(dialog: Dialog, db, nodes: list = None) -> None:
     """
-    Initialize parallel updating of the plbmng database.
+    Probe availability of the ``nodes`` concurrently and update the plbmng database with the results.
+
+    Results are written in batches of ``batch_size`` from configuration's ``monitoring`` section,
+    each batch in a single transaction.
 
     :param dialog: Instance of a dialog engine.
+    :param db: plbmng database to write the results to.
+    :type db: PlbmngDb
     :param nodes: List of nodes to update the database.
     """
-    global DIALOG
-    increment = Value("f", 0)
-    increment.value = float(100 / len(nodes))
-    base = Value("f", 0)
-    lock = Lock()
-    DIALOG = dialog
+    hostnames = [node["dns"] if node["dns"] else node["ip"] for node in nodes]
+    batch_size = settings.monitoring.batch_size
+    batch = []
+    probed = 0
     dialog.gauge_start()
+
+    def store_result(result: prober.ProbeResult) -> None:
+        nonlocal probed
+        batch.append(result)
+        if len(batch) >= batch_size:
+            db.store_probe_results(batch)
+            batch.clear()
+        probed += 1
+        dialog.gauge_update(int(probed * 100 / len(hostnames)))
+
     try:
-        pool = Pool(initializer=multi_processing_init, initargs=(lock, base, increment))
+        prober.run_probes(hostnames, store_result)
+        db.store_probe_results(batch)
     except sqlite3.OperationalError:
+        dialog.gauge_stop()
         dialog.msgbox("Could not update database")
-    pool.map(update_availability_database, nodes)
-    pool.close()
-    pool.join()
-    dialog.gauge_update(100, "Completed")
-    dialog.gauge_stop()
-    dialog.msgbox("Availability database has been successfully updated")
+    else:
+        dialog.gauge_update(100, "Completed")
+        dialog.gauge_stop()
+        dialog.msgbox("Availability database has been successfully updated")
 
 
-def multi_processing_init(i_lock: Lock, i_base: Value, i_increment: Value) -> None:
+def jobs_downloaded_artefacts(jobs: List[executor.PlbmngJob]) -> List[executor.PlbmngJob]:
     """
-    Initialize Pool.
+    Return all jobs that have artefacts downloaded.
 
-    :param i_lock: Lock to synchronize processes.
-    :param i_base: Progress of updating the database. Value is used in DIALOG gauge.
-    :param i_increment: Incremental value in % added to :param base when process is done.
+    :param jobs: list of plbmng jobs to be looked up
+    :return: list of plbmng jobs that have artefacts downloaded
     """
-    global lock
-    lock = i_lock
-    global base
-    base = i_base
-    global increment
-    increment = i_increment
+    return [job for job in jobs if Path(f"{get_remote_jobs_path()}/{job.hostname}/{job.job_id}").exists()]
 
 
-def update_availability_database(node: list) -> None:
+def _upload_with_retries(host: str, upload: Callable[..., None], progress: Dict[str, int]) -> None:
     """
-    Update database with given information from :param node.
+    Upload to the ``host`` by the ``upload`` function, retrying with exponential backoff on connection errors.
 
-    :param node: List which contains all information from planetlab
-        network about the node (must follow template from default.node).
-    """
-    # inint block
-    global DIALOG  # ,PLBMNG_DATABASE
-    db = sqlite3.connect(get_db_path("plbmng_database"))
-    cursor = db.cursor()
-    # action block
-    ip_or_hostname = node["dns"] if node["dns"] else node["ip"]
-    hash_object = hashlib.md5(ip_or_hostname.encode())
-    ssh_result = "T" if test_ssh(ip_or_hostname) is True else "F"
-    ping_result = "T" if test_ping(ip_or_hostname, True) is True else "F"
-    ssh = True if ssh_result == "T" else False
-    programs = get_server_params(ip_or_hostname, ssh)
-
-    # find if object exists in the database
-    sql = """SELECT nkey from availability
-             WHERE shash = "{hash}";""".format(
-        hash=str(hash_object.hexdigest())
-    )
-    cursor.execute(sql)
-    if cursor.fetchone() is None:
-        sql = """INSERT INTO availability(shash, shostname, bssh, bping)
-                 VALUES ("{hash}", "{ip_hstnm}", "{ssh_res}", "{ping_res}");""".format(
-            hash=hash_object.hexdigest(), ip_hstnm=ip_or_hostname, ssh_res=ssh_result, ping_res=ping_result
-        )
-    else:
-        sql = """UPDATE availability
-                 SET bssh="{bssh}", bping="{bping}"
-                 WHERE shash="{shash}";""".format(
-            bssh=ssh_result, bping=ping_result, shash=hash_object.hexdigest()
-        )
-    cursor.execute(sql)
+    :param host: Host to which the upload is done.
+    :param upload: Function called as ``upload(host, callback)`` performing the upload.
+        The ``callback`` has to be called with the number of bytes uploaded so far and the total size.
+    :param progress: Dictionary in which the number of bytes uploaded to the ``host`` is kept up to date.
+    :raises COPY_TRANSIENT_ERRORS: the last error if the upload did not succeed after ``copy_retries`` retries
+    """
 
-    sql = """SELECT nkey
-             FROM programs
-             WHERE shash="{shash}";""".format(
-        shash=str(hash_object.hexdigest())
-    )
-    cursor.execute(sql)
-
-    if cursor.fetchone() is None:
-        sql = """INSERT INTO programs(shash, shostname, sgcc, spython, skernel, smem)
-                 VALUES ("{shash}", "{shostname}", "{sgcc}", "{spython}", "{skernel}", "{smem}");""".format(
-            shash=hash_object.hexdigest(),
-            shostname=ip_or_hostname,
-            sgcc=programs[0],
-            spython=programs[1],
-            skernel=programs[2],
-            smem=programs[3],
-        )
-    else:
-        sql = """UPDATE programs
-                 SET sgcc="{sgcc}", spython="{spython}", skernel="{skernel}", smem="{smem}")
-                 WHERE shash="{shash}";""".format(
-            shash=hash_object.hexdigest(),
-            sgcc=programs[0],
-            spython=programs[1],
-            skernel=programs[2],
-            smem=programs[3],
-        )
-    cursor.execute(sql)
-    # clean up
+    def callback(transferred: int, total: int) -> None:  # noqa: U100
+        progress[host] = transferred
 
-    lock.acquire()
-    base.value = base.value + increment.value
-    DIALOG.gauge_update(int(base.value))
-    lock.release()
-    db.commit()
-    db.close()
+    delay = settings.remote_execution.copy_retry_delay
+    for attempt in range(settings.remote_execution.copy_retries + 1):
+        progress[host] = 0
+        try:
+            upload(host, callback)
+            return
+        except COPY_TRANSIENT_ERRORS as e:
+            if attempt == settings.remote_execution.copy_retries:
+                raise
+            logger.warning("Copy to {} failed ({}), retrying in {} s", host, e, delay)
+            time.sleep(delay)
+            delay *= 2
 
 
-def secure_copy(host: str) -> bool:
+def _parallel_upload(
+    dialog: Dialog, hosts: list, size: int, upload: Callable[..., None], concurrency: int = None
+) -> Dict[str, Union[None, str]]:
     """
-    Copy ``SOURCE_PATH`` to the ``DESTINATION_PATH`` to ``host``.
+    Run the ``upload`` to all ``hosts`` in parallel and show the number of bytes uploaded in the gauge.
+
+    :param dialog: Instance of dialog engine.
+    :param hosts: List of hosts to upload to.
+    :param size: Number of bytes uploaded to each host.
+    :param upload: Function performing the upload, see :py:func:`_upload_with_retries`.
+    :param concurrency: Maximum number of hosts uploaded to at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to :py:obj:`None` if the upload succeeded, or to the error message otherwise.
+    """
+    total = size * len(hosts) or 1
+    progress = {}
+    results = {}
+    dialog.gauge_start()
+    with ThreadPoolExecutor(concurrency or settings.remote_execution.concurrency) as pool:
+        futures = {pool.submit(_upload_with_retries, host, upload, progress): host for host in hosts}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=COPY_PROGRESS_INTERVAL)
+            for future in done:
+                error = future.exception()
+                results[futures[future]] = None if error is None else str(error) or type(error).__name__
+            dialog.gauge_update(
+                int(sum(progress.values()) * 100 / total),
+                f"Copied to {len(results)} of {len(hosts)} hosts",
+                update_text=True,
+            )
+    dialog.gauge_update(100, "Completed", update_text=True)
+    dialog.gauge_stop()
+    return results
 
-    **Global parameters must be set first!**
 
-    :param host: IP address or host name.
-    :return: Return :py:obj:`True` if command has failed. Otherwise return :py:obj:`False`.
+def copy_files(
+    dialog: Dialog, source_path: str, hosts: list, destination_path: str, concurrency: int = None
+) -> Dict[str, Union[None, str]]:
     """
-    global SOURCE_PATH, DESTINATION_PATH
-    ssh_key = settings.remote_execution.ssh_key
-    user = settings.planetlab.slice
-    cmd = (
-        "scp -r -o PasswordAuthentication=no -o UserKnownHostsFile=/dev/null "
-        "-o StrictHostKeyChecking=no -o LogLevel=QUIET "
-        "-i %s %s %s@%s:%s" % (ssh_key, SOURCE_PATH, user, host, DESTINATION_PATH)
-    )
-    ret, stdout = run_command(cmd)
-    lock.acquire()
-    base.value = base.value + increment.value
-    DIALOG.gauge_update(int(base.value))
-    lock.release()
-    if ret != 0:
-        return True
-    return False
+    Perform copy of the file specified by ``source_path`` to the ``destination_path`` at the specified ``hosts``.
 
+    The file is uploaded to the hosts in parallel. The gauge shows the number of bytes uploaded to all the hosts.
+    Uploads failing on connection errors are retried, a failure on one host does not stop the others.
 
-def jobs_downloaded_artefacts(jobs: List[executor.PlbmngJob]) -> List[executor.PlbmngJob]:
-    """
-    Return all jobs that have artefacts downloaded.
+    :param dialog: Instance of dialog engine.
+    :param source_path: Path of the file to copy.
+    :param hosts: List of hosts on which the file should be copied.
+    :param destination_path: Path to the destination file that will be copied.
+    :param concurrency: Maximum number of hosts the file is uploaded to at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to :py:obj:`None` if the file was copied to it,
+        or to the error message otherwise.
+    """
+
+    def upload(host: str, callback: Callable[[int, int], None]) -> None:
+        sshlib.upload_file(
+            source_path,
+            destination_path,
+            key_filename=settings.remote_execution.ssh_key,
+            hostname=host,
+            username=settings.planetlab.slice,
+            callback=callback,
+        )
 
-    :param jobs: list of plbmng jobs to be looked up
-    :return: list of plbmng jobs that have artefacts downloaded
+    return _parallel_upload(dialog, hosts, os.path.getsize(source_path), upload, concurrency)
+
+
+def copy_directory(
+    dialog: Dialog, source_path: str, hosts: list, destination_path: str, concurrency: int = None
+) -> Dict[str, Union[None, str]]:
     """
-    return [job for job in jobs if Path(f"{get_remote_jobs_path()}/{job.hostname}/{job.job_id}").exists()]
+    Perform recursive copy of the ``source_path`` directory into the ``destination_path`` at the specified ``hosts``.
+
+    The directory is packed to a compressed tar archive once. The archive is then streamed to each host
+    over a single SSH channel and unpacked there on the fly, so that the copy costs no round trip per file.
+
+    :param dialog: Instance of dialog engine.
+    :param source_path: Path of the directory to copy.
+    :param hosts: List of hosts on which the directory should be copied.
+    :param destination_path: Directory on the hosts into which the content of the ``source_path`` is unpacked.
+        It is created if it does not exist.
+    :param concurrency: Maximum number of hosts the directory is uploaded to at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to :py:obj:`None` if the directory was copied to it,
+        or to the error message otherwise.
+    """
+    destination = shlex.quote(destination_path)
+    unpack_cmd = f"mkdir -p {destination} && tar -xzf - -C {destination}"
+
+    def upload(host: str, callback: Callable[[int, int], None]) -> None:
+        result = sshlib.pipe_file(
+            archive.name,
+            unpack_cmd,
+            hostname=host,
+            username=settings.planetlab.slice,
+            key_filename=settings.remote_execution.ssh_key,
+            callback=callback,
+        )
+        if result.return_code != 0:
+            raise OSError(result.stderr.strip() or f"Unpacking failed with exit code {result.return_code}")
 
+    with tempfile.NamedTemporaryFile(prefix="plbmng-upload-", suffix=".tar.gz") as archive:
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            tar.add(source_path, arcname=".")
+        archive.flush()
+        return _parallel_upload(dialog, hosts, os.path.getsize(archive.name), upload, concurrency)
 
-def parallel_copy(dialog, source_path: str, hosts: list, destination_path: str) -> bool:
+
+def sync_files(
+    dialog: Dialog, source_path: str, hosts: list, destination_path: str, concurrency: int = None
+) -> Dict[str, Union[None, str]]:
     """
-    Perform parallel copy of the local file to the remote host.
+    Synchronize the file or directory ``source_path`` to the ``destination_path`` at the specified ``hosts``.
+
+    Only the files that changed since they were last sent to the host are compared with it
+    and only their changed blocks are sent, see :py:func:`plbmng.lib.sync.sync_host`.
 
     :param dialog: Instance of dialog engine.
-    :param source_path: File or directory to be copied.
-    :param hosts: List of hosts(ip addressed or host names).
-    :param destination_path: Path on the target where should be file or directory copied to.
-    :return: True if source path has been copied successfully to all hosts.
-    """
-    global DIALOG, SOURCE_PATH, DESTINATION_PATH
-    DIALOG = dialog
-    SOURCE_PATH = source_path
-    DESTINATION_PATH = destination_path
-    increment = Value("f", 0)
-    increment.value = float(100 / len(hosts))
-    base = Value("f", 0)
-    lock = Lock()
-    DIALOG = dialog
-    dialog.gauge_start()
-    pool = Pool(initializer=multi_processing_init, initargs=(lock, base, increment))
-    ret = pool.map(secure_copy, hosts)
-    pool.close()
-    pool.join()
-    dialog.gauge_update(100, "Completed")
-    dialog.gauge_stop()
-    # if ret is empty list, return False
-    if not ret:
-        return False
-    # any -> If at least one scp command failed(secure_copy returned True), return False
-    return not any(ret)
+    :param source_path: Path of the file or directory to synchronize.
+    :param hosts: List of hosts on which the files should be synchronized.
+    :param destination_path: Path of the file, or of the directory the content of the ``source_path``
+        directory is synchronized into, on the hosts.
+    :param concurrency: Maximum number of hosts synchronized at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to :py:obj:`None` if the files were synchronized,
+        or to the error message otherwise.
+    """
+    files = sync.local_files(source_path, destination_path)
+    manifest = sync.SyncManifest()
+
+    def upload(host: str, callback: Callable[[int, int], None]) -> None:
+        sync.sync_host(host, files, manifest, callback)
+
+    return _parallel_upload(dialog, hosts, sum(digest.size for digest in files.values()), upload, concurrency)
 
 
-def copy_files(dialog: Dialog, source_path: str, hosts: list, destination_path: str) -> bool:
+def relay_files(
+    dialog: Dialog, source_path: str, hosts: list, destination_path: str, db
+) -> Dict[str, Union[None, str]]:
     """
-    Perform copy of the file specified by ``source_path`` to the ``destination_path`` at the specified ``hosts``.
+    Distribute the file ``source_path`` to the ``destination_path`` at the ``hosts`` through the nodes themselves.
+
+    The controller sends the file only to a few nodes with the lowest latency, the nodes relay it to the
+    nearest other nodes, see :py:mod:`plbmng.lib.relay`. Checksum of the file is verified on every node.
+    :py:class:`plbmng.lib.relay.RelayCredentialsError` is raised before anything is sent if the nodes
+    have no credentials to connect to each other.
 
     :param dialog: Instance of dialog engine.
-    :param source_path: Path of the file to copy.
+    :param source_path: Path of the file to distribute.
     :param hosts: List of hosts on which the file should be copied.
-    :param destination_path: Path to the destination file that will be copied.
-    :return: :py:obj:`True` if all copy operations were performed successfully, :py:obj:`False` otherwise.
+    :param destination_path: Path to the destination file on the hosts.
+    :param db: plbmng database with the latencies of the nodes.
+    :type db: PlbmngDb
+    :return: Dictionary mapping each host to :py:obj:`None` if the file was copied to it,
+        or to the error message otherwise.
     """
-    ssh_key = settings.remote_execution.ssh_key
-    user = settings.planetlab.slice
+    relay.check_credentials()
+    plan = relay.plan_tree(hosts, db.get_latencies(hosts))
+    logger.info(
+        "Relaying {} to {} hosts from {} seeds in {} rounds", source_path, len(hosts), len(plan.seeds), plan.depth()
+    )
+    finished = []
+
+    def callback(host: str, error: Union[None, str]) -> None:  # noqa: U100
+        finished.append(host)
+        dialog.gauge_update(
+            int(len(finished) * 100 / len(hosts)), f"Copied to {len(finished)} of {len(hosts)} hosts", update_text=True
+        )
+
     dialog.gauge_start()
-    # TODO: Parallelize this method and work properly with gauges.
-    # TODO: Add possibility to copy directories recursively.
-    for host in hosts:
-        try:
-            sshlib.upload_file(source_path, destination_path, key_filename=ssh_key, hostname=host, username=user)
-        except OSError:
-            return False
-    dialog.gauge_update(100, "Completed")
-    return True
+    results = relay.distribute(source_path, destination_path, plan, callback=callback)
+    dialog.gauge_update(100, "Completed", update_text=True)
+    dialog.gauge_stop()
+    return results
 
 
-def run_remote_command(dialog: Dialog, command: str, hosts: list) -> bool:
+def run_remote_command(
+    dialog: Dialog, command: str, hosts: list, concurrency: int = None, on_output=None
+) -> Dict[str, sshlib.SSHCommandResult]:
     """
-    Run ``command`` on the specified ``hosts``.
+    Run ``command`` on all the specified ``hosts`` in parallel.
+
+    A failure on one host does not stop the command on the others. The gauge is updated
+    every time the command finishes on a host.
+
+    Output is read as it arrives. Only ``output_spill_threshold`` bytes of each stream are kept in memory,
+    bigger output is moved to ``<host>.stdout`` and ``<host>.stderr`` files in a temporary directory.
 
     :param dialog: Instance of dialog.
     :param command: Command to be run on the specified ``hosts``.
     :param hosts: List of hosts on which the ``command`` should be executed.
-    :return: :py:obj:`True` if all commands ended successfully, :py:obj:`False` otherwise.
-    """
-    ssh_key = settings.remote_execution.ssh_key
-    user = settings.planetlab.slice
+    :param concurrency: Maximum number of hosts the command runs on at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :param on_output: Function called as ``on_output(host, stream, line)`` with every line of the output,
+        ``stream`` is either ``stdout`` or ``stderr``.
+    :return: Dictionary mapping each host to the :py:class:`plbmng.lib.ssh.StreamedCommandResult` of the ``command``.
+        ``return_code`` is :py:obj:`None` if the command could not be run or did not finish in time,
+        ``stderr`` then contains the error. ``duration`` includes connecting to the host and starting the command.
+    """
+    results = {}
     dialog.gauge_start()
-    # TODO: Parallelize this method and work properly with gauges.
+    spill_dir = tempfile.mkdtemp(prefix="plbmng-output-")
+    spill_threshold = settings.remote_execution.output_spill_threshold
+    client = ParallelSSHClient(
+        hosts,
+        user=settings.planetlab.slice,
+        pkey=settings.remote_execution.ssh_key,
+        pool_size=concurrency or settings.remote_execution.concurrency,
+        timeout=settings.remote_execution.connection_timeout,
+        num_retries=1,
+    )
+    started_at = time.monotonic()
+    output = client.run_command(command, stop_on_errors=False, read_timeout=settings.remote_execution.command_timeout)
+
+    def capture(host: str, stream: str, lines, output: sshlib.CommandOutput) -> None:
+        for line in lines:
+            output.write(line + "\n")
+            if on_output is not None:
+                on_output(host, stream, line)
+
+    def collect(host_output) -> Tuple[str, sshlib.SSHCommandResult]:
+        host = host_output.host
+        stdout, stderr = (
+            sshlib.CommandOutput(f"{spill_dir}/{host}.{stream}", spill_threshold) for stream in ("stdout", "stderr")
+        )
+        return_code = None
+        if host_output.exception is not None:
+            error = host_output.exception
+            stderr.write(str(error) or type(error).__name__)
+        else:
+            try:
+                # stderr is read concurrently, so that the command does not block on its full stderr pipe
+                reader = spawn(capture, host, "stderr", host_output.stderr, stderr)
+                capture(host, "stdout", host_output.stdout, stdout)
+                reader.get()
+                host_output.client.wait_finished(host_output)
+                return_code = host_output.exit_code
+            except Timeout:
+                stderr.write("Command did not finish in time")
+        stdout.close()
+        stderr.close()
+        result = sshlib.StreamedCommandResult(stdout, stderr, return_code)
+        result.duration = round(time.monotonic() - started_at, 3)
+        return host, result
+
+    greenlets = [spawn(collect, host_output) for host_output in output]
+    for finished, greenlet in enumerate(iwait(greenlets), 1):
+        host, results[host] = greenlet.get()
+        dialog.gauge_update(
+            int(finished * 100 / len(greenlets)), f"Finished on {finished} of {len(greenlets)} hosts", update_text=True
+        )
+    dialog.gauge_update(100, "Completed", update_text=True)
+    dialog.gauge_stop()
     try:
-        for host in hosts:
-            sshlib.command(command, hostname=host, username=user, key_filename=ssh_key)
-        dialog.gauge_update(100, "Completed")
-    except Exception:
-        return False
-    return True
+        # keep the directory only if some output was spilled into it
+        os.rmdir(spill_dir)
+    except OSError:
+        logger.info("Output of the remote command was saved to {}", spill_dir)
+    return results
 
 
 def get_remote_jobs(host: str) -> List[executor.PlbmngJob]:
     """
-    Return all jobs found in the *jobs.json* of the given ``host``.
+    Return all jobs of the given ``host``.
+
+    The executor on the ``host`` prints the current state of its jobs, i.e. the *jobs.json* file
+    with its journal replayed, see :py:class:`plbmng.executor.PlbmngJobsJournal`.
 
     :param host: The ``host`` whose entities are to be returned.
+    :raises OSError: if the jobs could not be read on the ``host``
     :return: List of jobs for the given ``host``.
     """
-    with executor.PlbmngJobsFile(f"{get_remote_jobs_path()}/jobs.json_{host}") as jobs:
-        return jobs.jobs
+    with tempfile.TemporaryDirectory(prefix="plbmng-jobs-") as spill_dir:
+        result = _run_executor(
+            host,
+            'python3 "$executor" --dump',
+            lambda cmd: sshlib.stream_command(cmd, spill_dir=spill_dir, **_executor_ssh_args(host)),
+        )
+        if result.return_code != 0:
+            raise OSError((result.stderr or "").strip() or f"Could not read the jobs, exit code {result.return_code}")
+        if result.stdout is None:
+            with open(result.stdout_file) as stdout_file:
+                jobs = json.load(stdout_file)
+        else:
+            jobs = json.loads(result.stdout)
+    return [executor.PlbmngJob(**job) for job in jobs]
+
+
+def fetch_remote_jobs(hosts: List[str], concurrency: int = None) -> Dict[str, Union[List[executor.PlbmngJob], str]]:
+    """
+    Return all jobs of the ``hosts``, see :py:func:`get_remote_jobs`.
+
+    :param hosts: Hosts whose jobs are to be returned.
+    :param concurrency: Maximum number of hosts queried at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :return: Dictionary mapping each host to the list of its jobs, or to the error message if they could not be read.
+    """
+    results = {}
+    with ThreadPoolExecutor(concurrency or settings.remote_execution.concurrency) as pool:
+        futures = {pool.submit(get_remote_jobs, host): host for host in hosts}
+        for future in as_completed(futures):
+            error = future.exception()
+            results[futures[future]] = future.result() if error is None else str(error) or type(error).__name__
+    return results
 
 
 def delete_jobs(db, jobs: List[executor.PlbmngJob]) -> None:
@@ -880,49 +1116,40 @@ def delete_jobs(db, jobs: List[executor.PlbmngJob]) -> None:
     hosts: Dict[str, List[executor.PlbmngJob]] = {host: list(jobs) for host, jobs in hosts}
 
     delete_remote_host_jobs(hosts)
+    db.delete_jobs(jobs)
     for host in hosts:
-        for job in hosts[host]:
-            delete_job(db, job)
+        _delete_local_artefacts(host)
 
 
 def delete_remote_host_jobs(hosts: Dict[str, List[executor.PlbmngJob]]) -> None:
     """
     Delete :py:class:`plbmng.executor.PlbmngJob`/s from the remote hosts.
 
+    The executor on each host appends the deletions to the journal of its *jobs.json* file,
+    so the jobs which changed their state in the meantime are not overwritten.
+
     :param hosts: Dictionary containing hosts. For each host a list of jobs is defined.
+    :raises OSError: if the jobs could not be deleted on any of the hosts
     """
-    hosts_list = list(hosts.keys())
-    ssh_key = settings.remote_execution.ssh_key
-    user = settings.planetlab.slice
-    file_name = "jobs.json"
-    separator = "_"
 
-    # get jobs.json from the host
-    client = ParallelSSHClient(hosts_list, user=user, pkey=ssh_key)
-    cmds = client.copy_remote_file(
-        f"/home/{user}/.plbmng/{file_name}", f"{get_remote_jobs_path()}/{file_name}", suffix_separator=separator
-    )
-    joinall(cmds, raise_error=True)
+    def delete(host: str) -> None:
+        job_ids = " ".join(shlex.quote(job.job_id) for job in hosts[host])
+        result = _run_executor(
+            host,
+            f'python3 "$executor" --delete {job_ids}',
+            lambda cmd: sshlib.command(cmd, **_executor_ssh_args(host)),
+        )
+        if result.return_code != 0:
+            raise OSError(result.stderr.strip() or f"exit code {result.return_code}")
 
-    # remove jobs from jobs.json
-    for host in hosts:
-        try:
-            with executor.PlbmngJobsFile(f"{get_remote_jobs_path()}/{file_name}{separator}{host}") as jf:
-                for job in hosts[host]:
-                    jf.del_job(job)
-        except Exception:
-            pass  # ignore all exceptions raised during manipulation with jobs file
-
-    # copy jobs.json back to the host
-    copy_args = [
-        {
-            "local_file": f"{get_remote_jobs_path()}/{file_name}{separator}{host}",
-            "remote_file": f"/home/{user}/.plbmng/{file_name}",
-        }
-        for host in hosts_list
-    ]
-    cmds = client.copy_file("%(local_file)s", "%(remote_file)s", copy_args=copy_args)
-    joinall(cmds, raise_error=True)
+    errors = []
+    with ThreadPoolExecutor(settings.remote_execution.concurrency) as pool:
+        futures = {pool.submit(delete, host): host for host in hosts}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                errors.append(f"{futures[future]}: {future.exception()}")
+    if errors:
+        raise OSError("Could not delete the jobs on the hosts: " + "; ".join(sorted(errors)))
 
 
 def delete_job(db, job: plbmng.executor.PlbmngJob) -> None:
@@ -933,7 +1160,12 @@ def delete_job(db, job: plbmng.executor.PlbmngJob) -> None:
     :type db: PlbmngDb
     :param job: job to be deleted
     """
+    # delete from database
+    db.delete_job(job)
+    _delete_local_artefacts(job.hostname)
+
 
+def _delete_local_artefacts(host: str) -> None:
     def rm_tree(pth):
         pth = Path(pth)
         for child in pth.glob("*"):
@@ -943,10 +1175,8 @@ def delete_job(db, job: plbmng.executor.PlbmngJob) -> None:
                 rm_tree(child)
         pth.rmdir()
 
-    # delete from database
-    db.delete_job(job)
     # delete job artefacts
-    files_to_delete = [f"{get_remote_jobs_path()}/jobs.json_{job.hostname}", f"{get_remote_jobs_path()}/{job.hostname}"]
+    files_to_delete = [f"{get_remote_jobs_path()}/jobs.json_{host}", f"{get_remote_jobs_path()}/{host}"]
     for file in files_to_delete:
         try:
             if Path(file).is_file():
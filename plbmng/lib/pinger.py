@@ -0,0 +1,172 @@
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from platform import system
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from plbmng.lib import resolver
+from plbmng.utils.logger import logger
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+PAYLOAD = b"plbmng".ljust(56, b"\0")
+PING_WORKERS = 32
+
+_SYSTEM = system().lower()
+if _SYSTEM == "windows":
+    _PING_ARGS = ["-n", "1"]
+    _PING_AVG = re.compile("Average = ([0-9]+)ms")
+else:
+    # for Linux ping parameter takes seconds while MAC OS ping takes milliseconds
+    _PING_ARGS = ["-c", "1", "-W", "1" if _SYSTEM == "linux" else "800"]
+    _PING_AVG = re.compile("min/avg/max/[a-z]+ = [0-9.]+/([0-9.]+)/[0-9.]+/[0-9.]+")
+
+
+def checksum(data: bytes) -> int:
+    """
+    Compute Internet checksum of the ``data`` as defined by RFC 1071.
+
+    :param data: ICMP message with the checksum field set to zero.
+    :return: 16-bit checksum.
+    """
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(identifier: int, sequence: int) -> bytes:
+    """
+    Build ICMP echo request message.
+
+    :param identifier: ICMP identifier. Kernel replaces it when datagram ICMP socket is used.
+    :param sequence: ICMP sequence number used to pair the reply with the request.
+    :return: ICMP echo request ready to be sent.
+    """
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum(header + PAYLOAD), identifier, sequence)
+    return header + PAYLOAD
+
+
+def _open_socket() -> Tuple[socket.socket, bool]:
+    """
+    Open unprivileged datagram ICMP socket, or raw ICMP socket if datagram one is not allowed.
+
+    :return: The socket and flag telling whether it is a raw one.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError:
+        # datagram ICMP sockets are allowed only for groups in the net.ipv4.ping_group_range sysctl
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+
+def _parse_reply(data: bytes) -> Optional[Tuple[int, int]]:
+    # raw sockets (and datagram ones on some systems) receive the IP header as well
+    if data and data[0] >> 4 == 4:
+        header_length = (data[0] & 0x0F) * 4
+        data = data[header_length:]
+    if len(data) < 8:
+        return None
+    icmp_type, _, _, identifier, sequence = struct.unpack("!BBHHH", data[:8])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return identifier, sequence
+
+
+def subprocess_ping(target: str) -> Optional[float]:
+    """
+    Ping the ``target`` using the system ``ping`` tool.
+
+    Used as a fallback if the ICMP socket can not be opened.
+
+    :param target: Host name or IP address.
+    :return: Round trip time in milliseconds or :py:obj:`None` if the ``target`` did not respond.
+    """
+    p = subprocess.Popen(["ping", *_PING_ARGS, target], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    avg_str = _PING_AVG.findall(str(p.communicate()[0]))
+    if p.returncode != 0 or not avg_str:
+        return None
+    return float(avg_str[0])
+
+
+def ping_hosts(hosts: Iterable[str], timeout: float = 1.0) -> Dict[str, Optional[float]]:
+    """
+    Send ICMP echo request to all ``hosts`` in one pass and gather the replies.
+
+    A single ICMP socket is used for all ``hosts``. If the kernel allows neither datagram
+    nor raw ICMP sockets, every host is pinged by the system ``ping`` tool instead.
+    Host names are resolved through the shared :py:mod:`plbmng.lib.resolver` cache.
+
+    :param hosts: Host names or IP addresses.
+    :param timeout: Time in seconds to wait for the reply after the last request was sent.
+    :return: Dictionary mapping each host to its round trip time in milliseconds,
+        or to :py:obj:`None` if the host did not respond.
+    """
+    addresses = resolver.resolve_many(hosts)
+    rtts = dict.fromkeys(addresses)
+    try:
+        sock, raw = _open_socket()
+    except OSError as e:
+        logger.info("ICMP socket not available ({}), falling back to the ping tool", e)
+        resolved = [(host, ip) for host, ip in addresses.items() if ip]
+        with ThreadPoolExecutor(PING_WORKERS) as pool:
+            rtts.update(zip((host for host, _ in resolved), pool.map(subprocess_ping, (ip for _, ip in resolved))))
+        return rtts
+
+    identifier = os.getpid() & 0xFFFF
+    pending = {}  # (ip, sequence) -> (host, time the request was sent)
+    requests = [(host, ip) for host, ip in addresses.items() if ip]
+    with sock:
+        sock.setblocking(False)
+        sequence = 0
+        deadline = time.monotonic() + timeout
+        while pending or requests:
+            if requests:
+                host, ip = requests.pop()
+                sequence = (sequence + 1) & 0xFFFF
+                try:
+                    sock.sendto(echo_request(identifier, sequence), (ip, 0))
+                except OSError as e:
+                    logger.debug("Sending ICMP echo request to {} failed: {}", host, e)
+                else:
+                    pending[(ip, sequence)] = host, time.monotonic()
+                    deadline = time.monotonic() + timeout
+            wait = 0 if requests else deadline - time.monotonic()
+            if wait < 0:
+                break
+            readable, _, _ = select.select([sock], [], [], wait)
+            while readable:
+                try:
+                    data, (ip, _) = sock.recvfrom(1024)
+                except BlockingIOError:
+                    break
+                received_at = time.monotonic()
+                reply = _parse_reply(data)
+                if reply is None or (raw and reply[0] != identifier):
+                    continue
+                host, sent_at = pending.pop((ip, reply[1]), (None, None))
+                if host is not None:
+                    rtts[host] = round((received_at - sent_at) * 1000, 3)
+    return rtts
+
+
+def ping(target: str, timeout: float = 1.0) -> Optional[float]:
+    """
+    Ping single ``target``.
+
+    :param target: Host name or IP address.
+    :param timeout: Time in seconds to wait for the reply.
+    :return: Round trip time in milliseconds or :py:obj:`None` if the ``target`` did not respond.
+    """
+    return ping_hosts([target], timeout)[target]
@@ -1,31 +1,56 @@
 #!/usr/bin/env python
 import argparse
-import codecs
+import csv
+import json
 import logging
-import socket
+import os
 import sys
 import traceback
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from time import asctime
 from time import localtime
+from time import monotonic
 from time import sleep
 from time import time
+from typing import Dict
+from typing import Iterable
+from typing import List
 from typing import Union
 
 import geocoder
 
+from plbmng.lib import resolver
+from plbmng.utils.config import get_db_path
+
 plc_host = "www.planet-lab.eu"
 
 auth = {"AuthMethod": "password", "AuthString": "", "Username": ""}
 
-arg = {"path": "", "id": 1, "start_id": 1, "quiet": False}
+arg = {
+    "path": "",
+    "id": 1,
+    "start_id": 1,
+    "quiet": False,
+    "offline_geocoder": False,
+    "incremental": False,
+    "delta_output": None,
+}
 
 api_url = f"https://{plc_host}:443/PLCAPI/"
 plc_api = xmlrpc.client.ServerProxy(api_url, allow_none=True)
 
 locations = {}
 
+GEOCODE_INTERVAL = 1  # Usage policy https://operations.osmfoundation.org/policies/nominatim/
+
+NODE_FILE_HEADER = "# ID\tIP\tDNS\tCONTINENT\tCOUNTRY\tREGION\tCITY\tURL\tFULL NAME\tLATITUDE\tLONGITUDE\n"
+# keys of the node dictionary in the order of the node file columns following the ID
+NODE_FIELDS = ["ip", "hostname", "continent", "country", "region", "city", "url", "name", "latitude", "longitude"]
+LOCATION_FIELDS = ["city", "region", "country", "continent"]
+SITE_FIELDS = ["latitude", "longitude", "url", "name"]
+
 continents = {
     "AD": "EU",
     "AE": "AS",
@@ -282,6 +307,28 @@ def arguments() -> None:
     parser.add_argument("-o", "--output", required=True, action="store", help="File where you want to save output.")
     parser.add_argument("--start_id", type=int, help="ID for the first node")
     parser.add_argument("-q", "--quiet", action="store_true", default=False, help="Suppress stdout")
+    parser.add_argument(
+        "--invalidate-geocode-cache",
+        action="store_true",
+        default=False,
+        help="Drop the cached locations of all sites and geocode them again.",
+    )
+    parser.add_argument(
+        "--offline-geocoder",
+        action="store_true",
+        default=False,
+        help="Do not contact OpenStreetMap, locations not found in the cache are left unknown.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Enrich only the nodes which were added or changed since the OUTPUT was written.",
+    )
+    parser.add_argument(
+        "--delta-output",
+        help="File where the hostnames of added, changed and removed nodes are saved as JSON.",
+    )
     args, unknown_argument = parser.parse_known_args()
     if args.username:
         auth["Username"] = args.username
@@ -301,6 +348,18 @@ def arguments() -> None:
     if args.quiet:
         arg["quiet"] = True
 
+    if args.invalidate_geocode_cache:
+        invalidate_geocode_cache()
+
+    if args.offline_geocoder:
+        arg["offline_geocoder"] = True
+
+    if args.incremental:
+        arg["incremental"] = True
+
+    if args.delta_output:
+        arg["delta_output"] = args.delta_output
+
     if unknown_argument:
         logging.error("Unknown argument")
         sys.exit(1)
@@ -325,57 +384,205 @@ def get_ip_address(hostname: str) -> Union[str, None]:
     """
     Translate hostname to IP address.
 
+    Addresses are cached by :py:mod:`plbmng.lib.resolver`, so nodes already resolved by plbmng are not resolved again.
+
     :param hostname: HOSTNAME
     :return: if hostname cannot be translated to IP address returns None. Otherwise it returns IP address as a string.
     """
-    if hostname is not None or hostname == "":
-        try:
-            ip_addr = socket.gethostbyname(hostname)
-            return ip_addr
-        except socket.error:
-            pass
+    if hostname:
+        return resolver.resolve(hostname)
     return None
 
 
-def append_to_file(node: dict) -> None:
+def get_interfaces(interface_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    Fetch IP addresses of all interfaces in a single PLCAPI call.
+
+    :param interface_ids: IDs of the interfaces.
+    :return: Dictionary mapping interface ID to its IP address.
+    """
+    interface_ids = list(interface_ids)
+    if not interface_ids:
+        return {}
+    interfaces = plc_api.GetInterfaces(auth, {"interface_id": interface_ids}, ["interface_id", "ip"])
+    return {interface["interface_id"]: interface["ip"] for interface in interfaces}
+
+
+def get_sites(site_ids: Iterable[int]) -> Dict[int, dict]:
+    """
+    Fetch all sites in a single PLCAPI call.
+
+    :param site_ids: IDs of the sites, duplicates are fetched only once.
+    :return: Dictionary mapping site ID to the site information.
+    """
+    site_ids = list(set(site_ids))
+    if not site_ids:
+        return {}
+    sites = plc_api.GetSites(auth, site_ids, ["site_id", "latitude", "longitude", "url", "name"])
+    return {site["site_id"]: site for site in sites}
+
+
+def reverse_geocode(latitude: float, longitude: float) -> List[str]:
+    """
+    Find the location of the given coordinates using OpenStreetMap.
+
+    :param latitude: latitude of the place
+    :param longitude: longitude of the place
+    :return: city, region, country and continent of the place
     """
-    Write information about a node into the file.
+    g = geocoder.osm([latitude, longitude], method="reverse")
+    country = "unknown"
+    continent = "unknown"
+    if g.country_code is not None:
+        country = g.country_code.upper()
+        continent = get_continent(g.country_code)
+    return [g.city, g.county, country, continent]
+
+
+def offline_reverse_geocode(latitude: float, longitude: float) -> List[str]:  # noqa: U100
+    """
+    Stand-in for :py:func:`reverse_geocode` which does not access the network.
+
+    :param latitude: latitude of the place
+    :param longitude: longitude of the place
+    :return: unknown city, region, country and continent
+    """
+    return ["unknown", "unknown", "unknown", "unknown"]
+
+
+def load_geocode_cache() -> Dict[str, dict]:
+    """
+    Load the persistent geocode cache from the plbmng database directory.
+
+    :return: Dictionary mapping site ID to its coordinates and location.
+    """
+    try:
+        with open(get_db_path("geocode_cache", failsafe=True)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_geocode_cache(cache: Dict[str, dict]) -> None:
+    """
+    Atomically write the geocode cache to the plbmng database directory.
+
+    :param cache: Dictionary mapping site ID to its coordinates and location.
+    """
+    path = get_db_path("geocode_cache", failsafe=True)
+    try:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as err:
+        logging.error("Could not write the geocode cache %s: %s", path, err)
+
+
+def invalidate_geocode_cache() -> None:
+    """Drop the cached locations of all sites."""
+    save_geocode_cache({})
+    locations.clear()
+
+
+def geocode_sites(sites: Iterable[dict]) -> None:
+    """
+    Find the location of every site which is not in :py:data:`locations` yet and store it there.
+
+    Locations are kept in the persistent geocode cache keyed by site ID, so only new sites and sites
+    whose coordinates have changed are geocoded. Requests are sent one by one, at most one per
+    :py:data:`GEOCODE_INTERVAL` seconds. With the ``offline_geocoder`` argument set the sites missing
+    in the cache are looked up by :py:func:`offline_reverse_geocode` and are not stored in the cache.
+
+    :param sites: sites as returned by :py:func:`get_sites`
+    """
+    cache = load_geocode_cache()
+    last_request = None
+    try:
+        for site in sites:
+            if site["site_id"] in locations:
+                continue
+            if site["latitude"] is None or site["longitude"] is None:
+                locations[site["site_id"]] = ["unknown", "unknown", "unknown", "unknown"]
+                continue
+            cached = cache.get(str(site["site_id"]))
+            if cached and (cached["latitude"], cached["longitude"]) == (site["latitude"], site["longitude"]):
+                locations[site["site_id"]] = cached["location"]
+                continue
+            if arg["offline_geocoder"]:
+                locations[site["site_id"]] = offline_reverse_geocode(site["latitude"], site["longitude"])
+                continue
+            if last_request is not None:
+                sleep(max(0, last_request + GEOCODE_INTERVAL - monotonic()))
+            last_request = monotonic()
+            locations[site["site_id"]] = reverse_geocode(site["latitude"], site["longitude"])
+            cache[str(site["site_id"])] = {
+                "latitude": site["latitude"],
+                "longitude": site["longitude"],
+                "location": locations[site["site_id"]],
+            }
+    finally:
+        # keep the sites geocoded so far even if the run was interrupted
+        if last_request is not None:
+            save_geocode_cache(cache)
+
+
+def read_node_file(path: str) -> Dict[str, dict]:
+    """
+    Read nodes from the node file previously written by :py:func:`run`.
+
+    :param path: path to the node file
+    :return: Dictionary mapping hostname to the node. Empty if the file does not exist.
+    """
+    columns = ["id"] + NODE_FIELDS
+    try:
+        with open(path, encoding="utf-8") as f:
+            csv_reader = csv.reader(f, delimiter="\t")
+            next(csv_reader, None)
+            return {row[2]: dict(zip(columns, row)) for row in csv_reader if len(row) == len(columns)}
+    except OSError:
+        return {}
+
+
+def format_node(node: dict) -> str:
+    """
+    Format information about a node as a line of the node file.
 
     :param node: dictionary containing information about a node
+    :return: tab separated line
     """
-    if arg["id"] == arg["start_id"]:
-        try:
-            f = open(arg["path"], "w")
-            f.write("# ID\tIP\tDNS\tCONTINENT\tCOUNTRY\tREGION\tCITY\tURL\tFULL NAME\tLATITUDE\tLONGITUDE\n")
-            f.close()
-        except Exception as err:
-            traceback.print_exc()
-            logging.error(err)
-            sys.exit(1)
+    return "\t".join([str(arg["id"])] + [str(node[field]) for field in NODE_FIELDS]) + "\n"
+
 
+def write_node_file(lines: List[str]) -> None:
+    """
+    Atomically replace the node file with the given lines in a single write.
+
+    :param lines: lines as returned by :py:func:`format_node`
+    """
+    tmp_path = f"{arg['path']}.tmp"
     try:
-        with codecs.open(arg["path"], mode="a", encoding="utf-8") as f:
-            f.write(
-                "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
-                    str(arg["id"]),
-                    node["ip"],
-                    node["hostname"],
-                    node["continent"],
-                    node["country"],
-                    node["region"],
-                    node["city"],
-                    node["url"],
-                    node["name"],
-                    node["latitude"],
-                    node["longitude"],
-                )
-            )
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(NODE_FILE_HEADER + "".join(lines))
+        os.replace(tmp_path, arg["path"])
     except Exception as err:
         traceback.print_exc()
         logging.error(err)
         sys.exit(1)
 
 
+def write_delta(delta: Dict[str, List[str]]) -> None:
+    """
+    Write the hostnames of added, changed and removed nodes to the ``delta_output`` file as JSON.
+
+    :param delta: dictionary with ``added``, ``changed`` and ``removed`` lists of hostnames
+    """
+    try:
+        with open(arg["delta_output"], "w") as f:
+            json.dump(delta, f)
+    except OSError as err:
+        logging.error("Could not write the delta %s: %s", arg["delta_output"], err)
+
+
 def print_info(node: dict) -> None:
     """
     Print information about a node.
@@ -410,7 +617,16 @@ def print_info(node: dict) -> None:
     )
 
 
-def run(path=None, username=None, password=None, start_id=None, quiet=False, return_output=False) -> Union[None, list]:
+def run(
+    path=None,
+    username=None,
+    password=None,
+    start_id=None,
+    quiet=False,
+    return_output=False,
+    offline_geocoder=False,
+    incremental=False,
+) -> Union[None, list]:
     """
     Create output file with all information about the nodes.
 
@@ -428,6 +644,10 @@ def run(path=None, username=None, password=None, start_id=None, quiet=False, ret
         Optional: default=:py:obj:`False`
     :param return_output: boolean value deciding whether to return output as list of nodes.
         Optional: default=:py:obj:`False`
+    :param offline_geocoder: boolean value deciding whether to use :py:func:`offline_reverse_geocode`
+        for the sites missing in the geocode cache. Optional: default=:py:obj:`False`
+    :param incremental: boolean value deciding whether to enrich only the nodes added or changed since
+        the file in path was written. Optional: default=:py:obj:`False`
     :return: lib/default2.node file, which contains following information about node:
         - ID
         - IP address
@@ -451,53 +671,70 @@ def run(path=None, username=None, password=None, start_id=None, quiet=False, ret
             arg[start_id] = start_id
         if quiet:
             arg["quiet"] = quiet
+        if offline_geocoder:
+            arg["offline_geocoder"] = offline_geocoder
+        if incremental:
+            arg["incremental"] = incremental
     try:
         all_nodes = plc_api.GetNodes(auth, {"-SORT": "node_id"}, ["site_id", "hostname", "interface_ids"])
+        interfaces = get_interfaces(node["interface_ids"][0] for node in all_nodes if node["interface_ids"])
+        sites = get_sites(node["site_id"] for node in all_nodes)
+        previous = read_node_file(arg["path"]) if arg["incremental"] else {}
+        empty_site = dict.fromkeys(SITE_FIELDS)
+        for node in all_nodes:
+            node.update((key, sites.get(node["site_id"], empty_site)[key]) for key in SITE_FIELDS)
+            old = previous.get(node["hostname"])
+            # location depends only on the site, so it is kept for the nodes whose site did not change
+            node["site_changed"] = old is None or any(
+                old[key] != str("unknown" if node[key] is None else node[key]) for key in SITE_FIELDS
+            )
+        changed_sites = {node["site_id"] for node in all_nodes if node["site_changed"]}
+        to_geocode = [site for site_id, site in sites.items() if site_id in changed_sites]
+        with ThreadPoolExecutor(max_workers=1) as geocoding_worker:
+            # geocoding is rate limited, resolve the nodes without interface meanwhile
+            geocoding = geocoding_worker.submit(geocode_sites, to_geocode)
+            addresses = resolver.resolve_many(node["hostname"] for node in all_nodes if not node["interface_ids"])
+            geocoding.result()
+
+        lines = []
+        delta = {"added": [], "changed": [], "removed": []}
         for node in all_nodes:
-            if len(node["interface_ids"]):
-                interfaces = plc_api.GetInterfaces(auth, {"interface_id": node["interface_ids"][0]}, ["ip"])
-                if len(interfaces) > 0:
-                    node.update(interfaces[0])
-                else:
-                    node.update({"ip": "unknown"})
+            if node["interface_ids"]:
+                node["ip"] = interfaces.get(node["interface_ids"][0], "unknown")
             else:
-                addr = get_ip_address(node["hostname"])
-                node["ip"] = addr
-
-            node.update(plc_api.GetSites(auth, node["site_id"], ["latitude", "longitude", "url", "name"])[0])
-
-            if node["site_id"] in list(locations.keys()):
-                location = locations[node["site_id"]]
-                node.update(
-                    {"city": location[0], "region": location[1], "country": location[2], "continent": location[3]}
-                )
+                node["ip"] = addresses[node["hostname"]]
+            old = previous.get(node["hostname"])
+            if node.pop("site_changed"):
+                location = locations.get(node["site_id"], ["unknown", "unknown", "unknown", "unknown"])
+                node.update(zip(LOCATION_FIELDS, location))
             else:
-                sleep(1)  # Usage policy https://operations.osmfoundation.org/policies/nominatim/
-                if node["latitude"] is not None and node["longitude"] is not None:
-                    g = geocoder.osm([node["latitude"], node["longitude"]], method="reverse")
-                    node["city"] = g.city
-                    node["region"] = g.county
-                    node["country"] = "unknown"
-                    node["continent"] = "unknown"
-                    if g.country_code is not None:
-                        node["country"] = g.country_code.upper()
-                        node["continent"] = get_continent(g.country_code)
-                    locations.update(
-                        {node["site_id"]: [node["city"], node["region"], node["country"], node["continent"]]}
-                    )
-                else:
-                    node.update({"city": "unknown", "region": "unknown", "country": "unknown", "continent": "unknown"})
+                node.update((key, old[key]) for key in LOCATION_FIELDS)
 
             # if value is None it is changed to unknown in info dictionary about node
             for value in list(node.values()):
                 if value is None:
                     node[list(node.keys())[list(node.values()).index(value)]] = "unknown"
 
-            append_to_file(node)
+            if old is None:
+                delta["added"].append(node["hostname"])
+            elif any(old[key] != str(node[key]) for key in NODE_FIELDS):
+                delta["changed"].append(node["hostname"])
+            lines.append(format_node(node))
             if not arg["quiet"]:
                 print_info(node)
             arg["id"] += 1
 
+        write_node_file(lines)
+        delta["removed"] = sorted(previous.keys() - {node["hostname"] for node in all_nodes})
+        logging.info(
+            "Added %d, changed %d and removed %d nodes",
+            len(delta["added"]),
+            len(delta["changed"]),
+            len(delta["removed"]),
+        )
+        if arg["delta_output"]:
+            write_delta(delta)
+
     except (KeyboardInterrupt, SystemExit):
         logging.error("Program stopped by user. Exiting....")
         sys.exit(1)
@@ -1,20 +1,32 @@
 #! /usr/bin/env python3
+import asyncio
 import socket
 import sys
+import time
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
+from plbmng.lib import resolver
+
 
 def test_port_availability(hostname: str, port: int) -> Union[bool, int]:
     """
     Test availability of a given port on host.
 
+    The host name is resolved through the shared :py:mod:`plbmng.lib.resolver` cache.
+
     :param hostname: Host name of a host.
     :param port: Port number to check if is availibale.
     :return: Return :py:obj:`True` if given port is available. Otherwise return :py:obj:`False`.
         If an error has occurred, return its number.
     """
     try:
-        server_ip = socket.gethostbyname(hostname)
+        server_ip = resolver.resolve(hostname)
+        if server_ip is None:
+            return 98
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(1)
         result = sock.connect_ex((server_ip, port))
@@ -31,3 +43,120 @@ def test_port_availability(hostname: str, port: int) -> Union[bool, int]:
     finally:
         if "sock" in locals():
             sock.close()
+
+
+PORT_OPEN = "open"
+PORT_CLOSED = "closed"
+PORT_UNRESOLVABLE = "unresolvable"
+
+
+class PortScanResult:
+    """Result of a connect attempt to a single port of a host."""
+
+    def __init__(self, hostname: str, port: int, status: str, latency: Optional[float] = None) -> None:
+        """
+        Construct object of PortScanResult class.
+
+        :param hostname: Host name or IP address of the scanned host.
+        :param port: Scanned port number.
+        :param status: One of :py:data:`PORT_OPEN`, :py:data:`PORT_CLOSED` or :py:data:`PORT_UNRESOLVABLE`.
+        :param latency: Time in milliseconds it took to establish the connection, :py:obj:`None` if it failed.
+        """
+        self.hostname = hostname
+        self.port = port
+        self.status = status
+        self.latency = latency
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Return whether the port is open.
+
+        :return: :py:obj:`True` if the connection was established.
+        """
+        return self.status == PORT_OPEN
+
+    def __repr__(self):
+        tmpl = "PortScanResult(hostname={hostname!r}, port={port!r}, status={status!r}, latency={latency!r})"
+        return tmpl.format(**self.__dict__)
+
+
+async def probe_port(hostname: str, port: int, timeout: float = 1.0, address: Optional[str] = None) -> PortScanResult:
+    """
+    Try to connect to the ``port`` of the ``hostname`` without blocking the event loop.
+
+    :param hostname: Host name or IP address of the host.
+    :param port: Port number to connect to.
+    :param timeout: Time in seconds to wait for the connection to be established.
+    :param address: Already resolved address of the ``hostname``. If it is :py:obj:`None`
+        the ``hostname`` is looked up in the shared :py:mod:`plbmng.lib.resolver` cache.
+    :return: Result of the connect attempt.
+    """
+    ip = address or await asyncio.get_running_loop().run_in_executor(None, resolver.resolve, hostname)
+    if ip is None:
+        return PortScanResult(hostname, port, PORT_UNRESOLVABLE)
+    started_at = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return PortScanResult(hostname, port, PORT_CLOSED)
+    latency = round((time.monotonic() - started_at) * 1000, 3)
+    writer.close()
+    return PortScanResult(hostname, port, PORT_OPEN, latency)
+
+
+async def async_sweep(
+    targets: Iterable[Tuple[str, int]], parallelism: int = 256, timeout: float = 1.0
+) -> List[PortScanResult]:
+    """
+    Connect to all ``targets`` concurrently.
+
+    All hosts are resolved in parallel before the scan, each of them only once
+    no matter how many of its ports are scanned.
+
+    :param targets: Pairs of host name (or IP address) and port number.
+    :param parallelism: Maximum number of connect attempts in flight.
+    :param timeout: Time in seconds to wait for each connection to be established.
+    :return: Results in the order of ``targets``.
+    """
+    targets = list(targets)
+    semaphore = asyncio.Semaphore(parallelism)
+    addresses = await asyncio.get_running_loop().run_in_executor(
+        None, resolver.resolve_many, [hostname for hostname, _ in targets]
+    )
+
+    async def limited_probe(hostname: str, port: int) -> PortScanResult:
+        if addresses[hostname] is None:
+            return PortScanResult(hostname, port, PORT_UNRESOLVABLE)
+        async with semaphore:
+            return await probe_port(hostname, port, timeout, addresses[hostname])
+
+    return await asyncio.gather(*(limited_probe(hostname, port) for hostname, port in targets))
+
+
+def sweep(targets: Iterable[Tuple[str, int]], parallelism: int = 256, timeout: float = 1.0) -> List[PortScanResult]:
+    """
+    Connect to all ``targets`` concurrently and block until all of them are scanned.
+
+    :param targets: Pairs of host name (or IP address) and port number.
+    :param parallelism: Maximum number of connect attempts in flight.
+    :param timeout: Time in seconds to wait for each connection to be established.
+    :return: Results in the order of ``targets``.
+    """
+    return asyncio.run(async_sweep(targets, parallelism, timeout))
+
+
+def sweep_hosts(
+    hostnames: Iterable[str], ports: Iterable[int] = (22,), parallelism: int = 256, timeout: float = 1.0
+) -> List[PortScanResult]:
+    """
+    Scan all ``ports`` of all ``hostnames`` in the same pass.
+
+    :param hostnames: Host names or IP addresses.
+    :param ports: Port numbers to be scanned on every host, e.g. ``(22, 80, 443)``.
+    :param parallelism: Maximum number of connect attempts in flight.
+    :param timeout: Time in seconds to wait for each connection to be established.
+    :return: Results ordered by host and then by port.
+    """
+    ports = list(ports)
+    return sweep([(hostname, port) for hostname in hostnames for port in ports], parallelism, timeout)
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import shlex
+import subprocess
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from plbmng.lib import pinger
+from plbmng.lib import port_scanner
+from plbmng.lib import resolver
+from plbmng.utils.config import settings
+from plbmng.utils.logger import logger
+
+PROBE_CONCURRENCY = settings.monitoring.concurrency
+PROBE_TIMEOUT = settings.monitoring.probe_timeout
+SSH_TIMEOUT = settings.monitoring.ssh_timeout
+
+# Facts gathered from the nodes. Name of the fact is mapped to the shell command printing its value.
+# All facts are collected by a single script in one SSH session, so adding a fact costs no extra round trip.
+FACTS = {
+    "gcc": "gcc -dumpversion",
+    "python": "python3 --version 2>&1",
+    "kernel": "uname -r",
+    "memory": "grep MemTotal /proc/meminfo | awk '{print $2 / 1024}'",
+    "cpus": "grep -c ^processor /proc/cpuinfo",
+    "load": "cut -d ' ' -f 1-3 /proc/loadavg",
+    "disk_free": "df -Pk / | awk 'NR == 2 {print $4}'",
+    "os_release": '(. /etc/os-release && echo "$PRETTY_NAME") || head -n 1 /etc/redhat-release',
+}
+# Facts stored in the programs table of the plbmng database, in the order of its columns
+SERVER_PARAMS = ["gcc", "python", "kernel", "memory"]
+
+
+class ProbeResult:
+    """Availability of a single node as found out by the prober."""
+
+    def __init__(
+        self, hostname: str, rtt: Optional[float] = None, ssh: bool = False, facts: Dict[str, str] = None
+    ) -> None:
+        """
+        Construct object of ProbeResult class.
+
+        :param hostname: IP address or host name of the probed node.
+        :param rtt: ICMP round trip time in milliseconds, :py:obj:`None` if the node did not respond
+        :param ssh: :py:obj:`True` if port 22 of the node is open, defaults to :py:obj:`False`
+        :param facts: Values of the :py:data:`FACTS` gathered from the node, defaults to ``unknown``
+        """
+        self.hostname = hostname
+        self.rtt = rtt
+        self.ssh = ssh
+        self.facts = facts or unknown_facts()
+
+    @property
+    def ping(self) -> bool:
+        """
+        Return whether the node responded to ICMP echo request.
+
+        :return: :py:obj:`True` if the node responded
+        """
+        return self.rtt is not None
+
+    @property
+    def programs(self) -> List[str]:
+        """
+        Return values of the :py:data:`SERVER_PARAMS` facts.
+
+        :return: List of the fact values in the order of :py:data:`SERVER_PARAMS`
+        """
+        return [self.facts[fact] for fact in SERVER_PARAMS]
+
+    def __repr__(self):
+        tmpl = "ProbeResult(hostname={hostname!r}, rtt={rtt!r}, ssh={ssh!r}, facts={facts!r})"
+        return tmpl.format(**self.__dict__)
+
+
+def unknown_facts(facts: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Return all ``facts`` with the ``unknown`` value.
+
+    :param facts: Facts definition, defaults to :py:data:`FACTS`
+    :return: Dictionary mapping all fact names to ``unknown``
+    """
+    return dict.fromkeys(facts or FACTS, "unknown")
+
+
+def facts_command(facts: Dict[str, str] = None) -> str:
+    """
+    Return shell command gathering all ``facts`` at once and printing them as a JSON object.
+
+    Only the first line of each fact output is used. Facts printing nothing are left empty.
+
+    :param facts: Facts definition, defaults to :py:data:`FACTS`
+    :return: Shell command to be run on the node
+    """
+    script = [
+        "fact() {",
+        '  value=$(sh -c "$2" 2>/dev/null | head -n 1 | tr -d \'\\000-\\037\\\\"\')',
+        '  printf \'%s"%s": "%s"\' "$separator" "$1" "$value"',
+        "  separator=', '",
+        "}",
+        "separator=''",
+        "printf '{'",
+    ]
+    script.extend(f"fact {shlex.quote(name)} {shlex.quote(cmd)}" for name, cmd in (facts or FACTS).items())
+    script.append("printf '}\\n'")
+    return "sh -c " + shlex.quote("\n".join(script))
+
+
+def parse_facts(output: str, facts: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Parse the output of the :py:func:`facts_command`.
+
+    :param output: Standard output of the command.
+    :param facts: Facts definition, defaults to :py:data:`FACTS`
+    :return: Dictionary mapping fact names to their values. Facts that were not gathered are ``unknown``.
+    """
+    parsed = unknown_facts(facts)
+    try:
+        gathered = json.loads(output)
+    except ValueError:
+        return parsed
+    parsed.update((name, value) for name, value in gathered.items() if name in parsed and value)
+    return parsed
+
+
+def ssh_argv(hostname: str) -> List[str]:
+    """
+    Return argv of the non-interactive ``ssh`` command connecting to the ``hostname``.
+
+    If the ``hostname`` is already in the resolver cache, ``ssh`` connects to its cached address.
+
+    :param hostname: IP address or host name of the target.
+    :return: ``ssh`` command line as list of arguments.
+    """
+    return [
+        "ssh",
+        "-o",
+        "PasswordAuthentication=no",
+        "-o",
+        "UserKnownHostsFile=/dev/null",
+        "-o",
+        "StrictHostKeyChecking=no",
+        "-o",
+        "LogLevel=QUIET",
+        "-o",
+        "ConnectTimeout=10",
+        "-i",
+        settings.remote_execution.ssh_key,
+        f"{settings.planetlab.slice}@{resolver.get_resolver().cached(hostname) or hostname}",
+    ]
+
+
+async def gather_facts(hostname: str, facts: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Gather all ``facts`` from the ``hostname`` in a single SSH session.
+
+    :param hostname: IP address or host name of the node.
+    :param facts: Facts definition, defaults to :py:data:`FACTS`
+    :return: Dictionary mapping fact names to their values. Facts that were not gathered are ``unknown``.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *ssh_argv(hostname), facts_command(facts), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), SSH_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return unknown_facts(facts)
+    return parse_facts(stdout.decode("utf-8", "ignore"), facts)
+
+
+async def probe_node(
+    hostname: str,
+    address: Optional[str],
+    semaphore: asyncio.Semaphore,
+    ping_sweep: "asyncio.Future[Dict[str, Optional[float]]]",
+) -> ProbeResult:
+    """
+    Probe SSH availability of the ``hostname`` and query its software/hardware.
+
+    The software/hardware query is performed only if the port 22 is open.
+    ICMP availability is taken from the ``ping_sweep`` running for all nodes at once.
+
+    :param hostname: IP address or host name of the node.
+    :param address: Resolved IP address of the node, :py:obj:`None` if it is unresolvable.
+    :param semaphore: Semaphore limiting the number of nodes probed at the same time.
+    :param ping_sweep: Future of the :py:func:`plbmng.lib.pinger.ping_hosts` result containing the ``hostname``.
+    :return: Result of the probe. Node is reported as unavailable if the probe fails unexpectedly.
+    """
+    if address is None:
+        return ProbeResult(hostname)
+    async with semaphore:
+        try:
+            ssh = (await port_scanner.probe_port(hostname, 22, PROBE_TIMEOUT, address)).is_open
+            facts = await gather_facts(hostname) if ssh else None
+        except Exception as e:
+            logger.error("Probing of {} failed: {}", hostname, e)
+            ssh, facts = False, None
+    try:
+        rtt = (await ping_sweep)[hostname]
+    except Exception as e:
+        logger.error("ICMP sweep failed: {}", e)
+        rtt = None
+    return ProbeResult(hostname, rtt, ssh, facts)
+
+
+async def probe_nodes(hostnames: Iterable[str], concurrency: int = None) -> AsyncIterator[ProbeResult]:
+    """
+    Probe all ``hostnames`` concurrently and yield the results as soon as they are available.
+
+    All ``hostnames`` are resolved once up front, the ICMP sweep, port probes
+    and SSH sessions then reuse the addresses from the resolver cache.
+
+    :param hostnames: IP addresses or host names of the nodes to be probed.
+    :param concurrency: Maximum number of nodes probed at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``monitoring`` section will be used.
+    :yield: :py:class:`ProbeResult` of each node in the order of completion.
+    """
+    hostnames = list(hostnames)
+    semaphore = asyncio.Semaphore(concurrency or PROBE_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    addresses = await loop.run_in_executor(None, resolver.resolve_many, hostnames)
+    ping_sweep = loop.run_in_executor(None, pinger.ping_hosts, hostnames, PROBE_TIMEOUT)
+    tasks = [
+        asyncio.ensure_future(probe_node(hostname, addresses[hostname], semaphore, ping_sweep))
+        for hostname in hostnames
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def run_probes(hostnames: Iterable[str], callback: Callable[[ProbeResult], None], concurrency: int = None) -> None:
+    """
+    Probe all ``hostnames`` and pass each result to the ``callback`` as soon as it is available.
+
+    Blocks until all nodes are probed.
+
+    :param hostnames: IP addresses or host names of the nodes to be probed.
+    :param callback: Function called with the :py:class:`ProbeResult` of each probed node.
+    :param concurrency: Maximum number of nodes probed at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``monitoring`` section will be used.
+    """
+
+    async def consume():
+        async for result in probe_nodes(hostnames, concurrency):
+            callback(result)
+
+    asyncio.run(consume())
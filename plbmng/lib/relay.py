@@ -0,0 +1,347 @@
+import hashlib
+import heapq
+import math
+import os
+import shlex
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import paramiko.agent
+
+from plbmng.lib import ssh as sshlib
+from plbmng.lib.catalog import get_catalog
+from plbmng.utils.config import settings
+from plbmng.utils.logger import logger
+
+# Options of the ssh client the nodes use to relay the payload to each other
+RELAY_SSH_OPTIONS = [
+    "-o",
+    "BatchMode=yes",
+    "-o",
+    "StrictHostKeyChecking=no",
+    "-o",
+    "UserKnownHostsFile=/dev/null",
+    "-o",
+    "LogLevel=ERROR",
+]
+
+
+class RelayCredentialsError(Exception):
+    """Raised when the nodes have no credentials to relay the payload to each other."""
+
+
+class RelayPlan:
+    """Fan-out tree in which the payload is distributed.
+
+    The controller sends the payload to the ``seeds``, every node which has the payload
+    then sends it further to its ``children``.
+    """
+
+    def __init__(self, seeds: List[str], children: Dict[str, List[str]]) -> None:
+        """
+        Construct object of RelayPlan class.
+
+        :param seeds: Hosts receiving the payload directly from the controller.
+        :param children: Dictionary mapping each host to the hosts it relays the payload to.
+        """
+        self.seeds = seeds
+        self.children = children
+
+    def depth(self) -> int:
+        """
+        Return number of relay rounds needed to reach all hosts.
+
+        :return: Number of hosts on the longest path from the controller.
+        """
+        depth, level = 0, self.seeds
+        while level:
+            depth += 1
+            level = [child for host in level for child in self.children.get(host, [])]
+        return depth
+
+    def __repr__(self):
+        return f"RelayPlan(seeds={self.seeds!r}, children={self.children!r})"
+
+
+def node_location(hostname: str) -> Optional[Tuple[float, float]]:
+    """
+    Return location of the node from the node catalog.
+
+    :param hostname: IP address or host name of the node.
+    :return: Latitude and longitude, or :py:obj:`None` if the location is not known.
+    """
+    node = get_catalog().get(hostname)
+    try:
+        return float(node["latitude"]), float(node["longitude"])
+    except (TypeError, ValueError):
+        return None
+
+
+def distance(a: Optional[Tuple[float, float]], b: Optional[Tuple[float, float]]) -> float:
+    """
+    Return great-circle distance of two locations.
+
+    :param a: Latitude and longitude of the first location.
+    :param b: Latitude and longitude of the second location.
+    :return: Distance in kilometers, infinity if any of the locations is not known.
+    """
+    if a is None or b is None:
+        return math.inf
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(min(1.0, math.sqrt(h)))
+
+
+def plan_tree(
+    hosts: Iterable[str],
+    latencies: Dict[str, Optional[float]],
+    fanout: int = None,
+    locations: Dict[str, Optional[Tuple[float, float]]] = None,
+) -> RelayPlan:
+    """
+    Plan the fan-out tree for the ``hosts``.
+
+    The hosts with the lowest round trip time from the controller become the seeds. Hosts are then
+    attached level by level, every host relays to the nearest ``fanout`` hosts not attached yet,
+    so the number of relay rounds grows logarithmically with the number of hosts.
+
+    :param hosts: IP addresses or host names of the nodes.
+    :param latencies: Dictionary mapping the hosts to their round trip time from the controller in milliseconds,
+        :py:obj:`None` if it is not known.
+    :param fanout: Number of the seeds and of the children of each host. If it is :py:obj:`None`
+        ``relay_fanout`` from configuration's ``remote_execution`` section will be used.
+    :param locations: Dictionary mapping the hosts to their latitude and longitude.
+        If it is :py:obj:`None` the locations are taken from the node catalog.
+    :return: Planned :py:class:`RelayPlan`.
+    """
+    fanout = fanout or settings.remote_execution.relay_fanout
+    hosts = list(dict.fromkeys(hosts))
+    if locations is None:
+        locations = {host: node_location(host) for host in hosts}
+    by_latency = sorted(hosts, key=lambda host: math.inf if latencies.get(host) is None else latencies[host])
+    seeds = by_latency[:fanout]
+    remaining = set(by_latency[fanout:])
+    children = {}
+    parents = deque(seeds)
+    while remaining:
+        parent = parents.popleft()
+        nearest = heapq.nsmallest(
+            fanout, sorted(remaining), key=lambda host: distance(locations.get(parent), locations.get(host))
+        )
+        children[parent] = nearest
+        remaining.difference_update(nearest)
+        parents.extend(nearest)
+    return RelayPlan(seeds, children)
+
+
+def check_credentials() -> None:
+    """
+    Check that the nodes will be able to connect to each other.
+
+    Without the ``relay_key`` the nodes use the SSH agent of the controller, which must hold at least one key.
+    Otherwise every relay would fail and the payload would be sent from the controller to each node.
+
+    :raises RelayCredentialsError: if the ``relay_key`` is not set and the SSH agent has no keys
+    """
+    if settings.remote_execution.relay_key:
+        return
+    agent = paramiko.agent.Agent()
+    try:
+        keys = agent.get_keys()
+    finally:
+        agent.close()
+    if not keys:
+        raise RelayCredentialsError(
+            "The nodes can not connect to each other. Set 'relay_key' in the 'remote_execution' section "
+            "or add the SSH key to the SSH agent (ssh-add)."
+        )
+
+
+def file_sha256(path: str) -> str:
+    """
+    Return SHA-256 digest of the local file.
+
+    :param path: Path of the file.
+    :return: Hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(sshlib.CHANNEL_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def part_path(destination_path: str, host: str) -> str:
+    """
+    Return path of the incomplete payload on the ``host``.
+
+    The path contains the ``host``, so that nodes sharing a file system do not overwrite each other's partial copy.
+
+    :param destination_path: Path of the payload on the ``host``.
+    :param host: IP address or host name of the node.
+    :return: Path to which the payload is written before it is verified.
+    """
+    return f"{destination_path}.{host}.part"
+
+
+def _receive_command(destination_path: str, host: str) -> str:
+    directory = shlex.quote(os.path.dirname(destination_path) or ".")
+    return f"mkdir -p {directory} && cat > {shlex.quote(part_path(destination_path, host))}"
+
+
+def _run(host: str, cmd: str, port: int, forward_agent: bool = False) -> None:
+    result = sshlib.command(
+        cmd,
+        hostname=host,
+        username=settings.planetlab.slice,
+        key_filename=settings.remote_execution.ssh_key,
+        timeout=settings.remote_execution.relay_timeout,
+        port=port,
+        forward_agent=forward_agent,
+    )
+    if result.return_code != 0:
+        raise OSError(result.stderr.strip() or f"Command failed on {host} with exit code {result.return_code}")
+
+
+def seed(host: str, source_path: str, destination_path: str, port: int = 22) -> None:
+    """
+    Send the payload from the controller to the ``host``.
+
+    :param host: IP address or host name of the node.
+    :param source_path: Path of the local file.
+    :param destination_path: Path of the payload on the ``host``.
+    :param port: SSH port of the ``host``.
+    :raises OSError: if the payload could not be written on the ``host``
+    """
+    result = sshlib.pipe_file(
+        source_path,
+        _receive_command(destination_path, host),
+        hostname=host,
+        username=settings.planetlab.slice,
+        key_filename=settings.remote_execution.ssh_key,
+        timeout=settings.remote_execution.relay_timeout,
+        port=port,
+    )
+    if result.return_code != 0:
+        raise OSError(result.stderr.strip() or f"Could not write the payload on {host}")
+
+
+def relay(parent: str, child: str, destination_path: str, port: int = 22) -> None:
+    """
+    Send the payload from the ``parent`` node, which already has it, to the ``child`` node.
+
+    The ``parent`` connects to the ``child`` with the ``relay_key`` from configuration's ``remote_execution``
+    section if it is set, otherwise with the SSH agent of the controller forwarded to the ``parent``.
+
+    :param parent: IP address or host name of the node having the payload.
+    :param child: IP address or host name of the node receiving the payload.
+    :param destination_path: Path of the payload on both nodes.
+    :param port: SSH port of the nodes.
+    """
+    relay_key = settings.remote_execution.relay_key
+    argv = ["ssh", *RELAY_SSH_OPTIONS, "-p", str(port)]
+    if relay_key:
+        argv += ["-i", relay_key]
+    argv += [f"{settings.planetlab.slice}@{child}", _receive_command(destination_path, child)]
+    cmd = f"{' '.join(shlex.quote(arg) for arg in argv)} < {shlex.quote(destination_path)}"
+    _run(parent, cmd, port, forward_agent=not relay_key)
+
+
+def verify(host: str, destination_path: str, sha256: str, port: int = 22) -> None:
+    """
+    Verify the checksum of the payload received by the ``host`` and move it to the ``destination_path``.
+
+    :param host: IP address or host name of the node.
+    :param destination_path: Path of the payload on the ``host``.
+    :param sha256: SHA-256 digest of the payload.
+    :param port: SSH port of the ``host``.
+    """
+    part = shlex.quote(part_path(destination_path, host))
+    _run(
+        host,
+        f"if echo {sha256}' '' '{part} | sha256sum -c --status; then mv -f {part} {shlex.quote(destination_path)}; "
+        f"else rm -f {part}; echo 'Checksum of the received payload does not match' >&2; exit 1; fi",
+        port,
+    )
+
+
+def deliver(
+    host: str, parent: Optional[str], source_path: str, destination_path: str, sha256: str, port: int = 22
+) -> Optional[str]:
+    """
+    Deliver the payload to the ``host`` from its ``parent`` node, or from the controller.
+
+    If the relay from the ``parent`` fails, the payload is sent from the controller instead.
+
+    :param host: IP address or host name of the node.
+    :param parent: Node relaying the payload to the ``host``, :py:obj:`None` for the seeds.
+    :param source_path: Path of the local file.
+    :param destination_path: Path of the payload on the nodes.
+    :param sha256: SHA-256 digest of the payload.
+    :param port: SSH port of the nodes.
+    :return: The node which sent the payload, :py:obj:`None` if it was the controller.
+    """
+    if parent is not None:
+        try:
+            relay(parent, host, destination_path, port)
+            verify(host, destination_path, sha256, port)
+            return parent
+        except Exception as e:
+            logger.warning("Relay from {} to {} failed ({}), sending from the controller", parent, host, e)
+    seed(host, source_path, destination_path, port)
+    verify(host, destination_path, sha256, port)
+    return None
+
+
+def distribute(
+    source_path: str,
+    destination_path: str,
+    plan: RelayPlan,
+    port: int = 22,
+    concurrency: int = None,
+    callback: Callable[[str, Optional[str]], None] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Distribute the file to all hosts of the ``plan``.
+
+    Every host starts relaying the payload to its children as soon as it has received and verified it.
+    Children of a host the payload could not be delivered to get it from the controller.
+
+    :param source_path: Path of the local file.
+    :param destination_path: Path of the payload on the nodes.
+    :param plan: Fan-out tree, see :py:func:`plan_tree`.
+    :param port: SSH port of the nodes.
+    :param concurrency: Maximum number of transfers at the same time.
+        If it is :py:obj:`None` ``concurrency`` from configuration's ``remote_execution`` section will be used.
+    :param callback: Function called as ``callback(host, error)`` when the delivery to the host finished,
+        ``error`` is :py:obj:`None` if it succeeded.
+    :return: Dictionary mapping each host to :py:obj:`None` if the payload was delivered to it,
+        or to the error message otherwise.
+    """
+    sha256 = file_sha256(source_path)
+    results = {}
+    with ThreadPoolExecutor(concurrency or settings.remote_execution.concurrency) as pool:
+
+        def submit(host: str, parent: Optional[str]):
+            return pool.submit(deliver, host, parent, source_path, destination_path, sha256, port)
+
+        pending = {submit(host, None): host for host in plan.seeds}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                host = pending.pop(future)
+                error = future.exception()
+                results[host] = None if error is None else str(error) or type(error).__name__
+                if callback is not None:
+                    callback(host, results[host])
+                for child in plan.children.get(host, []):
+                    pending[submit(child, host if error is None else None)] = child
+    return results
@@ -0,0 +1,182 @@
+import atexit
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+from plbmng.utils.config import get_db_path
+from plbmng.utils.config import settings
+from plbmng.utils.logger import logger
+
+RESOLVER_WORKERS = 32
+
+
+class Resolver:
+    """Host name resolver backed by a persistent on-disk cache.
+
+    Successful resolutions are cached for ``ttl`` seconds, failed ones for ``negative_ttl`` seconds,
+    so that unresolvable nodes do not cost a DNS timeout on every refresh. The cache file is written
+    once per :py:meth:`resolve_many` batch, single lookups are written when the process exits.
+    """
+
+    def __init__(self, cache_path: str = None, ttl: int = None, negative_ttl: int = None) -> None:
+        """
+        Construct object of Resolver class.
+
+        :param cache_path: Path to the cache file. If it is :py:obj:`None`
+            ``dns_cache`` from configuration's ``database`` section will be used.
+        :param ttl: Seconds for which the resolved address is valid. If it is :py:obj:`None`
+            ``dns_ttl`` from configuration's ``monitoring`` section will be used.
+        :param negative_ttl: Seconds for which the failed resolution is valid. If it is :py:obj:`None`
+            ``dns_negative_ttl`` from configuration's ``monitoring`` section will be used.
+        """
+        self.cache_path = cache_path or get_db_path("dns_cache", failsafe=True)
+        self.ttl = ttl if ttl is not None else settings.monitoring.dns_ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else settings.monitoring.dns_negative_ttl
+        self._lock = threading.Lock()
+        self._cache = self._load()
+        self._dirty = False
+        atexit.register(self.save)
+
+    def _load(self) -> Dict[str, list]:
+        try:
+            with open(self.cache_path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        """Atomically write the cache to the cache file if it changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            cache = {host: entry for host, entry in self._cache.items() if entry[1] > now}
+            tmp_path = None
+            try:
+                # unique name, concurrent plbmng processes must not write into the same temporary file
+                with tempfile.NamedTemporaryFile(
+                    "w", dir=os.path.dirname(self.cache_path) or ".", suffix=".tmp", delete=False
+                ) as cache_file:
+                    tmp_path = cache_file.name
+                    json.dump(cache, cache_file)
+                os.replace(tmp_path, self.cache_path)
+                self._dirty = False
+            except OSError as e:
+                logger.error("Could not write the DNS cache {}: {}", self.cache_path, e)
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def cached(self, hostname: str) -> Optional[str]:
+        """
+        Return address of the ``hostname`` from the cache, without resolving it.
+
+        :param hostname: Host name or IP address.
+        :return: IP address, or :py:obj:`None` if it is not cached or the ``hostname`` is unresolvable.
+        """
+        if _is_ip_address(hostname):
+            return hostname
+        entry = self._cache.get(hostname)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def _lookup(self, hostname: str) -> Optional[str]:
+        try:
+            address = socket.gethostbyname(hostname)
+        except (socket.error, UnicodeError):
+            address = None
+        expires_at = time.time() + (self.ttl if address else self.negative_ttl)
+        with self._lock:
+            self._cache[hostname] = [address, expires_at]
+            self._dirty = True
+        return address
+
+    def _is_fresh(self, hostname: str) -> bool:
+        if _is_ip_address(hostname):
+            return True
+        entry = self._cache.get(hostname)
+        return entry is not None and entry[1] > time.time()
+
+    def resolve(self, hostname: str) -> Optional[str]:
+        """
+        Return IPv4 address of the ``hostname``, resolving it only if it is not cached.
+
+        :param hostname: Host name or IP address.
+        :return: IP address, or :py:obj:`None` if the ``hostname`` is unresolvable.
+        """
+        if self._is_fresh(hostname):
+            return self.cached(hostname)
+        return self._lookup(hostname)
+
+    def resolve_many(self, hostnames: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Return IPv4 addresses of all ``hostnames``, resolving the ones that are not cached in parallel.
+
+        :param hostnames: Host names or IP addresses.
+        :return: Dictionary mapping each hostname to its IP address, or to :py:obj:`None` if it is unresolvable.
+        """
+        hostnames = list(dict.fromkeys(hostnames))
+        missing = [hostname for hostname in hostnames if not self._is_fresh(hostname)]
+        if missing:
+            with ThreadPoolExecutor(RESOLVER_WORKERS) as pool:
+                list(pool.map(self._lookup, missing))
+            self.save()
+        return {hostname: self.cached(hostname) for hostname in hostnames}
+
+    def invalidate(self) -> None:
+        """Drop all cached resolutions."""
+        with self._lock:
+            self._cache = {}
+            self._dirty = True
+        self.save()
+
+
+def _is_ip_address(hostname: str) -> bool:
+    try:
+        ipaddress.ip_address(hostname)
+    except ValueError:
+        return False
+    return True
+
+
+_resolver = None
+
+
+def get_resolver() -> Resolver:
+    """
+    Return resolver shared by the whole plbmng process.
+
+    :return: Shared :py:class:`Resolver` instance.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+    return _resolver
+
+
+def resolve(hostname: str) -> Optional[str]:
+    """
+    Return IPv4 address of the ``hostname`` using the shared resolver.
+
+    :param hostname: Host name or IP address.
+    :return: IP address, or :py:obj:`None` if the ``hostname`` is unresolvable.
+    """
+    return get_resolver().resolve(hostname)
+
+
+def resolve_many(hostnames: Iterable[str]) -> Dict[str, Optional[str]]:
+    """
+    Return IPv4 addresses of all ``hostnames`` using the shared resolver.
+
+    :param hostnames: Host names or IP addresses.
+    :return: Dictionary mapping each hostname to its IP address, or to :py:obj:`None` if it is unresolvable.
+    """
+    return get_resolver().resolve_many(hostnames)
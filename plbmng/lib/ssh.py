@@ -1,10 +1,20 @@
+import atexit
 import logging
+import os
 import re
+import select
+import socket
+import threading
 import time
+from collections import OrderedDict
 from contextlib import contextmanager
+from contextlib import ExitStack
+from typing import Dict
+from typing import Tuple
 from typing import Union
 
 import paramiko
+import paramiko.agent
 
 from plbmng.utils.config import settings
 
@@ -14,6 +24,11 @@ CONNECTION_TIMEOUT = settings.remote_execution.connection_timeout
 COMMAND_TIMEOUT = settings.remote_execution.command_timeout
 SSH_USERNAME = settings.planetlab.slice
 SSH_KEY = settings.remote_execution.ssh_key
+POOL_MAX_CONNECTIONS = settings.remote_execution.pool_max_connections
+POOL_IDLE_TIMEOUT = settings.remote_execution.pool_idle_timeout
+CHANNEL_READ_SIZE = 32768
+OUTPUT_SPILL_THRESHOLD = settings.remote_execution.output_spill_threshold
+ANSI_ESCAPE = re.compile(rb"\x1b\[[0-9;?]*[A-Za-z]")
 
 # TODO impmlement https://pypi.org/project/parallel-ssh/ into this library
 
@@ -38,7 +53,7 @@ def decode_to_utf8(text) -> bytes:  # pragma: no cover
 class SSHCommandResult:
     """Structure that returns in all ssh commands results."""
 
-    def __init__(self, stdout=None, stderr=None, return_code=0) -> None:
+    def __init__(self, stdout=None, stderr=None, return_code=0, duration=None) -> None:
         """
         Construct object of SSHCommandResult class.
 
@@ -48,16 +63,121 @@ class SSHCommandResult:
         :type stderr: str, optional
         :param return_code: command return code, defaults to 0
         :type return_code: int, optional
+        :param duration: time in seconds it took to run the command, defaults to None
+        :type duration: float, optional
         """
         self.stdout = stdout
         self.stderr = stderr
         self.return_code = return_code
+        self.duration = duration
 
     def __repr__(self):
-        tmpl = "SSHCommandResult(stdout={stdout!r}, stderr={stderr!r}, " + "return_code={return_code!r})"
+        tmpl = (
+            "SSHCommandResult(stdout={stdout!r}, stderr={stderr!r}, return_code={return_code!r}, duration={duration!r})"
+        )
         return tmpl.format(**self.__dict__)
 
 
+class CommandOutput:
+    """One output stream of a remote command captured with bounded memory.
+
+    Output is kept in memory until it grows over ``spill_threshold`` bytes. Then it is moved
+    to the ``spill_path`` file and all the following output is appended there. Without ``spill_path``
+    only the last ``spill_threshold`` bytes are kept.
+    """
+
+    def __init__(self, spill_path=None, spill_threshold=None, strip_ansi=False) -> None:
+        """
+        Construct object of CommandOutput class.
+
+        :param spill_path: path of the file the output is moved to once it is too big, defaults to None
+        :type spill_path: str, optional
+        :param spill_threshold: maximum number of bytes kept in memory, unlimited if it is :py:obj:`None`
+        :type spill_threshold: int, optional
+        :param strip_ansi: remove ANSI escape sequences from the output, defaults to :py:obj:`False`
+        :type strip_ansi: bool, optional
+        """
+        self.spill_path = spill_path
+        self.spill_threshold = spill_threshold
+        self.strip_ansi = strip_ansi
+        self.size = 0
+        self.spilled = False
+        self.truncated = False
+        self._buffer = bytearray()
+        self._file = None
+
+    def write(self, data) -> bytes:
+        """
+        Append the ``data`` to the captured output.
+
+        :param data: received chunk of the output
+        :type data: bytes or str
+        :return: the ``data`` as stored, i.e. encoded and with ANSI escape sequences removed if requested
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.strip_ansi:
+            data = ANSI_ESCAPE.sub(b"", data)
+        self.size += len(data)
+        over_threshold = self.spill_threshold is not None and len(self._buffer) + len(data) > self.spill_threshold
+        if self._file is None and over_threshold:
+            if self.spill_path:
+                self._file = open(self.spill_path, "wb")
+                self._file.write(self._buffer)
+                self._buffer = bytearray()
+                self.spilled = True
+            else:
+                self.truncated = True
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+            if self.truncated:
+                del self._buffer[: -self.spill_threshold]
+        return data
+
+    def close(self) -> None:
+        """Close the spill file, if the output was spilled."""
+        if self._file is not None:
+            self._file.close()
+
+    @property
+    def text(self) -> Union[None, str]:
+        """
+        Return the output kept in memory.
+
+        :return: decoded output, or :py:obj:`None` if the output was moved to the spill file
+        """
+        if self.spilled:
+            return None
+        return self._buffer.decode("utf-8", "replace")
+
+    def __repr__(self):
+        tmpl = "CommandOutput(size={size!r}, spilled={spilled!r}, truncated={truncated!r}, spill_path={spill_path!r})"
+        return tmpl.format(**self.__dict__)
+
+
+class StreamedCommandResult(SSHCommandResult):
+    """Result of the command whose output was captured by :py:class:`CommandOutput`."""
+
+    def __init__(self, stdout, stderr, return_code=0, duration=None) -> None:
+        """
+        Construct object of StreamedCommandResult class.
+
+        :param stdout: captured command stdout
+        :type stdout: CommandOutput
+        :param stderr: captured command stderr
+        :type stderr: CommandOutput
+        :param return_code: command return code, defaults to 0
+        :type return_code: int, optional
+        :param duration: time in seconds it took to run the command, defaults to None
+        :type duration: float, optional
+        """
+        super().__init__(stdout.text, stderr.text, return_code, duration)
+        self.stdout_file = stdout.spill_path if stdout.spilled else None
+        self.stderr_file = stderr.spill_path if stderr.spilled else None
+
+
 class SSHClient(paramiko.SSHClient):
     """Representation of SSH client."""
 
@@ -130,6 +250,173 @@ def get_client(hostname=None, username=None, key_filename=None, timeout=None, po
     return client
 
 
+class _PooledConnection:
+    """Connection held by the :py:class:`SSHConnectionPool`."""
+
+    def __init__(self, key, client) -> None:
+        self.key = key
+        self.client = client
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.pooled = True
+
+    def is_alive(self) -> bool:
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, EOFError, OSError):
+            return False
+        return True
+
+
+class SSHConnectionPool:
+    """Process-wide pool of authenticated SSH connections.
+
+    Connections are keyed by (hostname, username, key_filename, port). Consecutive operations on the same
+    host share one transport, each of them on its own channel. Idle connections are closed after
+    ``idle_timeout`` seconds and the least recently used idle connections are closed once there are more
+    than ``max_connections`` of them. Connections found dead are replaced by new ones transparently.
+    """
+
+    def __init__(self, max_connections=None, idle_timeout=None) -> None:
+        """
+        Construct object of SSHConnectionPool class.
+
+        :param max_connections: Maximum number of connections kept open. If it is :py:obj:`None`
+            ``pool_max_connections`` from configuration's ``remote_execution`` section will be used.
+        :type max_connections: int
+        :param idle_timeout: Seconds after which an unused connection is closed. If it is :py:obj:`None`
+            ``pool_idle_timeout`` from configuration's ``remote_execution`` section will be used.
+        :type idle_timeout: int
+        """
+        self.max_connections = max_connections or POOL_MAX_CONNECTIONS
+        self.idle_timeout = idle_timeout or POOL_IDLE_TIMEOUT
+        self._lock = threading.Lock()
+        self._connections = OrderedDict()
+        self._by_client = {}
+
+    def acquire(self, hostname=None, username=None, key_filename=None, timeout=None, port=22) -> SSHClient:
+        """
+        Return a connected SSH client from the pool, connecting it if there is none for the given key.
+
+        Every acquired client has to be passed to :py:meth:`release` or :py:meth:`discard`.
+
+        :param hostname: The hostname of the server to establish connection.
+        :type hostname: str
+        :param username: The username to use when connecting. If it is :py:obj:`None`
+            ``ssh_username`` from configuration's ``server`` section will be used.
+        :type username: str
+        :param key_filename: The path of the ssh private key to use when
+            connecting to the server. If it is :py:obj:`None` ``key_filename`` from
+            configuration's ``server`` section will be used.
+        :type key_filename: str
+        :param timeout: Time to wait for establish the connection.
+        :type timeout: int
+        :param port: The server port to connect to, the default port is 22.
+        :type port: int
+        :return: An SSH connection.
+        """
+        key = (hostname, username or SSH_USERNAME, key_filename or SSH_KEY, port)
+        with self._lock:
+            self._evict_idle()
+            connection = self._connections.get(key)
+            if connection is not None and connection.is_alive():
+                return self._use(connection)
+            if connection is not None:
+                self._close(connection)
+        client = get_client(hostname, key[1], key[2], timeout, port)
+        logger.debug("Pooled new Paramiko client %s for [%s]", client._id, hostname)
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is not None:
+                # another thread connected to the same host meanwhile
+                client.close()
+                return self._use(connection)
+            connection = _PooledConnection(key, client)
+            self._connections[key] = connection
+            self._by_client[id(client)] = connection
+            self._enforce_limit()
+            return self._use(connection)
+
+    def _use(self, connection) -> SSHClient:
+        connection.users += 1
+        connection.last_used = time.monotonic()
+        if connection.pooled:
+            self._connections.move_to_end(connection.key)
+        return connection.client
+
+    def release(self, client) -> None:
+        """
+        Return the ``client`` to the pool so that it can be reused.
+
+        :param client: Client returned by :py:meth:`acquire`.
+        :type client: SSHClient
+        """
+        with self._lock:
+            connection = self._by_client.get(id(client))
+            if connection is None:
+                return
+            connection.users -= 1
+            connection.last_used = time.monotonic()
+            if not connection.pooled and connection.users <= 0:
+                self._close(connection)
+
+    def discard(self, client) -> None:
+        """
+        Close the ``client`` and remove it from the pool, e.g. after it failed.
+
+        :param client: Client returned by :py:meth:`acquire`.
+        :type client: SSHClient
+        """
+        with self._lock:
+            connection = self._by_client.get(id(client))
+            if connection is not None:
+                self._close(connection)
+
+    def _close(self, connection) -> None:
+        if connection.pooled and self._connections.get(connection.key) is connection:
+            del self._connections[connection.key]
+        connection.pooled = False
+        self._by_client.pop(id(connection.client), None)
+        connection.client.close()
+        logger.debug("Destroyed pooled Paramiko client %s", connection.client._id)
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for connection in list(self._connections.values()):
+            if connection.users <= 0 and now - connection.last_used > self.idle_timeout:
+                self._close(connection)
+
+    def _enforce_limit(self) -> None:
+        # connections are ordered from the least recently used one
+        excess = len(self._connections) - self.max_connections
+        for connection in list(self._connections.values()):
+            if excess <= 0:
+                break
+            if connection.users <= 0:
+                self._close(connection)
+            else:
+                # busy connection is closed as soon as it is released
+                del self._connections[connection.key]
+                connection.pooled = False
+            excess -= 1
+
+    def close_all(self) -> None:
+        """Close all connections of the pool."""
+        with self._lock:
+            for connection in list(self._by_client.values()):
+                self._close(connection)
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+
+pool = SSHConnectionPool()
+atexit.register(pool.close_all)
+
+
 @contextmanager
 def get_connection(hostname=None, username=None, key_filename=None, timeout=None, port=22):
     """
@@ -137,8 +424,8 @@ def get_connection(hostname=None, username=None, key_filename=None, timeout=None
 
     The connection will be configured with the specified arguments or will
     fall-back to server configuration in the configuration file.
-    Yield this SSH connection. The connection is automatically closed when the
-    caller is done using it using :py:obj:`contextlib <contextlib>`, so clients should use the
+    Yield this SSH connection. The connection is taken from the :py:data:`pool` and returned
+    there when the caller is done using it using :py:obj:`contextlib <contextlib>`, so clients should use the
     ``with`` statement to handle the object::
 
         with get_connection() as connection:
@@ -163,18 +450,21 @@ def get_connection(hostname=None, username=None, key_filename=None, timeout=None
     """
     if timeout is None:
         timeout = CONNECTION_TIMEOUT
-    client = get_client(hostname, username, key_filename, timeout, port)
+    client = pool.acquire(hostname, username, key_filename, timeout, port)
     try:
-        logger.debug(f"Instantiated Paramiko client {client._id}")
+        logger.debug(f"Acquired Paramiko client {client._id}")
         logger.info("Connected to [%s]", hostname)
         yield client
     finally:
-        client.close()
-        logger.debug(f"Destroyed Paramiko client {client._id}")
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            pool.discard(client)
+        pool.release(client)
+        logger.debug(f"Released Paramiko client {client._id}")
 
 
 @contextmanager
-def get_sftp_session(hostname=None, username=None, key_filename=None, timeout=None):
+def get_sftp_session(hostname=None, username=None, key_filename=None, timeout=None, port=22):
     """
     Yield a SFTP session object.
 
@@ -200,11 +490,15 @@ def get_sftp_session(hostname=None, username=None, key_filename=None, timeout=No
     :type key_filename: str
     :param timeout: Time to wait for establish the connection.
     :type timeout: int
+    :param port: The server port to connect to, the default port is 22.
+    :type port: int
     :yield: SFTP session
     """
-    with get_connection(hostname=hostname, username=username, key_filename=key_filename, timeout=timeout) as connection:
+    with get_connection(
+        hostname=hostname, username=username, key_filename=key_filename, timeout=timeout, port=port
+    ) as connection:
+        sftp = connection.open_sftp()
         try:
-            sftp = connection.open_sftp()
             yield sftp
         finally:
             sftp.close()
@@ -213,10 +507,11 @@ def get_sftp_session(hostname=None, username=None, key_filename=None, timeout=No
 @contextmanager
 def get_transport(hostname=None, username=None, key_filename=None, timeout=None, port=22):
     """
-    Create connection and return the transport object for this SSH connection.
+    Return the transport object of the pooled SSH connection.
 
     This can be used to perform lower-level tasks, like opening specific
-    kinds of channels.
+    kinds of channels. The transport is shared with other users of the connection,
+    so it must not be closed by the caller.
 
     :param hostname: The hostname of the server to establish connection. If
         it is :py:obj:`None` ``hostname`` from configuration's ``server`` section
@@ -235,18 +530,8 @@ def get_transport(hostname=None, username=None, key_filename=None, timeout=None,
     :type port: int
     :yield: :py:class:`paramiko.transport.Transport` object
     """
-    client = get_client(hostname, username, key_filename, timeout, port)
-    transport = client.get_transport()
-    try:
-        logger.debug(f"Instantiated Paramiko client {client._id}")
-        logger.debug(f"Instantiated Paramiko transport {transport.native_id}")
-        logger.info("Connected to [%s]", hostname)
-        yield transport
-    finally:
-        transport.close()
-        logger.debug(f"Destroyed Paramiko transport {transport.native_id}")
-        client.close()
-        logger.debug(f"Destroyed Paramiko client {client._id}")
+    with get_connection(hostname, username, key_filename, timeout, port) as connection:
+        yield connection.get_transport()
 
 
 @contextmanager
@@ -272,14 +557,16 @@ def get_channel(hostname=None, username=None, key_filename=None, timeout=None, p
     :yield: :py:class:`paramiko.channel.Channel` object
     """
     with get_transport(hostname, username, key_filename, timeout, port) as transport:
+        channel = transport.open_session()
         try:
-            channel = transport.open_session()
             yield channel
         finally:
             channel.close()
 
 
-def upload_file(local_file, remote_file, key_filename=None, hostname=None, username=None) -> None:
+def upload_file(
+    local_file, remote_file, key_filename=None, hostname=None, username=None, port=22, callback=None
+) -> None:
     """
     Upload a local file to a remote machine.
 
@@ -293,12 +580,15 @@ def upload_file(local_file, remote_file, key_filename=None, hostname=None, usern
         configuration's ``server`` section will be used.
     :param username: The username to use when connecting. If it is :py:obj:`None`
         ``ssh_username`` from configuration's ``server`` section will be used.
+    :param port: The server port to connect to, the default port is 22.
+    :param callback: function called as ``callback(transferred, total)`` with the number
+        of bytes transferred so far, see :py:meth:`paramiko.sftp_client.SFTPClient.put`.
     """
-    with get_sftp_session(hostname=hostname, username=username, key_filename=key_filename) as sftp:
-        _upload_file(sftp, local_file, remote_file)
+    with get_sftp_session(hostname=hostname, username=username, key_filename=key_filename, port=port) as sftp:
+        _upload_file(sftp, local_file, remote_file, callback)
 
 
-def _upload_file(sftp, local_file, remote_file) -> None:
+def _upload_file(sftp, local_file, remote_file, callback=None) -> None:
     """
     Upload a file using existent sftp session.
 
@@ -306,16 +596,17 @@ def _upload_file(sftp, local_file, remote_file) -> None:
     :param local_file: either a file path or a file-like object to be uploaded.
     :param remote_file: a remote file path where the uploaded file will be
         placed.
+    :param callback: function called with the number of bytes transferred so far and the total size.
     """
     # Check if local_file is a file-like object and use the proper
     # paramiko function to upload it to the remote machine.
     if hasattr(local_file, "read"):
-        sftp.putfo(local_file, remote_file)
+        sftp.putfo(local_file, remote_file, callback=callback)
     else:
-        sftp.put(local_file, remote_file)
+        sftp.put(local_file, remote_file, callback=callback)
 
 
-def download_file(remote_file, local_file=None, key_filename=None, hostname=None, username=None) -> None:
+def download_file(remote_file, local_file=None, key_filename=None, hostname=None, username=None, port=22) -> None:
     """
     Download a remote file to the local machine.
 
@@ -330,11 +621,12 @@ def download_file(remote_file, local_file=None, key_filename=None, hostname=None
         configuration's ``server`` section will be used.
     :param username: The username to use when connecting. If it is :py:obj:`None`
         ``ssh_username`` from configuration's ``server`` section will be used.
+    :param port: The server port to connect to, the default port is 22.
     """
     if local_file is None:  # pragma: no cover
         local_file = remote_file
     with get_connection(
-        hostname=hostname, username=username, key_filename=key_filename
+        hostname=hostname, username=username, key_filename=key_filename, port=port
     ) as connection:  # pragma: no cover
         try:
             sftp = connection.open_sftp()
@@ -352,6 +644,7 @@ def command(
     connection_timeout=None,
     port=22,
     background=False,
+    forward_agent=False,
 ) -> Union[None, SSHCommandResult]:
     """
     Execute SSH command(s) on remote hostname.
@@ -380,6 +673,9 @@ def command(
     :param background: Specifies whether the command should run in background.
         If the command is running in the background, no result will be returned.
     :type background: bool
+    :param forward_agent: Forward the local SSH agent to the command, so that it can connect further.
+        It is used only if the command is not running in the background.
+    :type forward_agent: bool
     :raises ValueError: if ``hostname`` argument is missing
     :return: :py:class:`SSHCommandResult` | :py:obj:`None` if ``background`` is :py:obj:`True`
     """
@@ -398,48 +694,270 @@ def command(
         with get_connection(
             hostname=hostname, username=username, key_filename=key_filename, timeout=connection_timeout, port=port
         ) as connection:
-            return execute_command(cmd, connection, timeout, connection_timeout)
+            return execute_command(cmd, connection, timeout, connection_timeout, forward_agent)
 
 
-def execute_command(cmd, connection, timeout=None, connection_timeout=None) -> SSHCommandResult:
-    """Execute a command via ssh in the given connection.
+def stream_command(
+    cmd,
+    hostname=None,
+    username=None,
+    key_filename=None,
+    timeout=None,
+    connection_timeout=None,
+    port=22,
+    callback=None,
+    spill_dir=None,
+    spill_threshold=None,
+    strip_ansi=False,
+) -> StreamedCommandResult:
+    """
+    Execute SSH command on remote hostname and capture its output with bounded memory.
 
-    :param cmd: a command to be executed via ssh
-    :param connection: SSH Paramiko client connection
+    Unlike :py:func:`command` the output is neither logged nor post-processed. Every chunk is passed
+    to the ``callback`` as soon as it is received and it is kept in memory only up to ``spill_threshold``
+    bytes per stream, the rest goes to ``<spill_dir>/<hostname>.stdout`` and ``<spill_dir>/<hostname>.stderr``.
+
+    :param cmd: The command to run
+    :type cmd: str
+    :param hostname: The hostname of the server to establish connection.
+    :type hostname: str
+    :param username: The username to use when connecting. If it is :py:obj:`None`
+        ``ssh_username`` from configuration's ``server`` section will be used.
+    :type username: str
+    :param key_filename: The path of the ssh private key to use when
+        connecting to the server. If it is :py:obj:`None` ``key_filename`` from
+        configuration's ``server`` section will be used.
+    :type key_filename: str
     :param timeout: Time to wait for the ssh command to finish.
+    :type timeout: int
     :param connection_timeout: Time to wait for establishing the connection.
-    :raises SSHCommandTimeoutError: if the command does not respond in time
-    :return: :py:class:`SSHCommandResult`
+    :type connection_timeout: int
+    :param port: The server port to connect to, the default port is 22.
+    :type port: int
+    :param callback: Function called as ``callback(hostname, stream, data)`` with ``stream`` being
+        ``stdout`` or ``stderr`` and ``data`` the received bytes.
+    :type callback: callable
+    :param spill_dir: Directory for the output exceeding the ``spill_threshold``. If it is :py:obj:`None`
+        only the last ``spill_threshold`` bytes of each stream are kept.
+    :type spill_dir: str
+    :param spill_threshold: Bytes of each stream kept in memory. If it is :py:obj:`None`
+        ``output_spill_threshold`` from configuration's ``remote_execution`` section will be used.
+    :type spill_threshold: int
+    :param strip_ansi: Remove ANSI escape sequences from the output.
+    :type strip_ansi: bool
+    :raises ValueError: if ``hostname`` argument is missing
+    :raises SSHCommandTimeoutError: if the command does not finish in time
+    :return: :py:class:`StreamedCommandResult`
     """
+    if hostname is None:
+        raise ValueError("Can not start SSH client. The 'hostname' argument is missing.")
     if timeout is None:
         timeout = COMMAND_TIMEOUT
     if connection_timeout is None:
         connection_timeout = CONNECTION_TIMEOUT
+    if spill_threshold is None:
+        spill_threshold = OUTPUT_SPILL_THRESHOLD
+    outputs = {
+        stream: CommandOutput(f"{spill_dir}/{hostname}.{stream}" if spill_dir else None, spill_threshold, strip_ansi)
+        for stream in ("stdout", "stderr")
+    }
+
+    def on_output(channel, is_stderr, data):  # noqa: U100
+        stream = "stderr" if is_stderr else "stdout"
+        data = outputs[stream].write(data)
+        if callback is not None:
+            callback(hostname, stream, data)
+
+    started_at = time.monotonic()
     logger.info(">>> %s", cmd)
-    _, stdout, stderr = connection.exec_command(cmd, timeout=connection_timeout)
-    if timeout:
-        # wait for the exit status ready
-        end_time = time.time() + timeout
-        while time.time() < end_time:
-            if stdout.channel.exit_status_ready():
-                break
-            time.sleep(1)
-        else:
-            logger.error(
-                "ssh command did not respond in the predefined time" " (timeout=%s) and will be interrupted", timeout
-            )
-            stdout.channel.close()
-            stderr.channel.close()
-            logger.error(f"[Captured stdout]\n{stdout.read()}\n-----\n")
-            logger.error(f"[Captured stderr]\n{stderr.read()}\n-----\n")
-            raise SSHCommandTimeoutError(
-                f"ssh command: {cmd} \n did not respond in the predefined time (timeout={timeout})"
-            )
-
-    errorcode = stdout.channel.recv_exit_status()
-
-    stdout = stdout.read()
-    stderr = stderr.read()
+    try:
+        with get_connection(
+            hostname=hostname, username=username, key_filename=key_filename, timeout=connection_timeout, port=port
+        ) as connection:
+            channel = connection.get_transport().open_session(timeout=connection_timeout)
+            channel.exec_command(cmd)
+            wait_for_channels([channel], timeout or None, on_output)
+            finished = channel.exit_status_ready()
+            channel.close()
+    finally:
+        for output in outputs.values():
+            output.close()
+    if not finished:
+        raise SSHCommandTimeoutError(
+            f"ssh command: {cmd} \n did not respond in the predefined time (timeout={timeout})"
+        )
+    duration = round(time.monotonic() - started_at, 3)
+    return StreamedCommandResult(outputs["stdout"], outputs["stderr"], channel.recv_exit_status(), duration)
+
+
+def pipe_file(
+    local_file,
+    cmd,
+    hostname=None,
+    username=None,
+    key_filename=None,
+    timeout=None,
+    connection_timeout=None,
+    port=22,
+    callback=None,
+    raw=False,
+) -> SSHCommandResult:
+    """
+    Execute SSH command on remote hostname with the content of the ``local_file`` on its standard input.
+
+    The file is streamed over the channel of the command, e.g. ``tar -xzf -`` unpacks the archive
+    as it is being uploaded. Output of the command is drained while the file is being sent,
+    so a command writing more than one window of output does not stop reading its input.
+
+    :param local_file: Either path of the file or a file-like object to be sent.
+    :type local_file: str
+    :param cmd: The command reading the file from its standard input.
+    :type cmd: str
+    :param hostname: The hostname of the server to establish connection.
+    :type hostname: str
+    :param username: The username to use when connecting. If it is :py:obj:`None`
+        ``ssh_username`` from configuration's ``server`` section will be used.
+    :type username: str
+    :param key_filename: The path of the ssh private key to use when
+        connecting to the server. If it is :py:obj:`None` ``key_filename`` from
+        configuration's ``server`` section will be used.
+    :type key_filename: str
+    :param timeout: Time to wait for the ssh command to finish once the whole file is sent,
+        and the longest time the sending can make no progress.
+    :type timeout: int
+    :param connection_timeout: Time to wait for establishing the connection.
+    :type connection_timeout: int
+    :param port: The server port to connect to, the default port is 22.
+    :type port: int
+    :param callback: Function called as ``callback(transferred, total)`` with the number of bytes sent so far.
+    :type callback: callable
+    :param raw: Return stdout and stderr as decoded strings, without removing any lines and without logging them,
+        e.g. when the output is parsed as JSON.
+    :type raw: bool
+    :raises ValueError: if ``hostname`` argument is missing
+    :raises SSHCommandTimeoutError: if the command does not finish in time or stops reading its input
+    :raises OSError: if the channel is closed before the command exits
+    :return: :py:class:`SSHCommandResult`
+    """
+    if hostname is None:
+        raise ValueError("Can not start SSH client. The 'hostname' argument is missing.")
+    if timeout is None:
+        timeout = COMMAND_TIMEOUT
+    if connection_timeout is None:
+        connection_timeout = CONNECTION_TIMEOUT
+    logger.info(">>> %s < %s", cmd, local_file)
+    with get_connection(
+        hostname=hostname, username=username, key_filename=key_filename, timeout=connection_timeout, port=port
+    ) as connection, ExitStack() as stack:
+        source = local_file if hasattr(local_file, "read") else stack.enter_context(open(local_file, "rb"))
+        position = source.tell()
+        total = source.seek(0, os.SEEK_END) - position
+        source.seek(position)
+        transferred = 0
+        output = {}
+        channel = connection.get_transport().open_session(timeout=connection_timeout)
+        # the blocking sends give up when the command does not read its input for the whole timeout
+        channel.settimeout(timeout or None)
+        try:
+            channel.exec_command(cmd)
+            # output is drained by another thread, the command must not block on a full window while it is sent data
+            drainer = threading.Thread(target=lambda: output.update(wait_for_channels([channel])), daemon=True)
+            drainer.start()
+            for chunk in iter(lambda: source.read(CHANNEL_READ_SIZE), b""):
+                # the command exited early, e.g. it could not create the destination, its status tells why
+                if channel.exit_status_ready():
+                    break
+                try:
+                    channel.sendall(chunk)
+                except socket.timeout:
+                    raise SSHCommandTimeoutError(
+                        f"ssh command: {cmd} \n did not read its input in the predefined time (timeout={timeout})"
+                    )
+                except OSError:
+                    if not channel.exit_status_ready():
+                        raise
+                    break
+                transferred += len(chunk)
+                if callback is not None:
+                    callback(transferred, total)
+            channel.shutdown_write()
+            drainer.join(timeout or None)
+            if drainer.is_alive():
+                raise SSHCommandTimeoutError(
+                    f"ssh command: {cmd} \n did not respond in the predefined time (timeout={timeout})"
+                )
+            stdout, stderr = output[channel]
+            if raw:
+                return SSHCommandResult(decode_to_utf8(stdout), decode_to_utf8(stderr), channel.recv_exit_status())
+            return _command_result(stdout, stderr, channel.recv_exit_status())
+        finally:
+            channel.close()
+
+
+def _channel_finished(channel) -> bool:
+    return channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready()
+
+
+def wait_for_channels(channels, timeout=None, on_output=None) -> Dict[paramiko.Channel, Tuple[bytes, bytes]]:
+    """
+    Wait until the commands running on all ``channels`` finish, draining their output meanwhile.
+
+    All channels are served by the calling thread. It sleeps in :py:func:`select.select` until one
+    of the channels receives data or is closed, so the command completion is noticed as soon as it
+    happens. Channels which already received EOF are waited for on their status event.
+    Output is drained continuously, so commands never block on a full SSH window.
+
+    :param channels: Channels with the commands already started.
+    :type channels: list
+    :param timeout: Time in seconds to wait for all the commands to finish, no limit if it is :py:obj:`None`.
+    :type timeout: float
+    :param on_output: Function called as ``on_output(channel, is_stderr, data)`` with every received chunk.
+        If it is set the output is passed only to it and is not kept in memory.
+    :type on_output: callable
+    :return: Dictionary mapping each channel to its stdout and stderr, both empty if ``on_output`` is set.
+        Channels whose command did not finish in time are left open and can be checked by ``exit_status_ready()``.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    output = {channel: ([], []) for channel in channels}
+    pending = set(channels)
+    while True:
+        for channel in list(pending):
+            stdout, stderr = output[channel]
+            while channel.recv_ready():
+                data = channel.recv(CHANNEL_READ_SIZE)
+                if on_output:
+                    on_output(channel, False, data)
+                else:
+                    stdout.append(data)
+            while channel.recv_stderr_ready():
+                data = channel.recv_stderr(CHANNEL_READ_SIZE)
+                if on_output:
+                    on_output(channel, True, data)
+                else:
+                    stderr.append(data)
+            if _channel_finished(channel):
+                pending.discard(channel)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if not pending or (remaining is not None and remaining <= 0):
+            break
+        # EOF keeps the channel readable forever, such channels only wait for the exit status
+        readable = [channel for channel in pending if not channel.eof_received]
+        if not readable:
+            next(iter(pending)).status_event.wait(remaining)
+            continue
+        select.select(readable, [], [], remaining)
+    return {channel: (b"".join(stdout), b"".join(stderr)) for channel, (stdout, stderr) in output.items()}
+
+
+def _command_result(stdout, stderr, errorcode) -> SSHCommandResult:
+    """
+    Build the result of the command from its raw output.
+
+    :param stdout: raw standard output of the command
+    :param stderr: raw standard error output of the command
+    :param errorcode: exit status of the command
+    :return: :py:class:`SSHCommandResult`
+    """
     # Remove escape code for colors displayed in the output
     regex = re.compile(r"\x1b\[\d\d?m")
     if stdout:
@@ -459,3 +977,40 @@ def execute_command(cmd, connection, timeout=None, connection_timeout=None) -> S
         stdout = "".join(stdout).split("\n")
         stdout = [regex.sub("", line) for line in stdout if not line.startswith("[")]
     return SSHCommandResult(stdout, stderr, errorcode)
+
+
+def execute_command(cmd, connection, timeout=None, connection_timeout=None, forward_agent=False) -> SSHCommandResult:
+    """Execute a command via ssh in the given connection.
+
+    :param cmd: a command to be executed via ssh
+    :param connection: SSH Paramiko client connection
+    :param timeout: Time to wait for the ssh command to finish.
+    :param connection_timeout: Time to wait for establishing the connection.
+    :param forward_agent: Forward the local SSH agent to the command.
+    :raises SSHCommandTimeoutError: if the command does not respond in time
+    :return: :py:class:`SSHCommandResult`
+    """
+    if timeout is None:
+        timeout = COMMAND_TIMEOUT
+    if connection_timeout is None:
+        connection_timeout = CONNECTION_TIMEOUT
+    logger.info(">>> %s", cmd)
+    channel = connection.get_transport().open_session(timeout=connection_timeout)
+    if forward_agent:
+        # the handler serves the agent requests of the channel until the channel is closed
+        paramiko.agent.AgentRequestHandler(channel)
+    channel.exec_command(cmd)
+    stdout, stderr = wait_for_channels([channel], timeout or None)[channel]
+    if not channel.exit_status_ready():
+        logger.error(
+            "ssh command did not respond in the predefined time" " (timeout=%s) and will be interrupted", timeout
+        )
+        channel.close()
+        logger.error(f"[Captured stdout]\n{stdout}\n-----\n")
+        logger.error(f"[Captured stderr]\n{stderr}\n-----\n")
+        raise SSHCommandTimeoutError(
+            f"ssh command: {cmd} \n did not respond in the predefined time (timeout={timeout})"
+        )
+    errorcode = channel.recv_exit_status()
+    channel.close()
+    return _command_result(stdout, stderr, errorcode)
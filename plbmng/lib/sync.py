@@ -0,0 +1,276 @@
+import hashlib
+import io
+import json
+import os
+import shlex
+import tempfile
+import threading
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from plbmng.lib import ssh as sshlib
+from plbmng.utils.config import get_db_path
+from plbmng.utils.config import settings
+from plbmng.utils.logger import logger
+
+# Files are compared in blocks of this size, only the blocks which are not on the node already are sent
+BLOCK_SIZE = 65536
+
+# Run on the node with JSON list of paths on stdin. Prints digest of each file and of each of its blocks,
+# null for the files which do not exist. Has to stay compatible with the Python 3 of the nodes.
+QUERY_SCRIPT = """
+import hashlib, json, sys
+block_size = int(sys.argv[1])
+digests = []
+for path in json.loads(sys.stdin.read()):
+    try:
+        with open(path, "rb") as f:
+            total, blocks = hashlib.sha256(), []
+            for block in iter(lambda: f.read(block_size), b""):
+                total.update(block)
+                blocks.append(hashlib.sha256(block).hexdigest())
+        digests.append([total.hexdigest(), blocks])
+    except (IOError, OSError):
+        digests.append(None)
+print(json.dumps({"files": digests}))
+"""
+
+# Run on the node with the patch on stdin: JSON header line followed by the literal blocks.
+# Each file is rebuilt from the blocks of its old version and the literal blocks, verified and moved in place.
+PATCH_SCRIPT = """
+import hashlib, json, os, sys
+block_size = int(sys.argv[1])
+stdin = sys.stdin.buffer
+for entry in json.loads(stdin.readline().decode("utf-8"))["files"]:
+    path = entry["path"]
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    old = open(path, "rb") if os.path.exists(path) else None
+    tmp_path = path + ".plbmng-sync"
+    digest = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        for i, source in enumerate(entry["blocks"]):
+            length = min(block_size, entry["size"] - i * block_size)
+            if source < 0:
+                block = stdin.read(length)
+            else:
+                old.seek(source * block_size)
+                block = old.read(length)
+            digest.update(block)
+            f.write(block)
+    if old is not None:
+        old.close()
+    if digest.hexdigest() != entry["sha256"]:
+        os.remove(tmp_path)
+        sys.exit("Checksum of %s does not match after the update" % path)
+    os.chmod(tmp_path, entry["mode"])
+    os.replace(tmp_path, path)
+"""
+
+
+class FileDigest:
+    """SHA-256 digest of a local file and of each of its :py:data:`BLOCK_SIZE` blocks."""
+
+    def __init__(self, path: str) -> None:
+        """
+        Construct object of FileDigest class.
+
+        :param path: Path of the local file.
+        """
+        self.path = path
+        self.mode = os.stat(path).st_mode & 0o7777
+        self.size = 0
+        self.blocks = []
+        total = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                total.update(block)
+                self.blocks.append(hashlib.sha256(block).hexdigest())
+                self.size += len(block)
+        self.sha256 = total.hexdigest()
+
+    def read_block(self, index: int) -> bytes:
+        """
+        Read the block of the file.
+
+        :param index: Index of the block.
+        :return: Content of the block.
+        """
+        with open(self.path, "rb") as f:
+            f.seek(index * BLOCK_SIZE)
+            return f.read(BLOCK_SIZE)
+
+    def __repr__(self):
+        return f"FileDigest(path={self.path!r}, size={self.size!r}, sha256={self.sha256!r})"
+
+
+class SyncManifest:
+    """Digests of the files last sent to each host, stored in the database directory.
+
+    Files whose digest matches the manifest are not compared with the node at all.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Construct object of SyncManifest class.
+
+        :param path: Path to the manifest file. If it is :py:obj:`None`
+            ``sync_manifest`` from configuration's ``database`` section will be used.
+        """
+        self.path = path or get_db_path("sync_manifest", failsafe=True)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as manifest_file:
+                self._hosts = json.load(manifest_file)
+        except (OSError, ValueError):
+            self._hosts = {}
+
+    def get(self, host: str, remote_path: str) -> Optional[str]:
+        """
+        Return digest of the file last sent to the ``host``.
+
+        :param host: Host name or IP address.
+        :param remote_path: Path of the file on the ``host``.
+        :return: SHA-256 digest, or :py:obj:`None` if the file was not sent to the ``host`` yet.
+        """
+        return self._hosts.get(host, {}).get(remote_path)
+
+    def update(self, host: str, digests: Dict[str, str]) -> None:
+        """
+        Record digests of the files which are now on the ``host`` and save the manifest.
+
+        :param host: Host name or IP address.
+        :param digests: Dictionary mapping paths of the files on the ``host`` to their SHA-256 digests.
+        """
+        with self._lock:
+            self._hosts.setdefault(host, {}).update(digests)
+            tmp_path = None
+            try:
+                # unique name, concurrent plbmng processes must not write into the same temporary file
+                with tempfile.NamedTemporaryFile(
+                    "w", dir=os.path.dirname(self.path) or ".", suffix=".tmp", delete=False
+                ) as manifest_file:
+                    tmp_path = manifest_file.name
+                    json.dump(self._hosts, manifest_file)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error("Could not write the sync manifest {}: {}", self.path, e)
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+def _python_command(script: str) -> str:
+    return f"python3 -c {shlex.quote(script)} {BLOCK_SIZE}"
+
+
+def _run_with_input(host: str, cmd: str, data, callback: Callable[[int, int], None] = None) -> str:
+    result = sshlib.pipe_file(
+        data,
+        cmd,
+        hostname=host,
+        username=settings.planetlab.slice,
+        key_filename=settings.remote_execution.ssh_key,
+        callback=callback,
+        raw=True,
+    )
+    if result.return_code != 0:
+        raise OSError(result.stderr.strip() or f"Command failed on {host} with exit code {result.return_code}")
+    return result.stdout
+
+
+def remote_digests(host: str, remote_paths: List[str]) -> List[Optional[Tuple[str, List[str]]]]:
+    """
+    Return digests of the files on the ``host``.
+
+    :param host: Host name or IP address.
+    :param remote_paths: Paths of the files on the ``host``.
+    :return: Digest of the whole file and the digests of its blocks for each of the ``remote_paths``,
+        :py:obj:`None` for the files which do not exist.
+    """
+    output = _run_with_input(host, _python_command(QUERY_SCRIPT), io.BytesIO(json.dumps(remote_paths).encode()))
+    return json.loads(output)["files"]
+
+
+def sync_host(
+    host: str,
+    files: Dict[str, FileDigest],
+    manifest: SyncManifest,
+    callback: Callable[[int, int], None] = None,
+) -> int:
+    """
+    Make the files on the ``host`` identical to the local ones, sending only the blocks the ``host`` does not have.
+
+    Files recorded in the ``manifest`` with the same digest are skipped without contacting the ``host``.
+    The other files are compared with the ``host`` by their block digests. Blocks are matched by content,
+    so an unchanged block is reused even if it moved to another block-aligned offset.
+    Unlike rsync the blocks are not matched at arbitrary offsets, an insertion in the middle of the file
+    resends the rest of the file.
+
+    :param host: Host name or IP address.
+    :param files: Dictionary mapping paths on the ``host`` to the digests of the local files.
+    :param manifest: Manifest of the files already on the hosts, it is updated after the sync.
+    :param callback: Function called as ``callback(done, total)`` with the number of bytes of the local
+        files synchronized so far.
+    :return: Number of bytes of the file content sent to the ``host``.
+    """
+    total = sum(digest.size for digest in files.values()) or 1
+    changed = [path for path, digest in files.items() if manifest.get(host, path) != digest.sha256]
+    if not changed:
+        logger.info("All {} files are up to date on {}", len(files), host)
+        if callback is not None:
+            callback(total, total)
+        return 0
+    header, literals = [], []
+    for path, remote in zip(changed, remote_digests(host, changed)):
+        local = files[path]
+        if remote is not None and remote[0] == local.sha256:
+            continue
+        old_blocks = {}
+        for index, block in enumerate(remote[1] if remote else []):
+            old_blocks.setdefault(block, index)
+        blocks = [old_blocks.get(block, -1) for block in local.blocks]
+        literals.extend((local, index) for index, source in enumerate(blocks) if source < 0)
+        header.append({"path": path, "size": local.size, "sha256": local.sha256, "mode": local.mode, "blocks": blocks})
+    sent = 0
+    if header:
+        with tempfile.SpooledTemporaryFile(max_size=sshlib.OUTPUT_SPILL_THRESHOLD) as patch:
+            patch.write(json.dumps({"files": header}).encode() + b"\n")
+            for local, index in literals:
+                block = local.read_block(index)
+                patch.write(block)
+                sent += len(block)
+            patch.seek(0)
+
+            def scaled(transferred: int, size: int) -> None:
+                if callback is not None:
+                    callback(total * transferred // (size or 1), total)
+
+            _run_with_input(host, _python_command(PATCH_SCRIPT), patch, scaled)
+    manifest.update(host, {path: files[path].sha256 for path in changed})
+    logger.info("Synchronized {} of {} files to {}, sent {} bytes", len(header), len(files), host, sent)
+    if callback is not None:
+        callback(total, total)
+    return sent
+
+
+def local_files(source_path: str, destination_path: str) -> Dict[str, FileDigest]:
+    """
+    Compute digests of the file or of all files in the directory to be synchronized.
+
+    :param source_path: Path of the local file or directory.
+    :param destination_path: Path of the file, or of the directory the content of the ``source_path``
+        directory is synchronized into, on the hosts.
+    :return: Dictionary mapping paths on the hosts to the digests of the local files.
+    """
+    if not os.path.isdir(source_path):
+        return {destination_path: FileDigest(source_path)}
+    files = {}
+    for root, _, names in os.walk(source_path):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                files[os.path.join(destination_path, os.path.relpath(path, source_path))] = FileDigest(path)
+    return files
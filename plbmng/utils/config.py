@@ -3,6 +3,7 @@ from pathlib import Path
 
 from dynaconf import Dynaconf
 from dynaconf import loaders
+from dynaconf import Validator
 
 from plbmng.executor import ensure_basic_structure
 from plbmng.utils.logger import logger
@@ -85,12 +86,40 @@ def ensure_settings_file() -> None:
 
         base_settings = {
             "planetlab": {"SLICE": "", "USERNAME": "", "PASSWORD": ""},
-            "remote_execution": {"SSH_KEY": "", "CONNECTION_TIMEOUT": 30, "COMMAND_TIMEOUT": 60},
+            "remote_execution": {
+                "SSH_KEY": "",
+                "CONNECTION_TIMEOUT": 30,
+                "COMMAND_TIMEOUT": 60,
+                "POOL_MAX_CONNECTIONS": 256,
+                "POOL_IDLE_TIMEOUT": 300,
+                "CONCURRENCY": 100,
+                "OUTPUT_SPILL_THRESHOLD": 1048576,
+                "COPY_RETRIES": 3,
+                "COPY_RETRY_DELAY": 1,
+                "RELAY_FANOUT": 3,
+                "RELAY_KEY": "",
+                "RELAY_TIMEOUT": 3600,
+                "EXECUTOR_CONCURRENCY": 4,
+                "EXECUTOR_FSYNC": False,
+                "ARTEFACT_MAX_SIZE": 0,
+                "COMPRESS_ARTEFACTS": False,
+            },
+            "monitoring": {
+                "CONCURRENCY": 200,
+                "PROBE_TIMEOUT": 2,
+                "SSH_TIMEOUT": 15,
+                "BATCH_SIZE": 250,
+                "DNS_TTL": 21600,
+                "DNS_NEGATIVE_TTL": 3600,
+            },
             "database": {
                 "USER_NODES": "user_servers.node",
                 "LAST_SERVER": "last_server.node",
                 "PLBMNG_DATABASE": "internal.db",
                 "DEFAULT_NODE": "default.node",
+                "DNS_CACHE": "dns_cache.json",
+                "GEOCODE_CACHE": "geocode_cache.json",
+                "SYNC_MANIFEST": "sync_manifest.json",
             },
             "geolocation": {"map_file": "plbmng_server_map.html"},
             "first_run": True,
@@ -208,6 +237,29 @@ validators = [
     # TODO: Use Dynaconf validators to validate settings
     # Ensure some parameters exists (are required)
     # Ensure that each DB file exists
+    # Provide defaults for the settings introduced after the settings file was created
+    Validator("monitoring.concurrency", default=200),
+    Validator("monitoring.probe_timeout", default=2),
+    Validator("monitoring.ssh_timeout", default=15),
+    Validator("monitoring.batch_size", default=250),
+    Validator("monitoring.dns_ttl", default=21600),
+    Validator("monitoring.dns_negative_ttl", default=3600),
+    Validator("database.dns_cache", default="dns_cache.json"),
+    Validator("database.geocode_cache", default="geocode_cache.json"),
+    Validator("database.sync_manifest", default="sync_manifest.json"),
+    Validator("remote_execution.pool_max_connections", default=256),
+    Validator("remote_execution.pool_idle_timeout", default=300),
+    Validator("remote_execution.concurrency", default=100),
+    Validator("remote_execution.output_spill_threshold", default=1048576),
+    Validator("remote_execution.copy_retries", default=3),
+    Validator("remote_execution.copy_retry_delay", default=1),
+    Validator("remote_execution.relay_fanout", default=3),
+    Validator("remote_execution.relay_key", default=""),
+    Validator("remote_execution.relay_timeout", default=3600),
+    Validator("remote_execution.executor_concurrency", default=4),
+    Validator("remote_execution.executor_fsync", default=False),
+    Validator("remote_execution.artefact_max_size", default=0),
+    Validator("remote_execution.compress_artefacts", default=False),
 ]
 
 ensure_settings_file()